@@ -0,0 +1,378 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 ScyllaDB
+#
+
+#
+# This file is part of Scylla.
+#
+# Scylla is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Scylla is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Scylla.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from __future__ import absolute_import, division, print_function
+
+import contextlib
+import io
+import traceback
+
+from ansible.module_utils.basic import AnsibleModule, missing_required_lib
+from ansible.module_utils.common.text.converters import to_native
+
+try:
+    from ansible.module_utils import perftune
+    # perftune imports them only where they are used
+    import pyudev  # noqa: F401
+    import yaml  # noqa: F401
+    HAS_PERFTUNE = True
+    PERFTUNE_IMPORT_ERROR = None
+except ImportError:
+    HAS_PERFTUNE = False
+    PERFTUNE_IMPORT_ERROR = traceback.format_exc()
+
+__metaclass__ = type
+
+DOCUMENTATION = r'''
+---
+module: scylla_perftune
+short_description: Tunes IRQs, NICs, disks and kernel parameters for a seastar application
+description:
+- Computes the perftune tuning plan for the given NICs, disks and directories, compares it with the current
+  system state and rewrites only what differs from it.
+- Reports C(changed) only when something has really been rewritten. Supports check mode and C(--diff).
+- Requires pyudev and PyYAML on the target.
+options:
+  mode:
+    description:
+    - Configuration mode. Computed from the host's topology and the NICs' speeds when not given.
+    - One of C(mq), C(sq), C(sq_split), C(sq_split_2numa) or a parametric mode reserving N cores or M hyperthreads
+      for IRQs on every NUMA node (or, with C(:local), on the nodes of the tuned devices only), e.g. C(irq_cores:2)
+      or C(irq_threads:4:local).
+    type: str
+  nics:
+    description:
+    - Network interfaces to tune, optionally with their own configuration mode, e.g. C(eth0:sq_split). The IRQ CPUs
+      are split between them and irqbalance is configured once for all of them.
+    type: list
+    elements: str
+    default: []
+  dirs:
+    description:
+    - Directories whose disks are going to be tuned.
+    type: list
+    elements: str
+    default: []
+  devs:
+    description:
+    - Block devices to tune, e.g. nvme0n1.
+    type: list
+    elements: str
+    default: []
+  cpu_mask:
+    description:
+    - Mask of the CPUs to use, all CPUs by default.
+    type: str
+  tune:
+    description:
+    - Components to tune.
+    type: list
+    elements: str
+    choices: [ net, disks ]
+  options_file:
+    description:
+    - perftune configuration YAML file, e.g. /etc/scylla.d/perftune.yaml. The options above override its values.
+    type: path
+  nic_settings:
+    description:
+    - Also tune the NICs' ring sizes, combined channels, interrupt coalescing and offloads.
+    type: bool
+    default: false
+  extra_args:
+    description:
+    - Additional perftune command line arguments.
+    type: list
+    elements: str
+    default: []
+  plan:
+    description:
+    - A tuning plan file on the target created with perftune's C(--plan), e.g. computed once per hardware class from
+      a C(--capture) archive. It's applied instead of computing a plan on the host, only if the host's hardware
+      fingerprint matches the plan's one. The tuning options above are ignored and no facts are returned then.
+    type: path
+author:
+- ScyllaDB
+'''
+
+EXAMPLES = r'''
+---
+- name: Tune the loader's NIC
+  scylla_perftune:
+    mode: mq
+    nics:
+      - eth0
+    tune:
+      - net
+  become: true
+
+- name: Tune the client and the internode NICs together
+  scylla_perftune:
+    nics:
+      - eth0
+      - eth1:sq_split
+    tune:
+      - net
+  become: true
+
+- name: Enforce the tuning of a Scylla node
+  scylla_perftune:
+    options_file: /etc/scylla.d/perftune.yaml
+  become: true
+
+- name: Apply a plan computed on the controller from a captured host of the same hardware class
+  scylla_perftune:
+    plan: /etc/scylla.d/perftune-plan.json
+  become: true
+'''
+
+RETURN = r'''
+ansible_facts:
+  description: The computed CPU sets
+  returned: success, unless a plan is given
+  type: complex
+  contains:
+    scylla_perftune:
+      description: The mode, the compute CPU set, the IRQ CPU set, the tuned IRQs of every component, the IRQ CPUs of
+        every NIC and the cloud instance
+      type: dict
+      sample:
+        mode: sq_split
+        compute_cpu_mask: '0x000000fe'
+        compute_cpus: '1-7'
+        irq_cpu_mask: '0x00000001'
+        irq_cpus: '0'
+        irqs:
+          net: ['45', '46', '47']
+        nics:
+          eth0:
+            irq_cpus: '0'
+        instance:
+          cloud: aws
+          instance_type: i3en.2xlarge
+          profile: aws-i3en
+drifted:
+  description: The items of the plan that differed from the system state before the module ran
+  returned: always
+  type: list
+  sample: [{'category': 'irq', 'target': '/proc/irq/45/smp_affinity', 'expected': '0', 'current': '0-7'}]
+summary:
+  description: The numbers of the changed, unchanged and failed plan steps
+  returned: when not in check mode
+  type: dict
+  sample: {'changed': 2, 'unchanged': 40, 'failed': 0}
+'''
+
+
+def perftune_cli(params):
+    """
+    Build the perftune command line from the module parameters.
+    """
+    cli = []
+
+    if params['mode']:
+        cli += ['--mode', params['mode']]
+
+    for nic in params['nics']:
+        cli += ['--nic', nic]
+
+    for directory in params['dirs']:
+        cli += ['--dir', directory]
+
+    for dev in params['devs']:
+        cli += ['--dev', dev]
+
+    for tune in params['tune'] or []:
+        cli += ['--tune', tune]
+
+    if params['cpu_mask']:
+        cli += ['--cpu-mask', params['cpu_mask']]
+
+    if params['options_file']:
+        cli += ['--options-file', params['options_file']]
+
+    if params['nic_settings']:
+        cli.append('--nic-settings')
+
+    return cli + params['extra_args']
+
+
+def drift_diff(drifted):
+    """
+    Render the drifted items as the before/after texts of the module's diff.
+    """
+    before = ''
+    after = ''
+    for item in drifted:
+        line = "{category} {target}: {{}}\n".format(**item)
+        before += line.format(item['current'])
+        after += line.format(item['expected'])
+
+    return {'before': before, 'after': after}
+
+
+def tuning_facts(tuners):
+    """
+    Describe the computed CPU sets and the recognized cloud instance: the masks are the same in all tuners, every NIC
+    has its own share of the IRQ CPUs.
+    """
+    compute_cpu_mask = tuners[0].compute_cpu_mask
+    irq_cpu_mask = tuners[0].irqs_cpu_mask
+    instance = perftune.cloud_instance()
+
+    irqs = {}
+    for tuner in tuners:
+        irqs.setdefault('net' if isinstance(tuner, perftune.NetPerfTuner) else 'disks', []).extend(tuner.irqs)
+
+    return {
+        'mode': tuners[0].mode.name,
+        'compute_cpu_mask': compute_cpu_mask.to_hwloc_str(),
+        'compute_cpus': compute_cpu_mask.to_list_str(),
+        'irq_cpu_mask': irq_cpu_mask.to_hwloc_str(),
+        'irq_cpus': irq_cpu_mask.to_list_str(),
+        'irqs': { component: sorted(component_irqs, key=lambda irq: (len(irq), irq)) for component, component_irqs in irqs.items() },
+        'nics': {
+            tuner.nic: {'irq_cpus': tuner.nic_irqs_cpu_mask.to_list_str()}
+            for tuner in tuners if isinstance(tuner, perftune.NetPerfTuner)
+        },
+        'instance': {
+            'cloud': instance.cloud,
+            'instance_type': instance.instance_type,
+            'profile': instance.profile_name,
+        },
+    }
+
+
+def apply_plan_file(module, result, out):
+    """
+    Check or apply the given plan file after verifying the host's hardware fingerprint.
+    """
+    try:
+        with contextlib.redirect_stdout(out):
+            plan = perftune.TuningPlan.load(module.params['plan'])
+            perftune.verify_fingerprint(plan)
+            result['drifted'] = plan.check()['drifted']
+
+            if result['drifted'] and not module.check_mode:
+                result['summary'] = plan.apply()
+    except Exception as e:
+        module.fail_json(msg="Failed to tune the system: {}".format(to_native(e)),
+                         stdout=out.getvalue(), exception=traceback.format_exc(), **result)
+
+    finish(module, result, out)
+
+
+def finish(module, result, out):
+    """
+    Set the changed status and the diff of the result and exit.
+    """
+    if module.check_mode:
+        result['changed'] = bool(result['drifted'])
+    elif 'summary' in result:
+        result['changed'] = result['summary']['changed'] > 0
+        if result['summary']['failed']:
+            module.warn("{} tuning steps failed, see stdout for details".format(result['summary']['failed']))
+
+    if module._diff:
+        result['diff'] = drift_diff(result['drifted'])
+
+    result['stdout'] = out.getvalue()
+    module.exit_json(**result)
+
+
+def run_module():
+    module_args = dict(
+        mode=dict(type='str'),
+        nics=dict(type='list', elements='str', default=[]),
+        dirs=dict(type='list', elements='str', default=[]),
+        devs=dict(type='list', elements='str', default=[]),
+        cpu_mask=dict(type='str'),
+        tune=dict(type='list', elements='str', choices=['net', 'disks']),
+        options_file=dict(type='path'),
+        nic_settings=dict(type='bool', default=False),
+        extra_args=dict(type='list', elements='str', default=[]),
+        plan=dict(type='path'),
+    )
+
+    module = AnsibleModule(
+        argument_spec=module_args,
+        supports_check_mode=True
+    )
+
+    if not HAS_PERFTUNE:
+        module.fail_json(msg=missing_required_lib('pyudev and PyYAML'), exception=PERFTUNE_IMPORT_ERROR)
+
+    result = dict(
+        changed=False,
+        drifted=[],
+    )
+
+    out = io.StringIO()
+    if module.params['plan']:
+        apply_plan_file(module, result, out)
+    try:
+        # perftune's argument parser reports errors with sys.exit()
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(out):
+            args = perftune.argp.parse_args(perftune_cli(module.params))
+    except SystemExit:
+        module.fail_json(msg="Bad perftune arguments: {}".format(out.getvalue().strip()), **result)
+
+    if not args.tune and not args.options_file:
+        module.fail_json(msg="At least one component to tune MUST be given", **result)
+
+    try:
+        with contextlib.redirect_stdout(out):
+            perftune.prepare_args(args)
+            tuners = perftune.create_tuners(args)
+
+            nic_plan = perftune.TuningPlan()
+            if args.nic_settings:
+                for tuner in tuners:
+                    if isinstance(tuner, perftune.NetPerfTuner):
+                        tuner.plan_nic_settings(nic_plan)
+
+            plan = perftune.plan_tuning(args, tuners)
+            result['drifted'] = nic_plan.check()['drifted'] + plan.check()['drifted']
+
+            if result['drifted'] and not module.check_mode:
+                summary = {'changed': 0, 'unchanged': 0, 'failed': 0}
+                if args.nic_settings:
+                    # Changing the NICs' channels changes their IRQs - the plan has to be computed again
+                    tuners, summary = perftune.apply_nic_settings(args, tuners)
+                    plan = perftune.plan_tuning(args, tuners)
+
+                plan_summary = perftune.apply_tuning(args, tuners, plan)
+                result['summary'] = {key: summary[key] + plan_summary[key] for key in summary}
+    except Exception as e:
+        module.fail_json(msg="Failed to tune the system: {}".format(to_native(e)),
+                         stdout=out.getvalue(), exception=traceback.format_exc(), **result)
+
+    result['ansible_facts'] = {'scylla_perftune': tuning_facts(tuners)}
+    finish(module, result, out)
+
+
+def main():
+    run_module()
+
+
+if __name__ == '__main__':
+    main()
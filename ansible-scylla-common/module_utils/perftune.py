@@ -0,0 +1,4901 @@
+#!/usr/bin/python3
+
+import abc
+import argparse
+import atexit
+import contextlib
+import ctypes
+import enum
+import errno
+import fcntl
+import functools
+import glob
+import hashlib
+import io
+import itertools
+import json
+import os
+import pathlib
+import re
+import shlex
+import shutil
+import socket
+import struct
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+
+# pyudev, yaml and concurrent.futures are imported where they are used: they dominate the
+# start-up time and e.g. --get-cpu-mask usually needs none of them.
+
+def run_one_command(prog_args, my_stderr=None, check=True):
+    proc = subprocess.Popen(prog_args, stdout = subprocess.PIPE, stderr = my_stderr)
+    outs, errs = proc.communicate()
+    outs = str(outs, 'utf-8')
+
+    if check and proc.returncode != 0:
+        raise subprocess.CalledProcessError(returncode=proc.returncode, cmd=" ".join(prog_args), output=outs, stderr=errs)
+
+    return outs
+
+# The root directory of the system files perftune reads and writes (/sys, /proc, /dev and /etc): '/' on a real host or
+# a synthetic tree (see perftune_fixture.py) given with --root. Paths are always passed around as host paths, e.g.
+# /proc/irq/45/smp_affinity, and are mapped under the root only when they are accessed.
+sysroot = '/'
+
+def set_sysroot(root):
+    """
+    Set the root directory of the system files and forget everything learned under the previous one. The root may
+    be a --capture archive too: it's extracted into a temporary directory then.
+    """
+    global sysroot
+    sysroot = os.path.abspath(extract_snapshot(root) if os.path.isfile(root) else root)
+
+    for learned in (irq_is_managed, managed_irqs_debugfs_available, learned_managed_irqs, interrupt_table, irq_load, cpu_topology, ethtool, cloud_instance):
+        learned.cache_clear()
+
+def host_path(path):
+    """
+    Returns the given host path under the root, e.g. /proc/interrupts -> /tmp/fake/proc/interrupts.
+    """
+    if host_snapshot is not None:
+        host_snapshot.record(path)
+
+    if sysroot == '/':
+        return path
+
+    return os.path.join(sysroot, os.path.relpath(path, '/'))
+
+def from_host_path(path):
+    """
+    Returns the host path of the given path under the root: the reverse of host_path().
+    """
+    if sysroot == '/':
+        return path
+
+    return os.path.join('/', os.path.relpath(path, sysroot))
+
+def host_exists(path):
+    return os.path.exists(host_path(path))
+
+def host_glob(pattern):
+    """
+    glob.glob() of the given host path pattern: host paths are returned.
+    """
+    return [ from_host_path(path) for path in glob.glob(host_path(pattern)) ]
+
+def host_realpath(path):
+    """
+    Returns the host path the given host path resolves to, e.g. /sys/class/block/sda ->
+    /sys/devices/pci0000:00/0000:00:1f.2/ata1/host0/target0:0:0/0:0:0:0/block/sda.
+    """
+    return from_host_path(os.path.realpath(host_path(path)))
+
+# The HostSnapshot recording the system files perftune accesses while a --capture is in progress, None otherwise
+host_snapshot = None
+
+def is_live_host():
+    """
+    Returns True if the system files are the running host's ones and they are not being captured: udev, ethtool
+    ioctls and the files cached in /run are only used then since they can't be replayed from a root.
+    """
+    return sysroot == '/' and host_snapshot is None
+
+class HostSnapshot:
+    """
+    Records the system files perftune accesses while learning the host and stores them in a tar.gz archive
+    (--capture). Extracted, the archive is a root (see --root) the same plan is computed for on another machine.
+
+    Paths are recorded when they are mapped with host_path() and when files under /sys, /proc, /dev or /etc are
+    opened or listed (audit events): e.g. CpuTopology opens the files of the directories it's given directly. The
+    recorded files are archived with their contents, the symlinks on the way to them are archived as symlinks, and
+    the entries of the listed directories as empty files and directories. Device nodes become empty files.
+    """
+    __audit_events = ('open', 'os.listdir', 'os.scandir')
+    __audited_dirs = ('/sys', '/proc', '/dev', '/etc')
+    __hook_installed = False
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__paths = set()
+        self.__listed_dirs = set()
+        self.__members = {}
+
+        if not HostSnapshot.__hook_installed:
+            # Audit hooks can't be removed: a single one forwards the events to the active snapshot
+            sys.addaudithook(HostSnapshot.__audit)
+            HostSnapshot.__hook_installed = True
+
+#### Public methods ############################
+    def __enter__(self):
+        global host_snapshot
+        host_snapshot = self
+        return self
+
+    def __exit__(self, *exc_info):
+        global host_snapshot
+        host_snapshot = None
+        return False
+
+    def record(self, path, listed=False):
+        """
+        Record the given host path: the entries of a listed directory are archived too.
+        """
+        with self.__lock:
+            (self.__listed_dirs if listed else self.__paths).add(path)
+
+    def write(self, archive):
+        """
+        Store the recorded files into the given tar.gz archive.
+        """
+        for path in sorted(self.__paths | self.__listed_dirs):
+            self.__add(path)
+
+        for directory in sorted(self.__listed_dirs):
+            directory = host_realpath(directory)
+            try:
+                names = os.listdir(host_path(directory))
+            except OSError:
+                continue
+
+            for name in names:
+                self.__add(os.path.join(directory, name), content=False)
+
+        with tarfile.open(archive, 'w:gz') as tar:
+            for name in sorted(self.__members):
+                info, data = self.__members[name]
+                tar.addfile(info, io.BytesIO(data) if data is not None else None)
+
+#### Private methods ############################
+    @staticmethod
+    def __audit(event, args):
+        snapshot = host_snapshot
+        if snapshot is None or event not in HostSnapshot.__audit_events or not isinstance(args[0], str):
+            return
+
+        path = os.path.abspath(args[0])
+        if sysroot != '/':
+            if os.path.commonpath([sysroot, path]) != sysroot:
+                return
+            path = from_host_path(path)
+
+        if any(path == top or path.startswith(top + '/') for top in HostSnapshot.__audited_dirs):
+            snapshot.record(path, listed=event != 'open')
+
+    def __add(self, path, content=True):
+        """
+        Add the member of the given host path and the symlinks on the way to it: the path is resolved component by
+        component so that every member is stored under its real path.
+        """
+        resolved = '/'
+        for part in pathlib.PurePath(path).parts[1:]:
+            current = os.path.join(resolved, part)
+            if not os.path.islink(host_path(current)):
+                resolved = current
+                continue
+
+            if current not in self.__members:
+                target = os.readlink(host_path(current))
+                if os.path.isabs(target):
+                    target = os.path.relpath(target, os.path.dirname(current))
+
+                info = tarfile.TarInfo(os.path.relpath(current, '/'))
+                info.type = tarfile.SYMTYPE
+                info.linkname = target
+                self.__members[current] = (info, None)
+
+                # The target may be reached through other symlinks
+                self.__add(os.path.normpath(os.path.join(os.path.dirname(current), target)), content=False)
+
+            resolved = host_realpath(current)
+
+        self.__add_node(resolved, content)
+
+    def __add_node(self, path, content):
+        real_path = host_path(path)
+        if not os.path.exists(real_path) or (path in self.__members and (not content or os.path.isdir(real_path))):
+            return
+
+        info = tarfile.TarInfo(os.path.relpath(path, '/') if path != '/' else '.')
+        data = None
+        if os.path.isdir(real_path):
+            info.type = tarfile.DIRTYPE
+            info.mode = 0o755
+        else:
+            data = b''
+            if content and os.path.isfile(real_path):
+                try:
+                    with open(real_path, 'rb') as f:
+                        data = f.read()
+                except OSError:
+                    pass
+
+            info.mode = 0o644
+            info.size = len(data)
+
+        self.__members[path] = (info, data)
+
+def extract_snapshot(archive):
+    """
+    Extracts the given --capture archive into a temporary directory removed at exit and returns the directory.
+    """
+    root = tempfile.mkdtemp(prefix='perftune-root-')
+    atexit.register(shutil.rmtree, root, True)
+
+    with tarfile.open(archive, 'r:*') as tar:
+        # Refuse absolute paths and links out of the root where the extraction filters are supported
+        tar.extractall(root, **({'filter': 'data'} if hasattr(tarfile, 'data_filter') else {}))
+
+    return root
+
+def fwriteln(fname, line, log_message, log_errors=True, raise_errnos=()):
+    """
+    Returns True if the line has been written successfully and False otherwise. OSErrors with one of the given
+    errnos are raised instead.
+    """
+    try:
+        with open(host_path(fname), 'w') as f:
+            f.write(line)
+
+        print(log_message)
+        return True
+    except Exception as e:
+        if isinstance(e, OSError) and e.errno in raise_errnos:
+            raise
+
+        if log_errors:
+            print("{}: failed to write into {}: {}".format(log_message, fname, sys.exc_info()))
+
+        return False
+
+def readlines(fname):
+    try:
+        with open(host_path(fname), 'r') as f:
+            return f.readlines()
+    except:
+        print("Failed to read {}: {}".format(fname, sys.exc_info()))
+        return []
+
+def read_one_line(fname):
+    """
+    Returns the first line of the given file without the trailing new line or None if the file can't be read.
+    """
+    try:
+        with open(host_path(fname), 'r') as f:
+            return f.readline().rstrip('\n')
+    except:
+        return None
+
+def fwriteln_and_log(fname, line, log_errors=True):
+    msg = "Writing '{}' to {}".format(line, fname)
+    return fwriteln(fname, line, log_message=msg, log_errors=log_errors)
+
+def set_one_mask(conf_file, mask, log_errors=True, raise_errnos=()):
+    """
+    Write the given CpuMask into the given configuration file (e.g. smp_affinity or rps_cpus) in the kernel
+    "Mask Format".
+    """
+    if not host_exists(conf_file):
+        raise Exception("Configure file to set mask doesn't exist: {}".format(conf_file))
+    mask = mask.to_mask_str()
+
+    msg = "Setting mask {} in {}".format(mask, conf_file)
+    return fwriteln(conf_file, mask, log_message=msg, log_errors=log_errors, raise_errnos=raise_errnos)
+
+def sysctl_path(key):
+    """
+    Returns the /proc/sys file name of the given kernel parameter, e.g. net.core.somaxconn -> /proc/sys/net/core/somaxconn
+    """
+    return os.path.join('/proc/sys', *key.split('.'))
+
+def directory_mount(directory):
+    """
+    Returns the (device number, source) of the mount the given directory is on, learned from /proc/self/mountinfo. The
+    source is what is mounted, e.g. /dev/md0 or, for file systems stacked on a directory like ecryptfs, that directory.
+    """
+    def unescape(field):
+        # spaces, tabs, newlines and backslashes are octal escapes, e.g. \040
+        return re.sub(r"\\([0-7]{3})", lambda m: chr(int(m.group(1), 8)), field)
+
+    # "<id> <parent id> <major>:<minor> <root> <mount point> <options> [<optional fields>...] - <type> <source> ...":
+    # the longest mount point the directory is under wins
+    mount = None
+    for line in readlines('/proc/self/mountinfo'):
+        fields = line.split()
+        separator = fields.index('-', 5) if '-' in fields[5:] else len(fields)
+        if separator + 2 >= len(fields):
+            continue
+
+        mount_point = unescape(fields[4])
+        if directory == mount_point or directory.startswith(mount_point.rstrip('/') + '/'):
+            if mount is None or len(mount_point) > len(mount[0]):
+                mount = (mount_point, fields[2], unescape(fields[separator + 2]))
+
+    if mount is None:
+        raise LookupError("{} is not mounted".format(directory))
+
+    major, minor = mount[1].split(':')
+    return os.makedev(int(major), int(minor)), mount[2]
+
+def directory_device_number(directory):
+    """
+    Returns the device number of the file system the given directory is on. Under a synthetic root it's learned from
+    /proc/self/mountinfo since the directory's own st_dev is the one of the file system the root is on.
+    """
+    if is_live_host():
+        return os.stat(directory).st_dev
+
+    return directory_mount(directory)[0]
+
+def nic_speed(iface):
+    """
+    Returns the link speed of the given interface in Mb/s or None if it's not known (e.g. the link is down or it's a
+    virtual NIC).
+    """
+    speed = read_one_line("/sys/class/net/{}/speed".format(iface))
+    if speed is None or not speed.strip().isdigit():
+        return None
+
+    return int(speed)
+
+def nic_driver(iface):
+    """
+    Returns the driver name of the given interface from its /sys/class/net/<iface>/device/driver symlink or None if
+    it's not known, e.g. for virtual interfaces.
+    """
+    driver_link = "/sys/class/net/{}/device/driver".format(iface)
+    return os.path.basename(host_realpath(driver_link)) if host_exists(driver_link) else None
+
+def bdp_bytes(speed, rtt_ms=10):
+    """
+    Returns the bandwidth-delay product in bytes of a link of the given speed (in Mb/s) with the given round trip time.
+    """
+    return speed * 125 * rtt_ms
+
+def read_numa_node(sys_dev_dir):
+    """
+    Returns the NUMA node of the given device (e.g. /sys/class/net/eth0/device) or None if it's not known.
+    """
+    numa_node = read_one_line(os.path.join(sys_dev_dir, 'numa_node'))
+    if numa_node is None or not numa_node.strip().isdigit():
+        return None
+
+    return int(numa_node)
+
+def numa_local_mask(cpu_mask, numa_node):
+    """
+    Returns the CPUs of the given mask that belong to the given NUMA node or the whole mask if there are no such CPUs
+    or the node is not known.
+    """
+    if numa_node is None:
+        return cpu_mask
+
+    return (cpu_mask & cpu_topology().numa_nodes.get(numa_node, CpuMask())) or cpu_mask
+
+# The kernel managed IRQs learned from their failed smp_affinity writes are cached in this file until the next boot
+managed_irqs_cache_file = '/run/perftune-managed-irqs.json'
+
+@functools.lru_cache(maxsize=None)
+def managed_irqs_debugfs_available():
+    """
+    Returns True if the IRQs' debugfs (CONFIG_GENERIC_IRQ_DEBUGFS and a mounted debugfs) is available.
+    """
+    return host_exists("/sys/kernel/debug/irq/irqs")
+
+@functools.lru_cache(maxsize=None)
+def learned_managed_irqs():
+    """
+    Returns the map of the kernel managed IRQs learned from their failed smp_affinity writes to their actions: the
+    ones cached in /run on a live host and the ones learned during this run (see learn_managed_irq()).
+    """
+    if is_live_host():
+        try:
+            with open(managed_irqs_cache_file, 'r') as f:
+                cached = json.load(f)
+
+            if isinstance(cached, dict):
+                return cached
+        except (OSError, ValueError):
+            pass
+
+    return {}
+
+def learn_managed_irq(irq):
+    """
+    Remember that the affinity of the given IRQ is managed by the kernel - writing its smp_affinity has failed with
+    EIO. The IRQ is remembered with its actions: IRQ numbers are reused when drivers are reloaded.
+    """
+    interrupts = interrupt_table()
+    learned_managed_irqs()[irq] = interrupts.actions(irq) if irq in interrupts else []
+    irq_is_managed.cache_clear()
+
+    if is_live_host():
+        try:
+            with open(managed_irqs_cache_file, 'w') as f:
+                json.dump(learned_managed_irqs(), f)
+        except OSError:
+            pass
+
+@functools.lru_cache(maxsize=None)
+def irq_is_managed(irq):
+    """
+    Returns True if the affinity of the given IRQ is managed by the kernel (IRQD_AFFINITY_MANAGED, e.g. NVMe and many
+    multi-queue NICs' vectors on modern kernels): writing its smp_affinity fails with EIO.
+
+    This is learned from the IRQs' debugfs if it's available. Otherwise the IRQs whose smp_affinity writes have failed
+    with EIO (see learn_managed_irq()) are the managed ones.
+    """
+    if not managed_irqs_debugfs_available():
+        interrupts = interrupt_table()
+        learned = learned_managed_irqs()
+        return irq in learned and irq in interrupts and learned[irq] == interrupts.actions(irq)
+
+    try:
+        with open(host_path("/sys/kernel/debug/irq/irqs/{}".format(irq)), 'r') as f:
+            return any('AFFINITY_MANAGED' in line for line in f)
+    except:
+        return False
+
+def irq_affinity(irq, effective=False):
+    """
+    Returns the CpuMask the given IRQ is allowed to run on (smp_affinity_list) or, if effective is True, the one the
+    kernel has actually applied (effective_affinity_list). None is returned if it's not known.
+    """
+    line = read_one_line("/proc/irq/{}/{}".format(irq, 'effective_affinity_list' if effective else 'smp_affinity_list'))
+    if line is None:
+        return None
+
+    try:
+        return CpuMask.from_list_str(line)
+    except ValueError:
+        return None
+
+def verify_irq_affinity(irq, mask):
+    """
+    Check that the effective affinity of the given IRQ is within the requested CpuMask and report it if it's not.
+
+    :return: False if the kernel has applied a different affinity and True otherwise (including when the effective
+             affinity is not known, e.g. on old kernels or for an IRQ that is not active)
+    """
+    effective = irq_affinity(irq, effective=True)
+    if not effective or not effective - mask:
+        return True
+
+    print("IRQ {}: requested CPUs {} but the effective affinity is {}".format(irq, mask.to_list_str(), effective.to_list_str()))
+    return False
+
+def plan_managed_irqs(plan, irqs, load=None):
+    """
+    Report the given kernel managed IRQs and account their load (if the IrqLoad is given) on the CPUs they are fixed to.
+
+    :return: a list of (IRQ, CpuMask) tuples for the IRQs with a known affinity
+    """
+    placements = []
+    for irq in irqs:
+        mask = irq_affinity(irq, effective=True) or irq_affinity(irq)
+        plan.add_comment("IRQ {} is managed by the kernel, leaving its affinity ({}) intact".format(irq, mask.to_list_str() if mask else "unknown"))
+
+        if mask:
+            placements.append((irq, mask))
+            if load is not None:
+                load.add_fixed(irq, list(mask))
+
+    return placements
+
+def distribute_irqs(plan, irqs, cpu_mask, log_errors=True, load=None, numa_node=None):
+    """
+    Add the smp_affinity steps distributing the given IRQs among the CPUs of the given mask to the given TuningPlan.
+
+    IRQs managed by the kernel (see irq_is_managed()) are skipped: CPUs they are fixed to are avoided when the rest of
+    the mask has enough CPUs for the remaining IRQs.
+
+    By default IRQs are spread evenly (hwloc-distrib --single). If the IrqLoad is given the IRQs are bin-packed
+    according to their measured load instead and the predicted per-CPU load is reported.
+
+    If the NUMA node of the device is given the CPUs of this node are used first: IRQs are placed on other nodes
+    (the closest first) only after each local CPU got an IRQ.
+
+    :return: a list of (IRQ, CpuMask) tuples (managed IRQs are included with their fixed affinity)
+    """
+    # If IRQs' list is empty - do nothing
+    if not irqs:
+        return []
+
+    topology = cpu_topology()
+
+    managed_irqs = [ irq for irq in irqs if irq_is_managed(irq) ]
+    if managed_irqs:
+        managed_placements = plan_managed_irqs(plan, managed_irqs, load)
+        irqs = [ irq for irq in irqs if irq not in managed_irqs ]
+
+        managed_cpus = CpuMask()
+        for irq, mask in managed_placements:
+            managed_cpus = managed_cpus | mask
+
+        if len(topology.restrict(cpu_mask - managed_cpus)) >= len(irqs):
+            cpu_mask = cpu_mask - managed_cpus
+
+        return managed_placements + distribute_irqs(plan, irqs, cpu_mask, log_errors, load, numa_node)
+
+    if numa_node is not None and len(irqs) < len(topology.restrict(cpu_mask)):
+        placements = []
+        for node in topology.nodes_by_distance(numa_node):
+            node_cpus = cpu_mask & topology.numa_nodes[node]
+            if not node_cpus:
+                continue
+
+            placements += distribute_irqs(plan, irqs[len(placements):len(placements) + len(node_cpus)], node_cpus, log_errors, load)
+            if len(placements) == len(irqs):
+                break
+
+        return placements
+
+    if load is None:
+        placements = list(zip(irqs, topology.distribute(len(irqs), restrict=cpu_mask)))
+    else:
+        # CPUs in the hwloc-distrib order so that ties are spread the same way the round-robin distribution does
+        cpus = [ mask.first() for mask in topology.distribute(len(topology.restrict(cpu_mask)), restrict=cpu_mask) ]
+        placements = [ (irq, CpuMask.from_cpus([ cpu ])) for irq, cpu in zip(irqs, load.place(irqs, cpus)) ]
+
+        report = [ "Predicted IRQs load (sampled over {} seconds):".format(load.window) ] + load.report(sorted(cpus))
+        plan.add_comment("\n".join(report))
+
+    for irq, mask in placements:
+        plan.add_mask("/proc/irq/{}/smp_affinity".format(irq), mask, log_errors=log_errors)
+
+    return placements
+
+def report_irqs_locality(plan, device, numa_node, placements):
+    """
+    Add to the plan a report of how many of the given device's IRQs are placed on its NUMA node.
+    """
+    if numa_node is None:
+        msg = "{}: NUMA node unknown, {} IRQs".format(device, len(placements))
+    else:
+        local_cpus = cpu_topology().numa_nodes.get(numa_node, CpuMask())
+        local = sum(1 for irq, mask in placements if mask & local_cpus)
+        msg = "{}: NUMA node {}, {} IRQs: {} local, {} remote".format(device, numa_node, len(placements), local, len(placements) - local)
+
+    plan.add_comment(msg)
+
+def is_process_running(name):
+    """
+    Returns True if there is a live (not a zombie) process with the given name (as in /proc/<pid>/comm).
+    """
+    for stat_file in host_glob('/proc/[0-9]*/stat'):
+        # "<pid> (<comm>) <state> ...": the comm may contain spaces and parentheses
+        comm, _, rest = (read_one_line(stat_file) or '').partition('(')[2].rpartition(')')
+        if comm == name and rest.split()[:1] != ['Z']:
+            return True
+
+    return False
+
+def irqbalance_config():
+    """
+    Returns the (config file, options key, systemd) tuple of the irqbalance packaging of this system or None if it's
+    not known.
+    """
+    config_file = '/etc/default/irqbalance'
+    options_key = 'OPTIONS'
+    systemd = False
+
+    # If this file exists - this a "new (systemd) style" irqbalance packaging.
+    # This type of packaging uses IRQBALANCE_ARGS as an option key name, "old (init.d) style"
+    # packaging uses an OPTION key.
+    if host_exists('/lib/systemd/system/irqbalance.service'):
+        options_key = 'IRQBALANCE_ARGS'
+        systemd = True
+
+    if not host_exists(config_file):
+        if host_exists('/etc/sysconfig/irqbalance'):
+            config_file = '/etc/sysconfig/irqbalance'
+        elif host_exists('/etc/conf.d/irqbalance'):
+            config_file = '/etc/conf.d/irqbalance'
+            options_key = 'IRQBALANCE_OPTS'
+            systemd = 'systemd' in (read_one_line('/proc/1/comm') or '')
+        else:
+            return None
+
+    return config_file, options_key, systemd
+
+def irqbalance_assignment(line):
+    """
+    Parse a shell variable assignment line of an irqbalance config file, e.g. IRQBALANCE_ARGS="--banirq=45 --banirq=46".
+
+    :return: the (key, value) tuple with the value unquoted or None if the line is not an assignment, e.g. a comment
+    """
+    try:
+        words = shlex.split(line, comments=True)
+    except ValueError:
+        return None
+
+    if words and words[0] == 'export':
+        words = words[1:]
+
+    if len(words) != 1 or not re.match(r'^[A-Za-z_]\w*=', words[0]):
+        return None
+
+    return tuple(words[0].split('=', 1))
+
+class IrqbalanceConfig:
+    """
+    The irqbalance configuration file: the options line, e.g. IRQBALANCE_ARGS="--hintpolicy=subset --banirq=45", and
+    the IRQBALANCE_BANNED_CPUS mask of the CPUs irqbalance doesn't place any IRQ on.
+
+    IRQ bans may be given as --banirq=N, --banirq N, -i N or -iN - all other options are kept intact when the file
+    is rewritten.
+    """
+    banned_cpus_key = 'IRQBALANCE_BANNED_CPUS'
+    __banirq_re = re.compile(r'^(?:--banirq=|-i)(\S+)$')
+
+    def __init__(self, config_file, options_key, systemd=False):
+        self.__config_file = config_file
+        self.__options_key = options_key
+        self.__systemd = systemd
+
+        with open(host_path(config_file), 'r') as f:
+            self.__lines = f.readlines()
+
+        values = {}
+        for line in self.__lines:
+            assignment = irqbalance_assignment(line)
+            if assignment is None or assignment[0] not in (options_key, IrqbalanceConfig.banned_cpus_key):
+                continue
+
+            if assignment[0] in values:
+                raise Exception("Invalid format in {}: more than one lines with {} key".format(config_file, assignment[0]))
+
+            values[assignment[0]] = assignment[1]
+
+        self.__options = shlex.split(values.get(options_key, ''))
+        self.__banned_cpus = values.get(IrqbalanceConfig.banned_cpus_key)
+
+#### Public methods ############################
+    @property
+    def config_file(self):
+        return self.__config_file
+
+    @property
+    def systemd(self):
+        return self.__systemd
+
+    @property
+    def options(self):
+        return list(self.__options)
+
+    @property
+    def banned_cpus(self):
+        """
+        The IRQBALANCE_BANNED_CPUS CpuMask or None if it's not set.
+        """
+        if not self.__banned_cpus:
+            return None
+
+        try:
+            return CpuMask.from_mask_str(self.__banned_cpus)
+        except ValueError:
+            raise Exception("Invalid format in {}: bad {} value: {}".format(self.__config_file, IrqbalanceConfig.banned_cpus_key, self.__banned_cpus))
+
+    def banned_irqs(self):
+        """
+        Return the set of the banned IRQs.
+        """
+        return set(irq for _, irq in self.__option_groups() if irq is not None)
+
+    def is_configured(self, banned_irqs, banned_cpus=None):
+        """
+        Returns True if all the given IRQs are banned and IRQBALANCE_BANNED_CPUS is the given CpuMask (not checked if
+        it's None).
+        """
+        return set(banned_irqs) <= self.banned_irqs() and (banned_cpus is None or self.banned_cpus == banned_cpus)
+
+    def options_with_bans(self, banned_irqs, known_irqs=None):
+        """
+        Return the options list that bans the given IRQs in addition to the ones that are already banned.
+
+        :param banned_irqs: IRQs to ban
+        :param known_irqs: if given - bans of IRQs that are not in this collection are dropped, e.g. the ones left
+                           behind by a driver reload
+        """
+        options = []
+        banned = set()
+        for tokens, irq in self.__option_groups():
+            if irq is not None and (irq in banned or (known_irqs is not None and irq not in known_irqs)):
+                continue
+
+            options.extend(tokens)
+            if irq is not None:
+                banned.add(irq)
+
+        options.extend([ "--banirq={}".format(irq) for irq in banned_irqs if irq not in banned ])
+        return options
+
+    def write(self, options, banned_cpus):
+        """
+        Rewrite the config file with the given options list and IRQBALANCE_BANNED_CPUS CpuMask (the variable is
+        removed if it's None). All other lines are kept intact.
+        """
+        keys = (self.__options_key, IrqbalanceConfig.banned_cpus_key)
+        lines = [ line for line in self.__lines if (irqbalance_assignment(line) or (None,))[0] not in keys ]
+        if lines and not lines[-1].endswith('\n'):
+            lines[-1] += '\n'
+
+        lines.append("{}=\"{}\"\n".format(self.__options_key, " ".join(options)))
+        if banned_cpus is not None:
+            lines.append("{}={}\n".format(IrqbalanceConfig.banned_cpus_key, banned_cpus.to_mask_str()))
+
+        with open(host_path(self.__config_file), 'w') as cfile:
+            cfile.writelines(lines)
+
+#### Private methods ############################
+    def __option_groups(self):
+        """
+        Split the options list into (tokens, banned IRQ) tuples: the banned IRQ is None for every option that is not
+        an IRQ ban.
+        """
+        groups = []
+        tokens = iter(self.__options)
+        for token in tokens:
+            m = IrqbalanceConfig.__banirq_re.match(token)
+            if m:
+                groups.append(([token], m.group(1)))
+            elif token in ('--banirq', '-i'):
+                irq = next(tokens, None)
+                groups.append(([token] if irq is None else [token, irq], irq))
+            else:
+                groups.append(([token], None))
+
+        return groups
+
+def irqbalance_current_config():
+    """
+    Returns the IrqbalanceConfig of the running irqbalance, False if irqbalance is not running or None if its
+    configuration is not known.
+    """
+    if not is_process_running('irqbalance'):
+        return False
+
+    config = irqbalance_config()
+    if config is None:
+        return None
+
+    return IrqbalanceConfig(*config)
+
+def irqbalance_unbanned_irqs(banned_irqs):
+    """
+    Returns the list of the given IRQs irqbalance is not banned from moving (without changing anything) or None if
+    it can't be learned. An empty list is returned if irqbalance is not running.
+    """
+    config = irqbalance_current_config()
+    if not config:
+        return [] if config is False else None
+
+    current_bans = config.banned_irqs()
+    return [ irq for irq in banned_irqs if irq not in current_bans ]
+
+def irqbalance_is_configured(banned_irqs, banned_cpus=None):
+    """
+    Returns True if irqbalance bans all the given IRQs and its IRQBALANCE_BANNED_CPUS is the given CpuMask (not
+    checked if it's None), False if not and None if it can't be learned. It's True if irqbalance is not running.
+    """
+    config = irqbalance_current_config()
+    if not config:
+        return True if config is False else None
+
+    return config.is_configured(banned_irqs, banned_cpus)
+
+def restart_irqbalance(banned_irqs, banned_cpus=None):
+    """
+    Restart irqbalance if it's running and its configuration has to be changed: ban it from moving the IRQs from the
+    given list and from placing IRQs on the given CPUs.
+
+    Bans of IRQs that don't exist anymore are dropped when the configuration is rewritten, however they don't cause a
+    restart by themselves.
+
+    :param banned_irqs: IRQs to ban
+    :param banned_cpus: IRQBALANCE_BANNED_CPUS CpuMask, the current value is kept intact if it's None
+    :return: True if irqbalance configuration has been changed and irqbalance has been restarted, False otherwise
+    """
+    banned_irqs_list = list(banned_irqs)
+
+    # If there is nothing to ban - quit
+    if not banned_irqs_list and banned_cpus is None:
+        return False
+
+    config = irqbalance_current_config()
+
+    # return early if irqbalance is not running
+    if config is False:
+        print("irqbalance is not running")
+        return False
+
+    if config is None:
+        print("Unknown system configuration - not restarting irqbalance!")
+        print("You have to prevent it from moving IRQs {} manually!".format(banned_irqs_list))
+        return False
+
+    # Don't restart irqbalance (and let it re-place all IRQs) if nothing has to be changed
+    if config.is_configured(banned_irqs_list, banned_cpus):
+        print("irqbalance is already configured to ban IRQs {} - not restarting it".format(", ".join(banned_irqs_list)))
+        return False
+
+    orig_file = "{}.scylla.orig".format(config.config_file)
+
+    # Save the original file
+    if not host_exists(orig_file):
+        print("Saving the original irqbalance configuration is in {}".format(orig_file))
+        shutil.copyfile(host_path(config.config_file), host_path(orig_file))
+    else:
+        print("File {} already exists - not overwriting.".format(orig_file))
+
+    print("Restarting irqbalance: going to ban the following IRQ numbers: {} ...".format(", ".join(banned_irqs_list)))
+    if banned_cpus is not None:
+        print("... and the following CPUs: {}".format(banned_cpus.to_list_str()))
+
+    config.write(config.options_with_bans(banned_irqs_list, interrupt_table()),
+                 config.banned_cpus if banned_cpus is None else banned_cpus)
+
+    if sysroot != '/':
+        print("Not restarting irqbalance of the {} root".format(sysroot))
+    elif config.systemd:
+        print("Restarting irqbalance via systemctl...")
+        run_one_command(['systemctl', 'try-restart', 'irqbalance'])
+    else:
+        print("Restarting irqbalance directly (init.d)...")
+        run_one_command(['/etc/init.d/irqbalance', 'restart'])
+
+    return True
+
+class InterruptTable:
+    """
+    A parsed snapshot of /proc/interrupts.
+
+    For every IRQ line it holds the per-CPU counters, the chip/type columns and the tokenized action (device/queue)
+    names, e.g.
+
+       CPU0       CPU1
+     45:  1234  5678  IR-PCI-MSI 1572864-edge      eth0-TxRx-0
+     77:     0    17  PCI-MSI 65536-edge           nvme0q0, nvme0q1
+
+    Action names are indexed both as a whole (nvme3q17, eth0-TxRx-5, virtio2-input.0) and by their device part - the
+    part before the first '-' (eth0, virtio2) - so that looking up the IRQs of a given device or queue is O(1).
+    """
+    __hwirq_type_re = re.compile(r'^\S*-(edge|level|fasteoi)$|^\d+$', re.IGNORECASE)
+
+    def __init__(self, proc_interrupts='/proc/interrupts'):
+        self.__irq2line = {}
+        self.__irq2counters = {}
+        self.__irq2chip = {}
+        self.__irq2type = {}
+        self.__irq2actions = {}
+        self.__name2irqs = {}
+        self.__cpus = []
+
+        with open(host_path(proc_interrupts), 'r') as f:
+            self.__parse(f.readlines())
+
+#### Public methods ############################
+    @property
+    def cpus(self):
+        """
+        Return the list of CPU numbers in the order of the counters' columns.
+        """
+        return self.__cpus
+
+    def irqs(self):
+        """
+        Return the list of all IRQs (as strings, e.g. '45' or 'NMI') in the /proc/interrupts order.
+        """
+        return list(self.__irq2line.keys())
+
+    def keys(self):
+        return self.__irq2line.keys()
+
+    def line(self, irq):
+        """
+        Return the raw /proc/interrupts line of the given IRQ.
+        """
+        return self.__irq2line[irq]
+
+    def counters(self, irq):
+        """
+        Return the list of per-CPU counters of the given IRQ (ordered as cpus).
+        """
+        return self.__irq2counters[irq]
+
+    def chip(self, irq):
+        return self.__irq2chip[irq]
+
+    def irq_type(self, irq):
+        return self.__irq2type[irq]
+
+    def actions(self, irq):
+        """
+        Return the list of action (device/queue) names of the given IRQ, e.g. ['nvme0q0', 'nvme0q1'].
+        """
+        return self.__irq2actions[irq]
+
+    def irqs_by_name(self, name):
+        """
+        Return the list of IRQs that have an action named <name> or whose action device part is <name> in the
+        /proc/interrupts order, e.g. 'virtio2' matches virtio2-input.0 and virtio2-config but not virtio21-input.0.
+        """
+        return list(self.__name2irqs.get(name, []))
+
+    def irqs_matching(self, pattern):
+        """
+        Return the list of IRQs that have an action name matching the given compiled regular expression.
+        This is a linear scan - prefer irqs_by_name() when the exact name is known.
+        """
+        return [ irq for irq, actions in self.__irq2actions.items() if any(pattern.search(action) for action in actions) ]
+
+    def __contains__(self, irq):
+        return irq in self.__irq2line
+
+#### Private methods ############################
+    def __add_name(self, name, irq):
+        # Lines are parsed in order: an IRQ may only repeat right after itself (several actions of the same device)
+        irqs = self.__name2irqs.setdefault(name, [])
+        if not irqs or irqs[-1] != irq:
+            irqs.append(irq)
+
+    def __parse(self, lines):
+        if not lines:
+            return
+
+        self.__cpus = [ int(cpu[3:]) for cpu in lines[0].split() if cpu.startswith('CPU') ]
+        num_cpus = len(self.__cpus)
+
+        for line in lines[1:]:
+            irq, sep, rest = line.partition(':')
+            if not sep:
+                continue
+
+            irq = irq.strip()
+            fields = rest.split()
+            counters = []
+            for field in fields[:num_cpus]:
+                if not field.isdigit():
+                    break
+                counters.append(int(field))
+
+            fields = fields[len(counters):]
+            chip = fields[0] if fields else ''
+            fields = fields[1:]
+
+            # Optional "<hwirq>-<type>" (or separate "<hwirq> <type>") columns follow the chip name
+            irq_type = ''
+            while fields and self.__hwirq_type_re.search(fields[0]):
+                irq_type = fields[0]
+                fields = fields[1:]
+
+            actions = [ action.strip() for action in " ".join(fields).split(',') if action.strip() ]
+
+            self.__irq2line[irq] = line
+            self.__irq2counters[irq] = counters
+            self.__irq2chip[irq] = chip
+            self.__irq2type[irq] = irq_type
+            self.__irq2actions[irq] = actions
+
+            for action in actions:
+                self.__add_name(action, irq)
+                device, dash, _ = action.partition('-')
+                if dash and device:
+                    self.__add_name(device, irq)
+
+@functools.lru_cache(maxsize=None)
+def interrupt_table():
+    """
+    Returns the InterruptTable of this host - /proc/interrupts is parsed only once per run and shared by all tuners.
+    """
+    return InterruptTable()
+
+def learn_all_irqs_one(irq_conf_dir, interrupts, xen_dev_name):
+    """
+    Returns a list of IRQs of a single device.
+
+    irq_conf_dir: a /sys/... directory with the IRQ information for the given device
+    interrupts: an InterruptTable instance
+    xen_dev_name: a device name as it appears in the /proc/interrupts on Xen systems
+    """
+    msi_irqs_dir_name = host_path(os.path.join(irq_conf_dir, 'msi_irqs'))
+    # Device uses MSI IRQs
+    if os.path.exists(msi_irqs_dir_name):
+        return os.listdir(msi_irqs_dir_name)
+
+    irq_file_name = os.path.join(irq_conf_dir, 'irq')
+    # Device uses INT#x
+    if host_exists(irq_file_name):
+        return [ line.lstrip().rstrip() for line in readlines(irq_file_name) ]
+
+    # No irq file detected
+    modalias = read_one_line(os.path.join(irq_conf_dir, 'modalias')) or ''
+
+    # virtio case
+    if re.search("^virtio", modalias):
+        return list(itertools.chain.from_iterable(
+            map(lambda dirname : interrupts.irqs_by_name(dirname),
+                filter(lambda dirname : re.search('virtio', dirname),
+                       itertools.chain.from_iterable([ dirnames for dirpath, dirnames, filenames in os.walk(host_path(os.path.join(irq_conf_dir, 'driver'))) ])))))
+
+    # xen case
+    if re.search("^xen:", modalias):
+        return interrupts.irqs_by_name(xen_dev_name)
+
+    return []
+
+################################################################################
+def read_softirqs(proc_softirqs='/proc/softirqs'):
+    """
+    Returns a map of a softirq name (e.g. NET_RX) to the list of its per-CPU counters and the list of CPU numbers
+    of the counters columns.
+    """
+    with open(host_path(proc_softirqs), 'r') as f:
+        lines = f.readlines()
+
+    if not lines:
+        return {}, []
+
+    cpus = [ int(cpu[3:]) for cpu in lines[0].split() if cpu.startswith('CPU') ]
+    softirqs = {}
+    for line in lines[1:]:
+        name, sep, counters = line.partition(':')
+        if sep:
+            softirqs[name.strip()] = [ int(counter) for counter in counters.split() ]
+
+    return softirqs, cpus
+
+class IrqLoad:
+    """
+    The measured interrupts load: the rate of every IRQ over a sampling window plus its share of the NET_RX and
+    BLOCK softirqs work of the CPUs it fired on, together with the predicted per-CPU load of the IRQs placed so far.
+
+    A softirq is raised on the CPU that handled the corresponding hard IRQ, therefore the softirq rate of every CPU
+    is attributed to the IRQs that fired on it proportionally to their rates on that CPU.
+    """
+    softirq_names = ('NET_RX', 'BLOCK')
+
+    def __init__(self, window):
+        self.__window = window
+        self.__irq2weight = {}
+        self.__cpu2load = {}
+        self.__sample()
+
+#### Public methods ############################
+    @property
+    def window(self):
+        return self.__window
+
+    def weight(self, irq):
+        """
+        Return the expected number of interrupts (hard IRQs plus the attributed softirqs) per second of the given IRQ.
+        """
+        return self.__irq2weight.get(irq, 0.0)
+
+    def cpu_load(self, cpu):
+        """
+        Return the predicted load of the given CPU from the IRQs placed on it so far.
+        """
+        return self.__cpu2load.get(cpu, 0.0)
+
+    def place(self, irqs, cpus):
+        """
+        Bin-pack the given IRQs on the given CPUs so that the predicted load is balanced: the heaviest IRQ goes
+        first, each one to the least loaded CPU. Ties are broken by the number of IRQs already placed on the CPU and
+        then by the order of the given CPUs list.
+
+        :param irqs: list of IRQs
+        :param cpus: list of CPU numbers in the preferred order
+        :return: list of CPU numbers - one for each of the given IRQs
+        """
+        cpu2irqs_count = { cpu : 0 for cpu in cpus }
+        irq2cpu = {}
+
+        for irq in sorted(irqs, key=lambda irq: -self.weight(irq)):
+            cpu = min(enumerate(cpus), key=lambda idx_cpu: (self.cpu_load(idx_cpu[1]), cpu2irqs_count[idx_cpu[1]], idx_cpu[0]))[1]
+            irq2cpu[irq] = cpu
+            cpu2irqs_count[cpu] += 1
+            self.__cpu2load[cpu] = self.cpu_load(cpu) + self.weight(irq)
+
+        return [ irq2cpu[irq] for irq in irqs ]
+
+    def add_fixed(self, irq, cpus):
+        """
+        Account the load of the given IRQ the placement of which can't be changed (e.g. a kernel managed IRQ) on the
+        given CPUs (evenly).
+        """
+        for cpu in cpus:
+            self.__cpu2load[cpu] = self.cpu_load(cpu) + self.weight(irq) / len(cpus)
+
+    def report(self, cpus):
+        """
+        Return the predicted per-CPU load report lines for the given CPUs.
+        """
+        return [ "  CPU{}: {:.0f} interrupts/s".format(cpu, self.cpu_load(cpu)) for cpu in cpus ]
+
+#### Private methods ############################
+    def __sample(self):
+        interrupts_before = InterruptTable()
+        softirqs_before, softirq_cpus = read_softirqs()
+        time.sleep(self.__window)
+        interrupts_after = InterruptTable()
+        softirqs_after, _ = read_softirqs()
+
+        # per-CPU hard IRQ rates of every IRQ
+        irq2cpu_rates = {}
+        for irq in interrupts_after.irqs():
+            if irq not in interrupts_before or not irq.isdigit():
+                continue
+
+            rates = { cpu : (after - before) / self.__window
+                      for cpu, before, after in zip(interrupts_after.cpus, interrupts_before.counters(irq), interrupts_after.counters(irq)) if after > before }
+            if rates:
+                irq2cpu_rates[irq] = rates
+
+        cpu2irqs_rate = {}
+        for rates in irq2cpu_rates.values():
+            for cpu, rate in rates.items():
+                cpu2irqs_rate[cpu] = cpu2irqs_rate.get(cpu, 0.0) + rate
+
+        cpu2softirqs_rate = {}
+        for name in IrqLoad.softirq_names:
+            for cpu, before, after in zip(softirq_cpus, softirqs_before.get(name, []), softirqs_after.get(name, [])):
+                cpu2softirqs_rate[cpu] = cpu2softirqs_rate.get(cpu, 0.0) + max(after - before, 0) / self.__window
+
+        for irq, rates in irq2cpu_rates.items():
+            self.__irq2weight[irq] = sum(rate + cpu2softirqs_rate.get(cpu, 0.0) * rate / cpu2irqs_rate[cpu] for cpu, rate in rates.items())
+
+@functools.lru_cache(maxsize=None)
+def irq_load(window):
+    """
+    Returns the IrqLoad sampled over the given window (in seconds) - it's sampled only once per run and shared by
+    all tuners.
+    """
+    print("Sampling IRQs load for {} seconds...".format(window))
+    return IrqLoad(window)
+
+################################################################################
+class CpuMask:
+    """
+    A set of CPUs backed by a single integer bitmap: bit N is set iff CPU N belongs to the set.
+
+    Union, intersection, difference, complement (inside a given universe) and population count are O(words) integer
+    operations. The set can be parsed from and formatted to both cpuset(7) formats:
+      - "Mask Format": a comma-separated list of 32-bit hex words, the most significant word first, e.g.
+        00000000,000e3862 (kernel) or 0x00000000,,0x000e3862 (hwloc; an empty word means zero).
+      - "List Format": a comma-separated list of CPU numbers and ranges, e.g. 1,5-6,11-13,17-19.
+    """
+    __slots__ = ('__bits',)
+
+    def __init__(self, bits=0):
+        if bits < 0:
+            raise ValueError("CPU mask can't be negative: {}".format(bits))
+        self.__bits = bits
+
+    @staticmethod
+    def from_mask_str(mask_str):
+        bits = 0
+        for word in mask_str.strip().split(','):
+            word = word.strip()
+            if word[:2] in ('0x', '0X'):
+                word = word[2:]
+
+            bits = (bits << 32) | (int(word, 16) if word else 0)
+
+        return CpuMask(bits)
+
+    @staticmethod
+    def from_list_str(list_str):
+        bits = 0
+        for cpu_range in list_str.strip().split(','):
+            if not cpu_range:
+                continue
+
+            first, _, last = cpu_range.partition('-')
+            first = int(first)
+            last = int(last) if last else first
+            bits |= ((1 << (last - first + 1)) - 1) << first
+
+        return CpuMask(bits)
+
+    @staticmethod
+    def from_cpus(cpus):
+        bits = 0
+        for cpu in cpus:
+            bits |= 1 << int(cpu)
+
+        return CpuMask(bits)
+
+    @property
+    def bits(self):
+        return self.__bits
+
+    def to_mask_str(self):
+        """
+        Return the kernel "Mask Format" string, e.g. 00000000,000e3862.
+        """
+        return self.__format_words("{:08x}")
+
+    def to_hwloc_str(self):
+        """
+        Return the hwloc-style "Mask Format" string, e.g. 0x00000000,0x000e3862.
+        """
+        return self.__format_words("0x{:08x}")
+
+    def to_list_str(self):
+        """
+        Return the "List Format" string, e.g. 1,5-6,11-13,17-19.
+        """
+        ranges = []
+        bits = self.__bits
+        while bits:
+            first = (bits & -bits).bit_length() - 1
+            shifted = bits >> first
+            # the lowest zero bit of the shifted value terminates the run of ones
+            run_len = ((shifted + 1) & ~shifted).bit_length() - 1
+            last = first + run_len - 1
+            ranges.append(str(first) if first == last else "{}-{}".format(first, last))
+            bits &= ~(((1 << run_len) - 1) << first)
+
+        return ",".join(ranges)
+
+    def lowest(self):
+        """
+        Return a mask with only the lowest CPU of this mask (hwloc_bitmap_singlify()).
+        """
+        return CpuMask(self.__bits & -self.__bits)
+
+    def first(self):
+        """
+        Return the lowest CPU number in the mask or None if the mask is empty.
+        """
+        return (self.__bits & -self.__bits).bit_length() - 1 if self.__bits else None
+
+    def complement(self, universe):
+        """
+        Return the CPUs of the given universe mask that are not in this mask.
+        """
+        return CpuMask(universe.bits & ~self.__bits)
+
+    def __iter__(self):
+        bits = self.__bits
+        while bits:
+            low = bits & -bits
+            yield low.bit_length() - 1
+            bits ^= low
+
+    def __len__(self):
+        return bin(self.__bits).count('1')
+
+    def __bool__(self):
+        return self.__bits != 0
+
+    def __contains__(self, cpu):
+        return (self.__bits >> int(cpu)) & 1 == 1
+
+    def __or__(self, other):
+        return CpuMask(self.__bits | other.bits)
+
+    def __and__(self, other):
+        return CpuMask(self.__bits & other.bits)
+
+    def __sub__(self, other):
+        return CpuMask(self.__bits & ~other.bits)
+
+    def __eq__(self, other):
+        return isinstance(other, CpuMask) and self.__bits == other.bits
+
+    def __hash__(self):
+        return hash(self.__bits)
+
+    def __str__(self):
+        return self.to_hwloc_str()
+
+    def __repr__(self):
+        return "CpuMask({})".format(self.to_list_str())
+
+    def __format_words(self, word_format):
+        words = []
+        bits = self.__bits
+        while True:
+            words.append(word_format.format(bits & 0xffffffff))
+            bits >>= 32
+            if not bits:
+                break
+
+        return ",".join(reversed(words))
+
+class CpuTopology:
+    """
+    In-process model of the CPU topology as exposed in /sys/devices/system/cpu and /sys/devices/system/node.
+
+    It replaces hwloc-calc/hwloc-distrib invocations: objects are enumerated in the same (logical) order hwloc uses,
+    i.e. packages and cores are ordered by their first PU, and the IRQs distribution follows the hwloc_distrib()
+    algorithm over the machine -> package -> (NUMA node) -> core -> PU tree.
+    """
+    def __init__(self, cpu_dir='/sys/devices/system/cpu', node_dir='/sys/devices/system/node'):
+        self.__cpu_dir = host_path(cpu_dir)
+        self.__node_dir = host_path(node_dir)
+
+        self.__all_pus = self.__learn_online_pus()
+        self.__numa_nodes = self.__learn_numa_nodes()
+        self.__numa_distances = self.__learn_numa_distances()
+        self.__packages = self.__learn_packages()
+        self.__cores = list(itertools.chain.from_iterable(cores for package, cores in self.__packages))
+
+#### Public methods ############################
+    @property
+    def all_pus(self):
+        """
+        Return the mask of all online PUs.
+        """
+        return self.__all_pus
+
+    @property
+    def numa_nodes(self):
+        """
+        Return a map of NUMA node ID to the mask of its online PUs.
+        """
+        return self.__numa_nodes
+
+    def description(self):
+        """
+        Return a JSON-serializable description of the topology: the online PUs, the PUs of every NUMA node and the
+        cores in the logical order.
+        """
+        return {
+            'pus': self.__all_pus.to_list_str(),
+            'numa_nodes': { str(node): pus.to_list_str() for node, pus in self.__numa_nodes.items() },
+            'cores': [ core.to_list_str() for core in self.__cores ],
+        }
+
+    def nodes_by_distance(self, node):
+        """
+        Return the list of NUMA nodes (that have online PUs) ordered by their distance from the given node, the
+        given node first.
+        """
+        distances = self.__numa_distances.get(node, {})
+        return sorted(self.__numa_nodes.keys(), key=lambda other: (0 if other == node else 1, distances.get(other, sys.maxsize), other))
+
+    def pu(self, idx):
+        """
+        Return the mask of the PU with the given logical index (hwloc "PU:<idx>").
+        """
+        pus = list(self.__all_pus)
+        if idx >= len(pus):
+            raise Exception("PU:{} doesn't exist".format(idx))
+
+        return CpuMask.from_cpus([ pus[idx] ])
+
+    def core(self, idx, package=None):
+        """
+        Return the mask of the core with the given logical index (hwloc "core:<idx>"), or, if package is
+        given, of the core with the given index inside the given package (hwloc "package:<package>.core:<idx>").
+        """
+        cores = self.__cores if package is None else self.__package_cores(package)
+        if idx >= len(cores):
+            raise Exception("{}core:{} doesn't exist".format("" if package is None else "package:{}.".format(package), idx))
+
+        return cores[idx]
+
+    def restrict(self, cpu_mask):
+        """
+        Return the mask of all online PUs restricted to the given mask (hwloc-calc --restrict <mask> all).
+        """
+        return self.__all_pus & cpu_mask
+
+    def cpu_distance(self, cpu, other):
+        """
+        Return a topological distance between two CPUs: 0 - the same CPU, 1 - HT siblings, 2 - the same NUMA node,
+        3 - the same package, 4 - otherwise.
+        """
+        if cpu == other:
+            return 0
+
+        if any(cpu in core and other in core for core in self.__cores):
+            return 1
+
+        if any(cpu in node_pus and other in node_pus for node_pus in self.__numa_nodes.values()):
+            return 2
+
+        if any(cpu in package_pus and other in package_pus for package_pus, cores in self.__packages):
+            return 3
+
+        return 4
+
+    def cores_of(self, restrict):
+        """
+        Return the masks of the cores that have PUs inside the given mask, restricted to it, in the logical order.
+        """
+        return [ core & restrict for core in self.__cores if core & restrict ]
+
+    def number_of_cores(self, restrict):
+        """
+        Return the number of cores that have PUs inside the given mask (hwloc-calc --number-of core machine:0).
+        """
+        return sum(1 for core in self.__cores if core & restrict)
+
+    def number_of_pus(self, restrict):
+        """
+        Return the number of online PUs inside the given mask (hwloc-calc --number-of PU machine:0).
+        """
+        return len(self.restrict(restrict))
+
+    def distribute(self, n, restrict=None, single=True):
+        """
+        Distribute n items among the PUs inside the given mask (or among all online PUs) the same way
+        'hwloc-distrib <n> [--single] [--restrict <mask>]' does.
+
+        :return: a list of n masks - single-PU ones if 'single' is True
+        """
+        restrict = self.__all_pus if restrict is None else self.restrict(restrict)
+        if not restrict:
+            raise Exception("Can't distribute {} items: the given CPU set is empty".format(n))
+
+        if n <= 0:
+            return []
+
+        sets = []
+        self.__distrib(self.__tree(restrict), n, sets)
+
+        return [ cpu_set.lowest() for cpu_set in sets ] if single else sets
+
+    def split(self, weights, restrict=None):
+        """
+        Split the PUs inside the given mask (or all online PUs) into len(weights) disjoint masks, each one proportional
+        to its weight and of at least one PU. PUs are taken in the logical order, so HT siblings and PUs of the same
+        NUMA node stay together.
+
+        :return: a list of masks or None if there are fewer PUs than weights
+        """
+        pus = list(itertools.chain.from_iterable(self.cores_of(self.__all_pus if restrict is None else restrict)))
+        weights = [ max(1, weight) for weight in weights ]
+        if len(pus) < len(weights):
+            return None
+
+        # Every mask gets one PU, the rest are given proportionally to the weights (the largest remainders first)
+        spare = len(pus) - len(weights)
+        sizes = [ 1 + spare * weight // sum(weights) for weight in weights ]
+        by_remainder = sorted(range(len(weights)), key=lambda i: (-(spare * weights[i] % sum(weights)), i))
+        for i in by_remainder[:len(pus) - sum(sizes)]:
+            sizes[i] += 1
+
+        masks = []
+        for size in sizes:
+            masks.append(CpuMask.from_cpus(pus[:size]))
+            pus = pus[size:]
+
+        return masks
+
+#### Private methods ############################
+    def __read_sysfs(self, *path_parts):
+        with open(os.path.join(*path_parts), 'r') as f:
+            return f.read().strip()
+
+    def __learn_online_pus(self):
+        try:
+            return CpuMask.from_list_str(self.__read_sysfs(self.__cpu_dir, 'online'))
+        except OSError:
+            # fall back to all CPUs that have a topology directory
+            return CpuMask.from_cpus(os.path.basename(cpu_dir)[3:] for cpu_dir in glob.glob(os.path.join(self.__cpu_dir, 'cpu[0-9]*')))
+
+    def __learn_numa_nodes(self):
+        nodes = {}
+        for node_dir in glob.glob(os.path.join(self.__node_dir, 'node[0-9]*')):
+            node_pus = CpuMask.from_list_str(self.__read_sysfs(node_dir, 'cpulist')) & self.__all_pus
+            if node_pus:
+                nodes[int(os.path.basename(node_dir)[4:])] = node_pus
+
+        # non-NUMA kernel
+        if not nodes:
+            nodes[0] = self.__all_pus
+
+        return nodes
+
+    def __learn_numa_distances(self):
+        """
+        Return a map of NUMA node ID to the map of the distances to other nodes as in nodeX/distance: the i-th value
+        is the distance to the i-th node (including the memory-only ones) in the ascending order of their IDs.
+        """
+        node_ids = sorted(int(os.path.basename(node_dir)[4:]) for node_dir in glob.glob(os.path.join(self.__node_dir, 'node[0-9]*')))
+        distances = {}
+        for node_id in node_ids:
+            try:
+                distances[node_id] = dict(zip(node_ids, map(int, self.__read_sysfs(self.__node_dir, 'node{}'.format(node_id), 'distance').split())))
+            except OSError:
+                pass
+
+        return distances
+
+    def __learn_packages(self):
+        """
+        Return a list of (<package mask>, [<core masks>]) tuples ordered by the logical index.
+        """
+        package_id2pus = {}
+        cores = set()
+
+        for cpu in self.__all_pus:
+            cpu_mask = CpuMask.from_cpus([ cpu ])
+            topology_dir = os.path.join(self.__cpu_dir, 'cpu{}'.format(cpu), 'topology')
+            try:
+                package_id = int(self.__read_sysfs(topology_dir, 'physical_package_id'))
+                siblings = CpuMask.from_list_str(self.__read_sysfs(topology_dir, 'thread_siblings_list'))
+            except OSError:
+                package_id, siblings = 0, cpu_mask
+
+            package_id2pus[package_id] = package_id2pus.get(package_id, CpuMask()) | cpu_mask
+            cores.add(siblings & self.__all_pus)
+
+        packages = []
+        for package_pus in sorted(package_id2pus.values(), key=CpuMask.first):
+            package_cores = sorted([ core for core in cores if core & package_pus ], key=CpuMask.first)
+            packages.append((package_pus, package_cores))
+
+        return packages
+
+    def __package_cores(self, package):
+        if package >= len(self.__packages):
+            raise Exception("package:{} doesn't exist".format(package))
+
+        return self.__packages[package][1]
+
+    def __tree(self, restrict):
+        """
+        Build the (mask, [children]) tree of the topology restricted to the given mask.
+        Objects that have no PUs inside the restriction are dropped - just like 'hwloc --restrict' does.
+        """
+        def pus_subtree(cpu_mask):
+            return [ (CpuMask.from_cpus([ pu ]), []) for pu in cpu_mask ]
+
+        def cores_subtree(cores):
+            return [ (core & restrict, pus_subtree(core & restrict)) for core in cores if core & restrict ]
+
+        packages = []
+        for package_pus, package_cores in self.__packages:
+            if not package_pus & restrict:
+                continue
+
+            # A package that spans over more than one NUMA node gets an additional level
+            package_nodes = [ node_pus for node_id, node_pus in sorted(self.__numa_nodes.items(), key=lambda item: item[1].first())
+                              if node_pus & package_pus & restrict ]
+            if len(package_nodes) > 1:
+                children = [ (node_pus & package_pus & restrict, cores_subtree([ core for core in package_cores if core & node_pus ]))
+                             for node_pus in package_nodes ]
+            else:
+                children = cores_subtree(package_cores)
+
+            packages.append((package_pus & restrict, children))
+
+        return (restrict, packages)
+
+    def __distrib(self, root, n, sets):
+        """
+        hwloc_distrib() implementation: give each child a chunk proportional to its weight and recurse.
+        """
+        roots = root[1]
+        weights = [ len(cpu_set) for cpu_set, children in roots ]
+        tot_weight = sum(weights)
+        given_weight = 0
+
+        for (cpu_set, children), weight in zip(roots, weights):
+            chunk = ((given_weight + weight) * n + tot_weight - 1) // tot_weight - (given_weight * n + tot_weight - 1) // tot_weight
+
+            if not children or chunk <= 1:
+                if chunk:
+                    sets.extend([ cpu_set ] * chunk)
+                else:
+                    # the first chunk can't be empty
+                    sets[-1] = sets[-1] | cpu_set
+            else:
+                self.__distrib((cpu_set, children), chunk, sets)
+
+            given_weight += weight
+
+@functools.lru_cache(maxsize=None)
+def cpu_topology():
+    """
+    Returns the CpuTopology instance of this host - the topology is learned only once per run.
+    """
+    return CpuTopology()
+
+################################################################################
+class Ethtool:
+    """
+    The ethtool view of a network interface: the driver information, ring sizes, channels, interrupt coalescing and
+    offload features.
+
+    The settings are read and changed in-process using the SIOCETHTOOL ioctl (see include/uapi/linux/ethtool.h). The
+    ethtool binary is used only as a fallback when an ioctl fails, e.g. for features the legacy ioctl interface
+    doesn't cover.
+
+    Every kind of settings is read only once per object - create a new object in order to read the current values
+    again.
+    """
+    # ethtool -K short feature names to the names 'ethtool -k' reports
+    feature_names = {
+        'ntuple': 'ntuple-filters',
+        'gro': 'generic-receive-offload',
+        'lro': 'large-receive-offload',
+        'tso': 'tcp-segmentation-offload',
+        'gso': 'generic-segmentation-offload',
+        'rxhash': 'receive-hashing',
+    }
+
+    __SIOCETHTOOL = 0x8946
+
+    # ioctl commands: (get, set) pairs and the layout of their structures after the 'cmd' field
+    __DRVINFO = (0x00000003, None, '32s32s32s32s32s12s5I')
+    __RINGS = (0x00000010, 0x00000011, '8I')
+    __CHANNELS = (0x0000003c, 0x0000003d, '8I')
+    __COALESCE = (0x0000000e, 0x0000000f, '22I')
+
+    # struct ethtool_ringparam, struct ethtool_channels and struct ethtool_coalesce fields in the ethtool -G/-L/-C names
+    __ring_fields = ('rx', 'rx-mini', 'rx-jumbo', 'tx')
+    __channel_fields = ('rx', 'tx', 'other', 'combined')
+    __coalesce_fields = ('rx-usecs', 'rx-frames', 'rx-usecs-irq', 'rx-frames-irq', 'tx-usecs', 'tx-frames',
+                         'tx-usecs-irq', 'tx-frames-irq', 'stats-block-usecs', 'adaptive-rx', 'adaptive-tx',
+                         'pkt-rate-low', 'rx-usecs-low', 'rx-frames-low', 'tx-usecs-low', 'tx-frames-low',
+                         'pkt-rate-high', 'rx-usecs-high', 'rx-frames-high', 'tx-usecs-high', 'tx-frames-high',
+                         'sample-interval')
+
+    # Features with the legacy ethtool_value get/set commands and features that are ETHTOOL_GFLAGS/SFLAGS bits
+    __value_features = {'gro': (0x0000002b, 0x0000002c), 'tso': (0x0000001e, 0x0000001f), 'gso': (0x00000023, 0x00000024)}
+    __FLAGS = (0x00000025, 0x00000026)
+    __flag_features = {'lro': 1 << 15, 'ntuple': 1 << 27, 'rxhash': 1 << 28}
+
+    # Whether a feature is fixed is learned from the kernel's feature bits (ETHTOOL_GFEATURES) named by the features
+    # string set (ETHTOOL_GSSET_INFO and ETHTOOL_GSTRINGS): the bits behind the features above
+    __SSET_INFO = 0x00000037
+    __GSTRINGS = 0x0000001b
+    __GFEATURES = 0x0000003a
+    __ETH_SS_FEATURES = 4
+    __ETH_GSTRING_LEN = 32
+    __kernel_features = {
+        'gro': ('rx-gro',),
+        'tso': ('tx-tcp-segmentation', 'tx-tcp6-segmentation'),
+        'gso': ('tx-generic-segmentation',),
+        'lro': ('rx-lro',),
+        'ntuple': ('rx-ntuple-filter',),
+        'rxhash': ('rx-hashing',),
+    }
+
+    __adaptive_re = re.compile(r'^Adaptive RX:\s*(\S+)\s+TX:\s*(\S+)')
+
+    def __init__(self, iface):
+        self.__iface = iface
+        self.__cache = {}
+
+#### Public methods ############################
+    @property
+    def iface(self):
+        return self.__iface
+
+    def driver(self):
+        """
+        Return the driver name of the interface or None if it's not known.
+        """
+        return self.__get('driver', self.__read_driver, '-i', self.__parse_driver)
+
+    def rings(self):
+        """
+        Return the (maximums, current) tuple of the ring sizes dictionaries, e.g. ({'rx': 4096, 'tx': 4096, ...},
+        {'rx': 512, 'tx': 512, ...}). "n/a" values are None. Both are empty if the sizes are not reported.
+        """
+        return self.__get('rings', lambda: self.__read_preset_current(self.__RINGS, self.__ring_fields), '-g', self.__parse_preset_current)
+
+    def channels(self):
+        """
+        Return the (maximums, current) tuple of the channels count dictionaries, e.g. ({'combined': 63, ...},
+        {'combined': 8, ...}). "n/a" values are None. Both are empty if the channels are not reported.
+        """
+        return self.__get('channels', lambda: self.__read_preset_current(self.__CHANNELS, self.__channel_fields), '-l', self.__parse_preset_current)
+
+    def coalesce(self):
+        """
+        Return the interrupt coalescing parameters dictionary keyed by the 'ethtool -C' parameter names, e.g.
+        {'adaptive-rx': 'on', 'rx-usecs': '3', ...}. Parameters reported as "n/a" are omitted.
+        """
+        return self.__get('coalesce', self.__read_coalesce, '-c', self.__parse_coalesce)
+
+    def features(self):
+        """
+        Return the offload features dictionary: a feature name as 'ethtool -k' reports it to the (state, fixed) tuple,
+        e.g. {'large-receive-offload': ('off', True), ...}.
+        """
+        return self.__get('features', self.__read_features, '-k', self.__parse_features)
+
+    def is_set(self, option, params):
+        """
+        Check whether the given parameters of the given ethtool option (-G, -L, -C or -K) already have the given
+        values.
+
+        :param params: a dictionary of the parameters in the ethtool command line names, e.g. {'combined': '8'}
+        :return: True or False, None if it can't be checked
+        """
+        if option in ('-G', '-L'):
+            maximums, current = self.rings() if option == '-G' else self.channels()
+        elif option == '-C':
+            current = self.coalesce()
+        elif option == '-K':
+            current = { name : state for name, (state, fixed) in self.features().items() }
+            params = { Ethtool.feature_names.get(name, name) : value for name, value in params.items() }
+        else:
+            return None
+
+        if not current:
+            return None
+
+        return all(str(current.get(name)) == str(value) for name, value in params.items())
+
+    def set(self, args):
+        """
+        Change the settings according to the given ethtool command line arguments, e.g. ['-L', 'eth0', 'combined', '8'].
+
+        Raises an exception if the settings can't be changed.
+        """
+        if sysroot != '/':
+            raise Exception("{} settings can't be changed under the {} root".format(self.__iface, sysroot))
+
+        option, params = args[0], dict(zip(args[2::2], args[3::2]))
+        try:
+            if option == '-G':
+                self.__write_preset_current(self.__RINGS, self.__ring_fields, params)
+            elif option == '-L':
+                self.__write_preset_current(self.__CHANNELS, self.__channel_fields, params)
+            elif option == '-C':
+                self.__write_coalesce(params)
+            elif option == '-K':
+                self.__write_features(params)
+            else:
+                raise OSError("ethtool {} is not supported in-process".format(option))
+        except (OSError, KeyError, ValueError):
+            run_one_command(['ethtool'] + list(args), my_stderr=subprocess.DEVNULL)
+
+        self.__cache.clear()
+
+#### Private methods ############################
+    def __get(self, kind, ioctl_reader, option, parser):
+        """
+        Read the given kind of settings with the ioctl and fall back to parsing the output of 'ethtool <option>'.
+        """
+        if kind not in self.__cache and not is_live_host():
+            # There is no NIC behind a synthetic root: only its driver is known (from sysfs)
+            self.__cache[kind] = self.__sysfs_driver() if kind == 'driver' else parser('')
+
+        if kind not in self.__cache:
+            try:
+                self.__cache[kind] = ioctl_reader()
+            except OSError:
+                try:
+                    self.__cache[kind] = parser(run_one_command(['ethtool', option, self.__iface], my_stderr=subprocess.DEVNULL))
+                except:
+                    self.__cache[kind] = parser('')
+
+        return self.__cache[kind]
+
+    def __ioctl(self, cmd, fmt, values=None):
+        """
+        Issue the SIOCETHTOOL ioctl with the given command and the structure of the given layout (after the 'cmd'
+        field) and return the structure's fields.
+        """
+        data = ctypes.create_string_buffer(struct.pack('I' + fmt, cmd, *values) if values else struct.pack('I', cmd) + bytes(struct.calcsize('I' + fmt) - 4))
+        ifreq = struct.pack('16sP', self.__iface.encode(), ctypes.addressof(data))
+        ifreq += bytes(40 - len(ifreq))
+
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            fcntl.ioctl(sock.fileno(), self.__SIOCETHTOOL, ifreq)
+
+        return struct.unpack('I' + fmt, data.raw[:struct.calcsize('I' + fmt)])[1:]
+
+    def __sysfs_driver(self):
+        return nic_driver(self.__iface)
+
+    def __read_driver(self):
+        return self.__ioctl(self.__DRVINFO[0], self.__DRVINFO[2])[0].rstrip(b'\0').decode() or None
+
+    def __read_preset_current(self, cmds, fields):
+        values = self.__ioctl(cmds[0], cmds[2])
+        return dict(zip(fields, values[:len(fields)])), dict(zip(fields, values[len(fields):]))
+
+    def __write_preset_current(self, cmds, fields, params):
+        maximums, current = self.__read_preset_current(cmds, fields)
+        current.update({ field : int(params[field]) for field in fields if field in params })
+        if set(params) - set(fields):
+            raise KeyError("Unknown parameters: {}".format(", ".join(set(params) - set(fields))))
+
+        self.__ioctl(cmds[1], cmds[2], [ maximums[field] for field in fields ] + [ current[field] for field in fields ])
+
+    def __read_coalesce(self):
+        params = dict(zip(self.__coalesce_fields, self.__ioctl(self.__COALESCE[0], self.__COALESCE[2])))
+        for adaptive in ('adaptive-rx', 'adaptive-tx'):
+            params[adaptive] = 'on' if params[adaptive] else 'off'
+
+        return { name : str(value) for name, value in params.items() }
+
+    def __write_coalesce(self, params):
+        values = dict(zip(self.__coalesce_fields, self.__ioctl(self.__COALESCE[0], self.__COALESCE[2])))
+        for name, value in params.items():
+            if name not in values:
+                raise KeyError("Unknown parameter: {}".format(name))
+
+            values[name] = int(value == 'on') if name.startswith('adaptive-') else int(value)
+
+        self.__ioctl(self.__COALESCE[1], self.__COALESCE[2], [ values[name] for name in self.__coalesce_fields ])
+
+    def __read_features(self):
+        fixed = self.__read_fixed_features()
+
+        features = {}
+        for feature, cmds in self.__value_features.items():
+            features[Ethtool.feature_names[feature]] = ('on' if self.__ioctl(cmds[0], 'I')[0] else 'off', fixed[feature])
+
+        flags = self.__ioctl(self.__FLAGS[0], 'I')[0]
+        for feature, flag in self.__flag_features.items():
+            features[Ethtool.feature_names[feature]] = ('on' if flags & flag else 'off', fixed[feature])
+
+        return features
+
+    def __read_fixed_features(self):
+        """
+        Return a map of a feature (e.g. 'lro') to True if it can't be changed: none of its kernel feature bits is
+        available for changing or they have never been changed (the 'available' and 'never_changed' bits of
+        ETHTOOL_GFEATURES).
+
+        Raises an OSError if it can't be learned - a feature is never reported as not fixed when it's not known.
+        """
+        sset_mask, count = self.__ioctl(self.__SSET_INFO, 'IQI', [ 0, 1 << self.__ETH_SS_FEATURES, 0 ])[1:]
+        if not sset_mask & (1 << self.__ETH_SS_FEATURES):
+            raise OSError("{}: the features string set is not supported".format(self.__iface))
+
+        strings = self.__ioctl(self.__GSTRINGS, 'II{}s'.format(count * self.__ETH_GSTRING_LEN), [ self.__ETH_SS_FEATURES, count, b'' ])[2]
+        names = [ strings[i:i + self.__ETH_GSTRING_LEN].rstrip(b'\0').decode() for i in range(0, count * self.__ETH_GSTRING_LEN, self.__ETH_GSTRING_LEN) ]
+
+        # struct ethtool_get_features_block: 'available', 'requested', 'active' and 'never_changed' of every 32 bits
+        num_blocks = (count + 31) // 32
+        blocks = self.__ioctl(self.__GFEATURES, 'I{}I'.format(4 * num_blocks), [ num_blocks ] + [ 0 ] * 4 * num_blocks)[1:]
+        changeable = set()
+        for i, name in enumerate(names):
+            available, requested, active, never_changed = blocks[4 * (i // 32):4 * (i // 32) + 4]
+            if available & (1 << (i % 32)) and not never_changed & (1 << (i % 32)):
+                changeable.add(name)
+
+        fixed = {}
+        for feature, kernel_names in self.__kernel_features.items():
+            if not any(name in names for name in kernel_names):
+                raise OSError("{}: the kernel feature bits of '{}' are not known".format(self.__iface, feature))
+
+            fixed[feature] = not any(name in changeable for name in kernel_names)
+
+        return fixed
+
+    def __write_features(self, params):
+        for feature, state in params.items():
+            if feature in self.__value_features:
+                self.__ioctl(self.__value_features[feature][1], 'I', [ int(state == 'on') ])
+            elif feature in self.__flag_features:
+                flags = self.__ioctl(self.__FLAGS[0], 'I')[0]
+                flags = flags | self.__flag_features[feature] if state == 'on' else flags & ~self.__flag_features[feature]
+                self.__ioctl(self.__FLAGS[1], 'I', [ flags ])
+            else:
+                raise KeyError("Unknown feature: {}".format(feature))
+
+    @staticmethod
+    def __parse_driver(output):
+        for line in output.splitlines():
+            name, sep, value = line.partition(':')
+            if sep and name.strip() == 'driver':
+                return value.strip() or None
+
+        return None
+
+    @staticmethod
+    def __parse_preset_current(output):
+        """
+        Parse the 'ethtool -g' or 'ethtool -l' output: "Pre-set maximums:" and "Current hardware settings:" sections
+        of "RX Mini:	n/a"-like lines.
+        """
+        maximums, current = {}, {}
+        section = None
+        for line in output.splitlines():
+            name, sep, value = line.partition(':')
+            if not sep:
+                continue
+
+            if name.startswith('Pre-set maximums'):
+                section = maximums
+            elif name.startswith('Current hardware settings'):
+                section = current
+            elif section is not None and value.strip():
+                value = value.strip()
+                section[name.strip().lower().replace(' ', '-')] = int(value) if value.isdigit() else (None if value == 'n/a' else value)
+
+        return maximums, current
+
+    @staticmethod
+    def __parse_coalesce(output):
+        params = {}
+        for line in output.splitlines():
+            m = Ethtool.__adaptive_re.match(line)
+            if m:
+                params['adaptive-rx'], params['adaptive-tx'] = m.group(1), m.group(2)
+                continue
+
+            name, sep, value = line.partition(':')
+            if sep and value.strip():
+                params[name.strip()] = value.strip()
+
+        return { name : value for name, value in params.items() if value != 'n/a' }
+
+    @staticmethod
+    def __parse_features(output):
+        features = {}
+        for line in output.splitlines():
+            name, sep, value = line.partition(':')
+            if sep and value.split():
+                features[name.strip()] = (value.split()[0], '[fixed]' in value)
+
+        return features
+
+@functools.lru_cache(maxsize=None)
+def ethtool(iface):
+    """
+    Returns the Ethtool of the given interface - its settings are read only once per run and shared by all tuners.
+    """
+    return Ethtool(iface)
+
+################################################################################
+class PerThreadOutput:
+    """
+    A standard output replacement that collects what a thread prints into the thread's own buffer (see start() and
+    stop()). The output of threads that haven't started a buffer goes to the wrapped stream.
+    """
+    def __init__(self, stream):
+        self.__stream = stream
+        self.__local = threading.local()
+
+    def start(self):
+        self.__local.buffer = io.StringIO()
+
+    def stop(self):
+        """
+        Stop collecting the current thread's output and return it.
+        """
+        buffer = self.__local.buffer
+        self.__local.buffer = None
+        return buffer.getvalue()
+
+    def write(self, text):
+        buffer = getattr(self.__local, 'buffer', None)
+        return (self.__stream if buffer is None else buffer).write(text)
+
+    def flush(self):
+        self.__stream.flush()
+
+def plan_units(plan, units, jobs):
+    """
+    Plan the given independent units of work (e.g. bond slaves or disks) concurrently in a pool of up to 'jobs'
+    threads.
+
+    A unit is a function that adds its steps to the TuningPlan it's given. Every unit gets its own plan and its output
+    is collected separately: both are appended to the given plan and printed in the units' order, hence the result
+    doesn't depend on the timing. A 'write' of a file an earlier unit already writes is dropped - the first unit
+    wins just like when the units are planned one after another.
+
+    Must be called from the main thread.
+    """
+    output = PerThreadOutput(sys.stdout)
+
+    def plan_one_unit(unit):
+        unit_plan = TuningPlan()
+        output.start()
+        try:
+            unit(unit_plan)
+        finally:
+            unit_output = output.stop()
+
+        return unit_plan, unit_output
+
+    import concurrent.futures
+
+    with contextlib.redirect_stdout(output):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+            results = list(executor.map(plan_one_unit, units))
+
+    for unit_plan, unit_output in results:
+        sys.stdout.write(unit_output)
+        plan.extend(unit_plan, unique_writes=True)
+
+################################################################################
+class TuningPlan:
+    """
+    A complete, ordered list of configuration steps a tuning run is going to perform.
+
+    Tuners only compute the plan (see PerfTunerBase.plan()) - nothing is written to the system until apply() is
+    called. The plan can be serialized to JSON/YAML (--plan), stored and executed later (--apply).
+
+    Every step is a dictionary with a 'kind' key:
+      - comment:    {'message'} - a progress message printed when the plan is applied
+      - irqbalance: {'banned_irqs'} - ban the IRQs from being moved by irqbalance, an optional 'banned_cpus' CPU
+                    list sets IRQBALANCE_BANNED_CPUS too; irqbalance is restarted only if its configuration changes
+      - mask:       {'path', 'value'} - a CPU mask in the "List Format" for smp_affinity, rps_cpus, xps_cpus, etc.
+      - write:      {'path', 'value'} - a plain value for a sysfs/procfs file, e.g. rps_flow_cnt or queue/scheduler
+      - sysctl:     {'key', 'value'} - a kernel parameter, e.g. net.core.somaxconn
+      - sysctls:    {'values'} - a batch of kernel parameters applied as a whole: if one of them can't be written
+                    the ones written so far are rolled back
+      - ethtool:    {'iface', 'args'} - an ethtool invocation, e.g. ['-K', 'eth0', 'ntuple', 'on'] or
+                    ['-L', 'eth0', 'combined', '8'], failures are not fatal
+
+    mask and write steps may have a 'log_errors' boolean key - write errors are not reported when it's False.
+
+    After an IRQ's smp_affinity is written its effective_affinity_list is read back: a step the kernel has not
+    applied as requested is counted as failed.
+    """
+    version = 1
+    kinds = ('comment', 'irqbalance', 'mask', 'write', 'sysctl', 'sysctls', 'ethtool')
+    __irq_affinity_path_re = re.compile(r'^/proc/irq/(\d+)/smp_affinity$')
+
+    def __init__(self, steps=None, fingerprint=None):
+        self.__steps = list(steps) if steps else []
+        self.__fingerprint = fingerprint
+
+#### Public methods ############################
+    @property
+    def steps(self):
+        return self.__steps
+
+    @property
+    def fingerprint(self):
+        """
+        The fingerprint (see plan_fingerprint()) of the hardware the plan was computed for or None if it's unknown.
+        """
+        return self.__fingerprint
+
+    @fingerprint.setter
+    def fingerprint(self, fingerprint):
+        self.__fingerprint = fingerprint
+
+    def add_comment(self, message):
+        self.__steps.append({'kind': 'comment', 'message': message})
+
+    def add_irqbalance_ban(self, banned_irqs, banned_cpus=None):
+        step = {'kind': 'irqbalance', 'banned_irqs': list(banned_irqs)}
+        if banned_cpus is not None:
+            step['banned_cpus'] = banned_cpus.to_list_str()
+        self.__steps.append(step)
+
+    def add_mask(self, path, mask, log_errors=True):
+        step = {'kind': 'mask', 'path': path, 'value': mask.to_list_str()}
+        if not log_errors:
+            step['log_errors'] = False
+        self.__steps.append(step)
+
+    def add_write(self, path, value, log_errors=True):
+        step = {'kind': 'write', 'path': path, 'value': str(value)}
+        if not log_errors:
+            step['log_errors'] = False
+        self.__steps.append(step)
+
+    def add_sysctl(self, key, value):
+        self.__steps.append({'kind': 'sysctl', 'key': key, 'value': str(value)})
+
+    def add_sysctls(self, values):
+        """
+        Add a batch of kernel parameters (a sysctl key to value dictionary) applied in one pass with a rollback.
+        """
+        if values:
+            self.__steps.append({'kind': 'sysctls', 'values': { key : str(value) for key, value in values.items() }})
+
+    def add_ethtool(self, iface, args, description=None):
+        step = {'kind': 'ethtool', 'iface': iface, 'args': list(args)}
+        if description:
+            step['description'] = description
+        self.__steps.append(step)
+
+    def extend(self, other, unique_writes=False):
+        """
+        Append the steps of the given TuningPlan. With unique_writes 'write' steps of the files this plan already
+        writes are skipped.
+        """
+        written = { step['path'] for step in self.__steps if step['kind'] == 'write' } if unique_writes else set()
+        for step in other.to_dict()['steps']:
+            if unique_writes and step['kind'] == 'write':
+                if step['path'] in written:
+                    continue
+                written.add(step['path'])
+
+            self.__steps.append(step)
+
+    def targets(self):
+        """
+        Return the sorted list of the host paths the plan tunes: the sysfs/procfs files, the kernel parameters'
+        /proc/sys files and the NICs' /sys/class/net directories.
+        """
+        paths = set()
+        for step in self.__steps:
+            if step['kind'] in ('mask', 'write'):
+                paths.add(step['path'])
+            elif step['kind'] == 'sysctl':
+                paths.add(sysctl_path(step['key']))
+            elif step['kind'] == 'sysctls':
+                paths.update(sysctl_path(key) for key in step['values'])
+            elif step['kind'] == 'ethtool':
+                paths.add("/sys/class/net/{}".format(step['iface']))
+
+        return sorted(paths)
+
+    def irqs(self):
+        """
+        Return the sorted list of the IRQs the plan sets the affinity of or bans from irqbalance.
+        """
+        irqs = set()
+        for step in self.__steps:
+            if step['kind'] == 'irqbalance':
+                irqs.update(step['banned_irqs'])
+            elif step['kind'] == 'mask':
+                match = TuningPlan.__irq_affinity_path_re.match(step['path'])
+                if match:
+                    irqs.add(match.group(1))
+
+        return sorted(irqs, key=lambda irq: (len(irq), irq))
+
+    def to_dict(self):
+        plan = {'version': TuningPlan.version}
+        if self.__fingerprint is not None:
+            plan['fingerprint'] = self.__fingerprint
+        plan['steps'] = self.__steps
+
+        return plan
+
+    def dump(self, out_format='json'):
+        """
+        Return the plan serialized in the given format ('json' or 'yaml').
+        """
+        if out_format == 'yaml':
+            import yaml
+            return yaml.safe_dump(self.to_dict(), default_flow_style=False, sort_keys=False)
+
+        return json.dumps(self.to_dict(), indent=2)
+
+    @staticmethod
+    def load(plan_file):
+        """
+        Load the plan from the given JSON or YAML file (JSON is a subset of YAML).
+        """
+        import yaml
+
+        with open(plan_file, 'r') as f:
+            y = yaml.safe_load(f)
+
+        if not isinstance(y, dict) or 'steps' not in y:
+            raise Exception("Bad plan file {}: no 'steps' list".format(plan_file))
+
+        if y.get('version') != TuningPlan.version:
+            raise Exception("Bad plan file {}: unsupported version {}".format(plan_file, y.get('version')))
+
+        for step in y['steps']:
+            if step.get('kind') not in TuningPlan.kinds:
+                raise Exception("Bad plan file {}: unknown step {}".format(plan_file, step))
+
+        return TuningPlan(y['steps'], y.get('fingerprint'))
+
+    def check(self):
+        """
+        Compare every step with the current system state without changing anything.
+
+        :return: a drift report dictionary: 'drifted' - the list of the items that differ from the plan (see
+                 drift_item()), 'up_to_date' and 'unknown' - the numbers of the items that match the plan and of the
+                 ones whose state can't be learned
+        """
+        report = {'drifted': [], 'up_to_date': 0, 'unknown': 0}
+
+        for step in self.__steps:
+            if step['kind'] == 'comment':
+                continue
+
+            # Every kernel parameter of a batch is a separate item
+            items = [ {'kind': 'sysctl', 'key': key, 'value': value} for key, value in step['values'].items() ] if step['kind'] == 'sysctls' else [ step ]
+            for item in items:
+                up_to_date = TuningPlan.__irqbalance_is_up_to_date(item) if item['kind'] == 'irqbalance' else TuningPlan.is_up_to_date(item)
+                if up_to_date is None:
+                    report['unknown'] += 1
+                elif up_to_date:
+                    report['up_to_date'] += 1
+                else:
+                    report['drifted'].append(TuningPlan.drift_item(item))
+
+        return report
+
+    @staticmethod
+    def drift_item(step):
+        """
+        Describe the drift of the given step: a dictionary with the 'category' (irq, rps, xps, mask, scheduler,
+        block-queue, write, sysctl, ethtool or irqbalance), the configured 'target' (a file, a kernel parameter or an
+        interface), the 'expected' and the 'current' values.
+        """
+        kind = step['kind']
+
+        if kind == 'mask':
+            category = 'irq' if step['path'].startswith('/proc/irq/') else {'rps_cpus': 'rps', 'xps_cpus': 'xps'}.get(os.path.basename(step['path']), 'mask')
+            current = read_one_line(step['path'])
+            try:
+                current = CpuMask.from_mask_str(current).to_list_str()
+            except (AttributeError, ValueError):
+                pass
+
+            return {'category': category, 'target': step['path'], 'expected': step['value'], 'current': current}
+        elif kind == 'write':
+            if step['path'].endswith(os.path.join('queue', 'scheduler')):
+                category = 'scheduler'
+            elif os.path.basename(os.path.dirname(step['path'])) == 'queue':
+                category = 'block-queue'
+            else:
+                category = 'write'
+
+            return {'category': category, 'target': step['path'], 'expected': step['value'], 'current': read_one_line(step['path'])}
+        elif kind == 'sysctl':
+            return {'category': 'sysctl', 'target': step['key'], 'expected': step['value'], 'current': read_one_line(sysctl_path(step['key']))}
+        elif kind == 'ethtool':
+            return {'category': 'ethtool', 'target': step['iface'], 'expected': " ".join(step['args']), 'current': None}
+        elif kind == 'irqbalance':
+            current = "not banned: {}".format(", ".join(irqbalance_unbanned_irqs(step['banned_irqs']) or []))
+            if 'banned_cpus' not in step:
+                return {'category': 'irqbalance', 'target': 'banned IRQs', 'expected': list(step['banned_irqs']), 'current': current}
+
+            config = irqbalance_current_config()
+            banned_cpus = config.banned_cpus if config else None
+            return {'category': 'irqbalance', 'target': 'banned IRQs and CPUs',
+                    'expected': {'banned_irqs': list(step['banned_irqs']), 'banned_cpus': step['banned_cpus']},
+                    'current': {'banned_irqs': current, 'banned_cpus': banned_cpus.to_list_str() if banned_cpus is not None else None}}
+
+        return {'category': kind, 'target': None, 'expected': None, 'current': None}
+
+    def apply(self):
+        """
+        Execute all steps in order.
+
+        Steps whose current value already matches the planned one are skipped: e.g. rewriting an unchanged
+        smp_affinity would needlessly migrate the IRQ.
+
+        :return: a dictionary with the numbers of 'changed', 'unchanged' and 'failed' steps
+        """
+        summary = {'changed': 0, 'unchanged': 0, 'failed': 0}
+
+        for step in self.__steps:
+            result = TuningPlan.__apply_step(step)
+            if result is not None:
+                summary[result] += 1
+
+        print("Tuning plan applied: {changed} changed, {unchanged} unchanged, {failed} failed".format(**summary))
+        return summary
+
+    @staticmethod
+    def is_up_to_date(step):
+        """
+        Check if the system already has the value the given step is going to configure.
+
+        Values are compared after the normalization: masks are compared as CPU sets, selection lists like
+        "mq-deadline [none]" are reduced to the selected value and white spaces are collapsed.
+
+        :return: True or False, or None if the current value can't be learned
+        """
+        kind = step['kind']
+
+        if kind == 'mask':
+            current = read_one_line(step['path'])
+            if current is None:
+                return None
+
+            try:
+                return CpuMask.from_mask_str(current) == CpuMask.from_list_str(step['value'])
+            except ValueError:
+                return None
+        elif kind in ('write', 'sysctl'):
+            current = read_one_line(step['path'] if kind == 'write' else sysctl_path(step['key']))
+            if current is None:
+                return None
+
+            return TuningPlan.__normalize_value(current) == TuningPlan.__normalize_value(step['value'])
+        elif kind == 'sysctls':
+            up_to_date = [ TuningPlan.is_up_to_date({'kind': 'sysctl', 'key': key, 'value': value}) for key, value in step['values'].items() ]
+            return None if None in up_to_date else all(up_to_date)
+        elif kind == 'ethtool':
+            return TuningPlan.__ethtool_is_up_to_date(step['iface'], step['args'])
+
+        return None
+
+#### Private methods ############################
+    @staticmethod
+    def __normalize_value(value):
+        # A selection list, e.g. "mq-deadline kyber [none]" - the selected value is in brackets
+        m = re.search(r'\[(\S+)\]', value)
+        if m:
+            return m.group(1)
+
+        return " ".join(value.split())
+
+    @staticmethod
+    def __irqbalance_is_up_to_date(step):
+        return irqbalance_is_configured(step['banned_irqs'], TuningPlan.__banned_cpus(step))
+
+    @staticmethod
+    def __banned_cpus(step):
+        return CpuMask.from_list_str(step['banned_cpus']) if 'banned_cpus' in step else None
+
+    @staticmethod
+    def __apply_sysctls(values):
+        """
+        Write the kernel parameters that differ from the given values. If one of them fails the ones that have been
+        written so far get their original values back.
+
+        :return: True if all parameters have been set and False otherwise
+        """
+        originals = {}
+        for key, value in values.items():
+            current = read_one_line(sysctl_path(key))
+            if current is not None and TuningPlan.__normalize_value(current) == TuningPlan.__normalize_value(value):
+                continue
+
+            if current is None or not fwriteln_and_log(sysctl_path(key), value):
+                if originals:
+                    print("Failed to set {}: rolling back {} kernel parameters".format(key, len(originals)))
+                    for written_key, original in reversed(list(originals.items())):
+                        fwriteln_and_log(sysctl_path(written_key), original)
+
+                return False
+
+            originals[key] = current
+
+        return True
+
+    @staticmethod
+    def __ethtool_is_up_to_date(iface, args):
+        """
+        Rings (-G), channels (-L), coalescing (-C) and feature toggles (-K) may be checked: the current values are
+        read again on every check.
+        """
+        if len(args) < 2 or args[1] != iface:
+            return None
+
+        return Ethtool(iface).is_set(args[0], dict(zip(args[2::2], args[3::2])))
+
+    @staticmethod
+    def __apply_step(step):
+        """
+        :return: 'changed', 'unchanged' or 'failed' for steps that configure something and None for comments
+        """
+        kind = step['kind']
+
+        if kind == 'comment':
+            print(step['message'])
+            return None
+
+        if kind == 'irqbalance':
+            return 'changed' if restart_irqbalance(step['banned_irqs'], TuningPlan.__banned_cpus(step)) else 'unchanged'
+
+        if kind not in TuningPlan.kinds:
+            raise Exception("Unknown tuning plan step: {}".format(step))
+
+        if TuningPlan.is_up_to_date(step):
+            return 'unchanged'
+
+        if kind == 'mask':
+            mask = CpuMask.from_list_str(step['value'])
+            m = TuningPlan.__irq_affinity_path_re.match(step['path'])
+            try:
+                written = set_one_mask(step['path'], mask, log_errors=step.get('log_errors', True), raise_errnos=(errno.EIO,) if m else ())
+            except OSError:
+                # The kernel refuses to change the affinity of the IRQs it manages (see irq_is_managed())
+                print("IRQ {} is managed by the kernel (setting its affinity failed with EIO), leaving its affinity intact".format(m.group(1)))
+                learn_managed_irq(m.group(1))
+                return 'unchanged'
+
+            # Make sure the kernel has actually applied the requested IRQ affinity
+            if m:
+                if not written and step.get('log_errors', True):
+                    effective = irq_affinity(m.group(1), effective=True)
+                    print("IRQ {}: the affinity has not been changed{}".format(m.group(1), ", the effective affinity is {}".format(effective.to_list_str()) if effective else ""))
+                elif not verify_irq_affinity(m.group(1), mask):
+                    written = False
+        elif kind == 'write':
+            written = fwriteln_and_log(step['path'], step['value'], log_errors=step.get('log_errors', True))
+        elif kind == 'sysctl':
+            written = fwriteln_and_log(sysctl_path(step['key']), step['value'])
+        elif kind == 'sysctls':
+            written = TuningPlan.__apply_sysctls(step['values'])
+        else: # kind == 'ethtool'
+            print("{}...".format(step.get('description', "Running 'ethtool {}'".format(" ".join(step['args'])))), end='')
+            try:
+                Ethtool(step['iface']).set(step['args'])
+                print("ok")
+                written = True
+            except:
+                print("not supported")
+                written = False
+
+        return 'changed' if written else 'failed'
+
+################################################################################
+class CloudInstance:
+    """
+    The cloud instance perftune runs on, recognized by its DMI (SMBIOS) attributes in /sys/class/dmi/id and by the
+    models of its NVMe drives - the cloud's metadata server is never queried:
+      - AWS Nitro instances: 'Amazon EC2' sys_vendor, the instance type is the product_name, e.g. i3en.2xlarge
+      - AWS Xen instances (e.g. i3.4xlarge): the Xen version in bios_version ends with '.amazon', the instance type
+        is not known
+      - GCP: 'Google' sys_vendor, local SSDs are 'nvme_card' NVMe drives; the machine type is not known
+      - Azure: the Azure chassis_asset_tag, the local NVMe drives of the storage optimized sizes (Lsv3 and newer) are
+        'Microsoft NVMe Direct Disk' ones; the VM size is not known
+
+    The instance's tuning profile is the merge of the 'default' profile, the cloud's one and the instance's own one
+    if there is one (see instance_profiles).
+
+    The instance type can only change across reboots, hence what is learned on a live host is cached in /run for the
+    rest of the boot.
+    """
+    # Tuning profiles of the recognized instances:
+    #   - nvme_fast_path_only: distribute only the IRQs of the NVMe queues 1..<number of CPUs>
+    #   - default_mode:        the mode to use when none is given instead of the one computed from the NICs and disks,
+    #                          except on hosts with up to small_host_pus CPUs, e.g. the smallest sizes of a family
+    #   - nic_driver_profiles: per-driver overrides of NetPerfTuner.nic_driver_profiles for --nic-settings
+    # Profiles may be overridden in the 'instance_profiles' section of the --options-file.
+    instance_profiles = {
+        'default': {
+            'nvme_fast_path_only': False,
+            'default_mode': None,
+            'nic_driver_profiles': {},
+        },
+        'aws': {},
+        # Xen over-allocates NVMe HW queues on AWS i3 non-metal instances and only queues 1..<number of CPUs> are
+        # used for data transfer
+        'aws-xen': {
+            'nvme_fast_path_only': True,
+        },
+        # Nitro storage optimized families. Their instance store NVMe drives have a queue per CPU, and the largest
+        # sizes have two NUMA nodes with the drives spread over both. ENA often doesn't report its speed, so the
+        # default mode computed for the NIC would assume 10G and reserve a single core on the first node: reserve a
+        # core on every node instead. The ENA NIC settings are NetPerfTuner's 'ena' ones.
+        #
+        # i3 is on Nitro only as i3.metal: 2 sockets, 25G
+        'aws-i3': {
+            'nvme_fast_path_only': False,
+            'default_mode': 'irq_cores:1',
+        },
+        # up to 2 sockets and 100G (i3en.24xlarge)
+        'aws-i3en': {
+            'nvme_fast_path_only': False,
+            'default_mode': 'irq_cores:1',
+        },
+        # up to 2 sockets and 75G (i4i.32xlarge)
+        'aws-i4i': {
+            'nvme_fast_path_only': False,
+            'default_mode': 'irq_cores:1',
+        },
+        # Graviton2 has no SMT, so a core is a single CPU: reserve two of them, up to 100G (im4gn.16xlarge) on a single
+        # socket
+        'aws-im4gn': {
+            'nvme_fast_path_only': False,
+            'default_mode': 'irq_threads:2',
+        },
+        # gVNIC ring sizes are set when the VM is created and it has no adaptive interrupt moderation
+        'gcp': {
+            'nic_driver_profiles': {
+                'gve': {'rings': None, 'coalesce': {}},
+            },
+        },
+        # VMs with local SSDs (e.g. n2, up to 2 sockets): gVNIC doesn't report its speed either, reserve a core on
+        # every node for the IRQs of the SSDs and of the gVNIC queues
+        'gcp-local-ssd': {
+            'nvme_fast_path_only': False,
+            'default_mode': 'irq_cores:1',
+        },
+        # netvsc rings are sized by the host and it has no interrupt coalescing settings
+        'azure': {
+            'nic_driver_profiles': {
+                'hv_netvsc': {'rings': None, 'coalesce': {}},
+            },
+        },
+        # Storage optimized sizes (Lsv3 and newer): local NVMe drives, up to 2 sockets (L80s_v3), netvsc doesn't report
+        # its speed: reserve a core on every node
+        'azure-lsv3': {
+            'nvme_fast_path_only': False,
+            'default_mode': 'irq_cores:1',
+        },
+    }
+
+    # Hosts with up to that many CPUs use the computed default mode ('mq') whatever their profile's default_mode is:
+    # reserving CPUs for IRQs there costs more than it gains
+    small_host_pus = 4
+
+    cache_file = '/run/perftune-instance.json'
+    __aws_nitro_families = ('i3', 'i3en', 'i4i', 'im4gn')
+    __azure_asset_tag = '7783-7084-3265-9085-8269-3286-77'
+
+    def __init__(self, cloud=None, instance_type=None, profile=None):
+        self.__cloud = cloud
+        self.__instance_type = instance_type
+        self.__profile = profile
+
+#### Public methods ############################
+    @staticmethod
+    def learn():
+        """
+        Return the CloudInstance of this host: the one cached in /run on a live host or the one recognized by its DMI
+        attributes (which is cached then).
+        """
+        if is_live_host():
+            try:
+                with open(CloudInstance.cache_file, 'r') as f:
+                    cached = json.load(f)
+
+                # The profile may be gone since the instance was cached
+                if cached['profile'] is None or cached['profile'] in CloudInstance.instance_profiles:
+                    return CloudInstance(cached['cloud'], cached['instance_type'], cached['profile'])
+            except (OSError, ValueError, KeyError, TypeError):
+                pass
+
+        instance = CloudInstance.__detect()
+        if is_live_host():
+            try:
+                with open(CloudInstance.cache_file, 'w') as f:
+                    json.dump({'cloud': instance.cloud, 'instance_type': instance.instance_type, 'profile': instance.profile_name}, f)
+            except OSError:
+                pass
+
+        return instance
+
+    @property
+    def cloud(self):
+        """
+        'aws', 'gcp', 'azure' or None if it's not a recognized cloud instance.
+        """
+        return self.__cloud
+
+    @property
+    def instance_type(self):
+        """
+        The instance type, e.g. i3en.2xlarge, or None if it's not known.
+        """
+        return self.__instance_type
+
+    @property
+    def profile_name(self):
+        """
+        The name of the instance's own profile in instance_profiles or None if there isn't one.
+        """
+        return self.__profile
+
+    def profile(self, overrides):
+        """
+        Return the instance's tuning profile with the given overrides (a map of a profile name to the settings to
+        override, e.g. from the --options-file) applied.
+        """
+        for name, settings in overrides.items():
+            if name not in CloudInstance.instance_profiles:
+                raise Exception("Unknown instance profile '{}', supported profiles are: {}".format(name, ", ".join(CloudInstance.instance_profiles.keys())))
+
+            for setting in settings:
+                if setting not in CloudInstance.instance_profiles['default']:
+                    raise Exception("Unknown instance profile setting '{}' in '{}'".format(setting, name))
+
+        profile = {}
+        for name in ('default', self.__cloud, self.__profile):
+            if name is not None:
+                profile.update(CloudInstance.instance_profiles[name])
+                profile.update(overrides.get(name, {}))
+
+        return profile
+
+    @staticmethod
+    def default_mode(profile, cpu_mask):
+        """
+        Return the given profile's default mode for the given CPUs or None if the computed one is to be used.
+        """
+        if cpu_topology().number_of_pus(cpu_mask) <= CloudInstance.small_host_pus:
+            return None
+
+        return profile['default_mode']
+
+#### Private methods ############################
+    @staticmethod
+    def __detect():
+        dmi = { name: (read_one_line("/sys/class/dmi/id/{}".format(name)) or '').strip() for name in ('sys_vendor', 'product_name', 'bios_version', 'chassis_asset_tag') }
+        nvme_models = { (read_one_line(model) or '').strip() for model in host_glob('/sys/class/nvme/*/model') }
+
+        if dmi['sys_vendor'] == 'Amazon EC2':
+            instance_type = dmi['product_name'] or None
+            family = instance_type.split('.')[0] if instance_type else None
+            return CloudInstance('aws', instance_type, "aws-{}".format(family) if family in CloudInstance.__aws_nitro_families else None)
+
+        if dmi['bios_version'].endswith('.amazon'):
+            return CloudInstance('aws', None, 'aws-xen')
+
+        if dmi['sys_vendor'] == 'Google':
+            return CloudInstance('gcp', None, 'gcp-local-ssd' if 'nvme_card' in nvme_models else None)
+
+        if dmi['chassis_asset_tag'] == CloudInstance.__azure_asset_tag:
+            return CloudInstance('azure', None, 'azure-lsv3' if 'Microsoft NVMe Direct Disk' in nvme_models else None)
+
+        return CloudInstance()
+
+@functools.lru_cache(maxsize=None)
+def cloud_instance():
+    """
+    Returns the CloudInstance of this host - it's learned only once per run and shared by all tuners.
+    """
+    return CloudInstance.learn()
+
+################################################################################
+class TuningMode:
+    """
+    A configuration mode: the CPUs reserved for IRQs, the rest of the CPUs of --cpu-mask are the compute ones. If
+    nothing is reserved (the 'mq' mode) IRQs are distributed among all CPUs.
+
+    The named modes (PerfTunerBase.SupportedModes) reserve exactly the given CPUs of --cpu-mask: 'sq' - PU:0,
+    'sq_split' - core:0 and 'sq_split_2numa' - core:0 of the first two packages (hwloc-calc '~PU:0' and '~core:0').
+    If --cpu-mask has none of them there are no IRQ CPUs and the mode is rejected. The parametric ones reserve the
+    given number of cores or hyperthreads on every NUMA node or, with ':local', only on the nodes of the tuned devices.
+    They are taken in the logical order among the node's CPUs of --cpu-mask:
+        irq_cores:<N>[:local]
+        irq_threads:<M>[:local]
+    """
+    __parametric_re = re.compile(r"^irq_(cores|threads):([1-9]\d*)(:local)?$")
+
+    def __init__(self, name, reservations, cpus=None):
+        """
+        :param reservations: a map of a NUMA node to the (cores, threads) tuple reserved for IRQs on it
+        :param cpus: the CpuMask of the CPUs reserved for IRQs whatever the nodes' reservations are
+        """
+        self.__name = name
+        self.__reservations = { node: reservation for node, reservation in reservations.items() if any(reservation) }
+        self.__cpus = cpus or CpuMask()
+
+#### Public methods ############################
+    @staticmethod
+    def is_valid(name):
+        return name in PerfTunerBase.SupportedModes.names() or TuningMode.__parametric_re.match(name) is not None
+
+    @staticmethod
+    def is_local(name):
+        """
+        Return True if the given mode depends on the NUMA nodes of the tuned devices.
+        """
+        m = TuningMode.__parametric_re.match(name)
+        return m is not None and m.group(3) is not None
+
+    @staticmethod
+    def from_name(name, local_nodes=None):
+        """
+        Return the mode with the given name on this host's topology.
+
+        :param local_nodes: the NUMA nodes of the tuned devices for the ':local' modes - all nodes are used if none
+                            of them is known
+        """
+        topology = cpu_topology()
+
+        m = TuningMode.__parametric_re.match(name)
+        if m:
+            nodes = set(topology.numa_nodes.keys())
+            if m.group(3):
+                nodes = (nodes & set(local_nodes or [])) or nodes
+
+            reservation = (int(m.group(2)), 0) if m.group(1) == 'cores' else (0, int(m.group(2)))
+            return TuningMode(name, { node: reservation for node in nodes })
+
+        if name not in PerfTunerBase.SupportedModes.names():
+            raise Exception("Unsupported mode: {}".format(name))
+
+        mode = PerfTunerBase.SupportedModes[name]
+        cpus = CpuMask()
+        if mode == PerfTunerBase.SupportedModes.sq:
+            # CPU0
+            cpus = topology.pu(0)
+        elif mode == PerfTunerBase.SupportedModes.sq_split:
+            # CPU0 and its HT siblings
+            cpus = topology.core(0)
+        elif mode == PerfTunerBase.SupportedModes.sq_split_2numa:
+            # CPU0 and its HT siblings on each of the first two packages
+            cpus = topology.core(0, package=0) | topology.core(0, package=1)
+
+        return TuningMode(name, {}, cpus)
+
+    @staticmethod
+    def merge(modes, cpu_mask):
+        """
+        Merge the modes of several tuners (or NICs) into one that reserves on every NUMA node the most cores and the
+        most hyperthreads any of them does and all the CPUs any of them reserves, i.e. the union of their IRQ CPUs.
+        One of the given modes is returned if it reserves the same CPUs.
+        """
+        reservations = {}
+        cpus = CpuMask()
+        for mode in modes:
+            cpus = cpus | mode.cpus
+            for node, (cores, threads) in mode.reservations.items():
+                merged_cores, merged_threads = reservations.get(node, (0, 0))
+                reservations[node] = (max(merged_cores, cores), max(merged_threads, threads))
+
+        merged = TuningMode("+".join(sorted(set(mode.name for mode in modes))), reservations, cpus)
+        irq_cpus = merged.irq_cpus(cpu_mask)
+        return next((mode for mode in modes if mode.irq_cpus(cpu_mask) == irq_cpus), merged)
+
+    @property
+    def name(self):
+        return self.__name
+
+    @property
+    def reservations(self):
+        return self.__reservations
+
+    @property
+    def cpus(self):
+        return self.__cpus
+
+    def reserves_cpus(self):
+        """
+        Return True if the mode reserves CPUs for IRQs, i.e. it's not the 'mq' one.
+        """
+        return bool(self.__reservations) or bool(self.__cpus)
+
+    def irq_cpus(self, cpu_mask):
+        """
+        Return the CPUs of the given mask reserved for IRQs - an empty mask if nothing is reserved.
+        """
+        topology = cpu_topology()
+        irq_cpus = self.__cpus & cpu_mask
+        for node, (cores, threads) in self.__reservations.items():
+            node_cores = topology.cores_of(cpu_mask & topology.numa_nodes.get(node, CpuMask()))
+            pus = list(itertools.chain.from_iterable(node_cores))
+            irq_cpus = irq_cpus | CpuMask.from_cpus(pus[:max(sum(len(core) for core in node_cores[:cores]), threads)])
+
+        return irq_cpus
+
+    def __eq__(self, other):
+        return isinstance(other, TuningMode) and self.__name == other.__name and self.__reservations == other.__reservations and self.__cpus == other.__cpus
+
+    def __hash__(self):
+        return hash(self.__name)
+
+    def __str__(self):
+        return self.__name
+
+################################################################################
+class PerfTunerBase(metaclass=abc.ABCMeta):
+    # Kernel parameters a tuner wants: a sysctl key to a value or to a sizing rule - a function of the NIC speed (in
+    # Mb/s, None for tuners that don't deal with NICs) and the number of CPUs. A None value leaves the parameter
+    # intact. Values may be overridden in the 'sysctls' section of the --options-file.
+    sysctl_profile = {}
+
+    def __init__(self, args):
+        self.__args = args
+        self.__args.cpu_mask = cpu_topology().restrict(self.__args.cpu_mask)
+        self.__mode = None
+        self.__compute_cpu_mask = None
+        self.__irq_cpu_mask = None
+        self.__sysctls = None
+
+#### Public methods ##########################
+    class SupportedModes(enum.IntEnum):
+        """
+        The named modes. Modes are ordered from the one that cuts the biggest number of CPUs
+        from the compute CPUs' set to the one that takes the smallest ('mq' doesn't
+        cut any CPU from the compute set).
+
+        The modes of different tuners are merged with TuningMode.merge(), see TuningMode for the parametric modes.
+        """
+        sq_split = 0
+        sq = 1
+        mq = 2
+        sq_split_2numa = 3
+
+        @staticmethod
+        def names():
+            return PerfTunerBase.SupportedModes.__members__.keys()
+
+    @staticmethod
+    def cpu_mask_is_zero(cpu_mask):
+        """
+        We want to estimate if the whole mask is all-zeros.
+        :param cpu_mask: CpuMask instance
+        :return: True if mask is zero, False otherwise
+        """
+        return not cpu_mask
+
+    @staticmethod
+    def compute_cpu_mask_for_mode(mq_mode, cpu_mask):
+        mq_mode = PerfTunerBase.to_mode(mq_mode)
+
+        # all but the CPUs reserved for IRQs
+        irqs_cpu_mask = cpu_mask - mq_mode.irq_cpus(cpu_mask)
+
+        if PerfTunerBase.cpu_mask_is_zero(irqs_cpu_mask):
+            raise Exception("Bad configuration mode ({}) and cpu-mask value ({}): this results in a zero-mask for "
+                            "compute".format(mq_mode.name, cpu_mask))
+
+        return irqs_cpu_mask
+
+    @staticmethod
+    def irqs_cpu_mask_for_mode(mq_mode, cpu_mask):
+        mq_mode = PerfTunerBase.to_mode(mq_mode)
+        irqs_cpu_mask = 0
+
+        if mq_mode.reserves_cpus():
+            irqs_cpu_mask = cpu_mask - PerfTunerBase.compute_cpu_mask_for_mode(mq_mode, cpu_mask)
+        else: # 'mq'
+            # distribute equally between all available cores
+            irqs_cpu_mask = cpu_mask
+
+        if PerfTunerBase.cpu_mask_is_zero(irqs_cpu_mask):
+            raise Exception("Bad configuration mode ({}) and cpu-mask value ({}): this results in a zero-mask for "
+                            "IRQs".format(mq_mode.name, cpu_mask))
+
+        return irqs_cpu_mask
+
+    @staticmethod
+    def to_mode(mode, local_nodes=None):
+        """
+        Return the TuningMode of the given TuningMode, SupportedModes value or mode name.
+        """
+        if isinstance(mode, TuningMode):
+            return mode
+
+        return TuningMode.from_name(mode.name if isinstance(mode, PerfTunerBase.SupportedModes) else mode, local_nodes)
+
+    @property
+    def mode(self):
+        """
+        Return the configuration mode (a TuningMode)
+        """
+        # Make sure the configuration mode is set (see the __set_mode_and_masks() description).
+        if self.__mode is None:
+            self.__set_mode_and_masks()
+
+        return self.__mode
+
+    @mode.setter
+    def mode(self, new_mode):
+        """
+        Set the new configuration mode and recalculate the corresponding masks.
+        """
+        # Make sure the new_mode is a TuningMode
+        self.__mode = PerfTunerBase.to_mode(new_mode, self._get_numa_nodes())
+        self.__compute_cpu_mask = PerfTunerBase.compute_cpu_mask_for_mode(self.__mode, self.__args.cpu_mask)
+        self.__irq_cpu_mask = PerfTunerBase.irqs_cpu_mask_for_mode(self.__mode, self.__args.cpu_mask)
+
+    @property
+    def compute_cpu_mask(self):
+        """
+        Return the CPU mask to use for seastar application binding.
+        """
+        # see the __set_mode_and_masks() description
+        if self.__compute_cpu_mask is None:
+            self.__set_mode_and_masks()
+
+        return self.__compute_cpu_mask
+
+    @property
+    def irqs_cpu_mask(self):
+        """
+        Return the mask of CPUs used for IRQs distribution.
+        """
+        # see the __set_mode_and_masks() description
+        if self.__irq_cpu_mask is None:
+            self.__set_mode_and_masks()
+
+        return self.__irq_cpu_mask
+
+    @property
+    def instance_profile(self):
+        """
+        :return: the tuning profile of the cloud instance we are running on (see CloudInstance)
+        """
+        return cloud_instance().profile(self.__args.instance_profiles)
+
+    @property
+    def numa_local(self):
+        """
+        :return: True if devices' IRQs, RPS and XPS should be placed on the CPUs of the device's NUMA node first
+        """
+        return self.__args.numa_local
+
+    @property
+    def irq_load(self):
+        """
+        :return: the IrqLoad to place IRQs by if the load-aware IRQs placement was requested and None otherwise
+        """
+        if self.__args.irq_placement != 'load':
+            return None
+
+        return irq_load(self.__args.load_sample_window or 1.0)
+
+    @property
+    def args(self):
+        return self.__args
+
+    @property
+    def irqs(self):
+        return self._get_irqs()
+
+    @property
+    def irq_jobs(self):
+        """
+        The number of IRQ distribution units (e.g. bond slaves) that may be planned concurrently: the load-aware
+        placement accumulates the predicted load in the placement order, hence it's planned sequentially.
+        """
+        return 1 if self.irq_load is not None else self.args.jobs
+
+    def sysctls(self):
+        """
+        Return the kernel parameters of this tuner: its sysctl_profile with the --options-file overrides applied and
+        the sizing rules resolved.
+        """
+        if self.__sysctls is None:
+            nic_speed = self._get_nic_speed()
+            num_PUs = cpu_topology().number_of_pus(self.args.cpu_mask)
+
+            self.__sysctls = {}
+            for key, value in self.sysctl_profile.items():
+                value = self.args.sysctls.get(key, value)
+                if callable(value):
+                    value = value(nic_speed, num_PUs)
+
+                if value is not None:
+                    self.__sysctls[key] = str(value)
+
+        return self.__sysctls
+
+    def tune(self):
+        """
+        Compute the tuning plan and apply it right away.
+        """
+        plan = TuningPlan()
+        self.plan(plan)
+        plan.add_sysctls(self.sysctls())
+        plan.apply()
+
+#### "Protected"/Public (pure virtual) methods ###########
+    @abc.abstractmethod
+    def plan(self, plan):
+        """
+        Add all configuration steps of this tuner to the given TuningPlan. Nothing is written to the system.
+        """
+        pass
+
+    @abc.abstractmethod
+    def _get_def_mode(self):
+        """
+        Return a default configuration mode.
+        """
+        pass
+
+    @abc.abstractmethod
+    def _get_irqs(self):
+        """
+        Return the iteratable value with all IRQs to be configured.
+        """
+        pass
+
+    def _get_nic_speed(self):
+        """
+        Return the speed (in Mb/s) of the tuned NIC the sysctl_profile rules are sized for or None.
+        """
+        return None
+
+    def _get_numa_nodes(self):
+        """
+        Return the NUMA nodes of the tuned devices the ':local' modes reserve IRQ CPUs on or None if not known.
+        """
+        return None
+
+#### Private methods ############################
+    def __set_mode_and_masks(self):
+        """
+        Sets the configuration mode and the corresponding CPU masks. We can't
+        initialize them in the constructor because the default mode may depend
+        on the child-specific values that are set in its constructor.
+
+        That's why we postpone the mode's and the corresponding masks'
+        initialization till after the child instance creation.
+        """
+        if self.__args.mode:
+            self.mode = self.__args.mode
+        elif CloudInstance.default_mode(self.instance_profile, self.__args.cpu_mask):
+            self.mode = CloudInstance.default_mode(self.instance_profile, self.__args.cpu_mask)
+        else:
+            self.mode = self._get_def_mode()
+
+#################################################
+class NicIrqClassifier:
+    """
+    Classifies the IRQs of a NIC driver by their names (the actions in /proc/interrupts): whether an IRQ is a fast
+    path one, the role of its queue - 'rx', 'tx' or 'rxtx' for a combined queue - and the queue index. It also knows
+    the number of RSS queues the driver's HW supports.
+
+    The fast path IRQs are the ones that match one of the (regex, role) patterns, the first one that matches counts.
+    The regex's group, if any, is the queue index. A None role marks a fast path IRQ that doesn't serve a queue, e.g.
+    Intel's Flow Director one.
+    """
+    def __init__(self, patterns, max_rss_queues=None):
+        self.__patterns = [ (re.compile(regex), role) for regex, role in patterns ]
+        self.__max_rss_queues = max_rss_queues
+
+#### Public methods ############################
+    @property
+    def max_rss_queues(self):
+        """
+        The number of RSS queues the HW supports or None if it's not limited.
+        """
+        return self.__max_rss_queues
+
+    def classify(self, irq2actions):
+        """
+        Classify the IRQs of a single NIC.
+
+        :param irq2actions: a map of an IRQ to the list of its actions
+        :return: a map of every fast path IRQ to its (role, queue index) tuple, the index is None if it's not known
+        """
+        irq2class = {}
+        for irq, actions in irq2actions.items():
+            irq_class = self.classify_one(actions)
+            if irq_class is not None:
+                irq2class[irq] = irq_class
+
+        return irq2class
+
+    def classify_one(self, actions):
+        """
+        :return: the (role, queue index) tuple of the IRQ with the given actions or None if it's not a fast path one
+        """
+        for regex, role in self.__patterns:
+            for action in actions:
+                m = regex.search(action)
+                if m:
+                    return role, int(m.group(1)) if m.groups() else None
+
+        return None
+
+class GveIrqClassifier(NicIrqClassifier):
+    """
+    Google gVNIC IRQs are notification blocks (gve-ntfy-blk<index>@pci:<address>): the first half of them serves the
+    TX queues and the second half the RX queues.
+    """
+    def __init__(self):
+        super().__init__([ (r"^gve\-ntfy\-blk(\d+)@", 'rxtx') ])
+
+    def classify(self, irq2actions):
+        irq2class = super().classify(irq2actions)
+        num_tx_blocks = len(irq2class) // 2
+
+        return { irq: ('tx', block) if block < num_tx_blocks else ('rx', block - num_tx_blocks) for irq, (role, block) in irq2class.items() }
+
+class NetPerfTuner(PerfTunerBase):
+    __queue_dir_re = re.compile(r"/queues/[rt]x\-(\d+)/")
+
+    # Intel drivers name their fast path IRQs <bla-bla>-TxRx-<index> (or -rx-<index>/-tx-<index> for separate
+    # vectors), the Flow Director IRQ (<bla-bla>:fdir-TxRx-<index>) is distributed with them but serves no queue
+    __intel_patterns = [ (r"fdir\-TxRx\-\d+", None), (r"\-TxRx\-(\d+)", 'rxtx'), (r"\-rx\-(\d+)$", 'rx'), (r"\-tx\-(\d+)$", 'tx') ]
+
+    # IRQ classifiers of NIC drivers, by the name of the driver's /sys/class/net/<iface>/device/driver symlink.
+    # Drivers that are not listed use the 'default' one. If no IRQ of a NIC is classified as a fast path one all its
+    # IRQs are distributed.
+    nic_irq_classifiers = {
+        'default': NicIrqClassifier([ (r"fdir\-TxRx\-\d+", None), (r"(?:\-TxRx\-|\-fp\-|\-Tx\-Rx\-)(\d+)", 'rxtx'), (r"\-TxRx\-|\-fp\-|\-Tx\-Rx\-", 'rxtx') ]),
+        # Intel: the RSS limits of the PF and VF NICs
+        'ixgbe': NicIrqClassifier(__intel_patterns, max_rss_queues=16),
+        'ixgbevf': NicIrqClassifier(__intel_patterns, max_rss_queues=4),
+        'i40e': NicIrqClassifier(__intel_patterns, max_rss_queues=64),
+        'i40evf': NicIrqClassifier(__intel_patterns, max_rss_queues=16),
+        'iavf': NicIrqClassifier(__intel_patterns, max_rss_queues=16),
+        'ice': NicIrqClassifier(__intel_patterns),
+        'igb': NicIrqClassifier(__intel_patterns),
+        # Broadcom
+        'bnx2x': NicIrqClassifier([ (r"\-fp\-(\d+)", 'rxtx') ]),
+        'bnxt_en': NicIrqClassifier([ (r"\-TxRx\-(\d+)", 'rxtx'), (r"\-rx\-(\d+)$", 'rx'), (r"\-tx\-(\d+)$", 'tx') ]),
+        # Mellanox: completion vectors, the async (control) one is not a fast path IRQ
+        'mlx5_core': NicIrqClassifier([ (r"^mlx5_comp(\d+)@", 'rxtx') ]),
+        # AWS ENA: the management IRQ is not a fast path one
+        'ena': NicIrqClassifier([ (r"\-Tx\-Rx\-(\d+)", 'rxtx') ]),
+        # virtio-net: virtio<N>-input.<index> and virtio<N>-output.<index>, the config IRQ is not a fast path one
+        'virtio_net': NicIrqClassifier([ (r"\-input\.(\d+)$", 'rx'), (r"\-output\.(\d+)$", 'tx') ]),
+        'gve': GveIrqClassifier(),
+        # Xen netfront with split event channels: <iface>-q<index>-rx and <iface>-q<index>-tx
+        'vif': NicIrqClassifier([ (r"\-q(\d+)\-rx$", 'rx'), (r"\-q(\d+)\-tx$", 'tx'), (r"\-rx$", 'rx'), (r"\-tx$", 'tx') ]),
+    }
+
+    # Per-driver NIC settings applied with --nic-settings:
+    #   - rings:    RX/TX ring sizes (ethtool -G): 'max' or a number (limited by the NIC's maximum)
+    #   - coalesce: interrupt coalescing (ethtool -C) parameters, the ones the NIC doesn't report are skipped
+    #   - features: offloads (ethtool -K), the ones the NIC doesn't support or has fixed are skipped
+    # Drivers that are not listed use the 'default' settings.
+    nic_driver_profiles = {
+        'default': {
+            'rings': 'max',
+            'coalesce': {'adaptive-rx': 'on', 'adaptive-tx': 'on'},
+            'features': {'gro': 'on', 'lro': 'off', 'tso': 'on'},
+        },
+        # ixgbe has no adaptive moderation: rx-usecs 1 selects its dynamic ITR mode
+        'ixgbe': {
+            'rings': 'max',
+            'coalesce': {'rx-usecs': '1'},
+            'features': {'gro': 'on', 'lro': 'off', 'tso': 'on'},
+        },
+        'ena': {
+            'rings': 'max',
+            'coalesce': {'adaptive-rx': 'on'},
+            'features': {'gro': 'on', 'tso': 'on'},
+        },
+        # virtio rings are sized by the hypervisor and there is no interrupt moderation to speak of
+        'virtio_net': {
+            'rings': None,
+            'coalesce': {},
+            'features': {'gro': 'on', 'tso': 'on'},
+        },
+    }
+
+    # Speed assumed for sizing when the NIC doesn't report one, e.g. for virtio
+    __default_nic_speed = 10000
+
+    # NIC speed (in Mb/s) a single core reserved for IRQs is assumed to handle when the default mode is computed
+    __irq_core_speed = 25000
+
+    sysctl_profile = {
+        # Increase the socket listen() backlog
+        'net.core.somaxconn': '4096',
+        # Increase the maximum number of remembered connection requests, which are still
+        # did not receive an acknowledgment from connecting client.
+        'net.ipv4.tcp_max_syn_backlog': '4096',
+        # RFS flows table: 32768 entries or 2048 per CPU on larger machines (a power of 2)
+        'net.core.rps_sock_flow_entries': lambda speed, cpus: max(32768, 1 << (2048 * cpus - 1).bit_length()),
+        # Packets a CPU may queue while its NAPI poll is behind: the kernel's 1000 per Gb/s
+        'net.core.netdev_max_backlog': lambda speed, cpus: max(1000, speed),
+        # Packets a NET_RX softirq may process in one run: twice the kernel's 300 for 25G and faster NICs
+        'net.core.netdev_budget': lambda speed, cpus: 300 if speed < 25000 else 600,
+        # Busy polling trades CPU time for latency - it's left to the user
+        'net.core.busy_read': None,
+        'net.core.busy_poll': None,
+        # Socket buffers: the bandwidth-delay product of a 10ms round trip, at least 16MB
+        'net.core.rmem_max': lambda speed, cpus: max(16 << 20, bdp_bytes(speed)),
+        'net.core.wmem_max': lambda speed, cpus: max(16 << 20, bdp_bytes(speed)),
+        'net.ipv4.tcp_rmem': lambda speed, cpus: "4096 87380 {}".format(max(16 << 20, bdp_bytes(speed))),
+        'net.ipv4.tcp_wmem': lambda speed, cpus: "4096 65536 {}".format(max(16 << 20, bdp_bytes(speed))),
+        # The TCP memory pressure thresholds are sized by the kernel according to the amount of RAM
+        'net.ipv4.tcp_mem': None,
+    }
+
+    def __init__(self, args, nic, mode=None):
+        super().__init__(args)
+
+        self.__nic = nic
+        self.__irq_cpus = None
+        self.__nic_is_bond_iface = self.__check_dev_is_bond_iface()
+        self.__slaves = self.__learn_slaves()
+
+        # check that self.nic is either a HW device or a bonding interface
+        self.__check_nic()
+
+        self.__interrupts = interrupt_table()
+        self.__irq2class = {}
+        self.__nic2irqs = self.__learn_irqs()
+
+        # The NIC's own mode (--nic <name>:<mode>) overrides the --mode and the default one
+        if mode:
+            self.mode = mode
+
+#### Public methods ############################
+    def plan(self, plan):
+        """
+        Plan the networking server configuration.
+        """
+        if self.__irq_cpus is not None:
+            plan.add_comment("{}: IRQ CPUs {}".format(self.nic, self.nic_irqs_cpu_mask.to_list_str()))
+
+        if self.nic_is_hw_iface:
+            plan.add_comment("Setting a physical interface {}...".format(self.nic))
+            self.__setup_one_hw_iface(plan, self.nic)
+        else:
+            plan.add_comment("Setting {} bonding interface...".format(self.nic))
+            self.__setup_bonding_iface(plan)
+
+    def plan_nic_settings(self, plan):
+        """
+        Plan only the NICs' ethtool settings (--nic-settings): rings, channels, coalescing and offloads.
+
+        Changing the number of channels changes the NIC's IRQs, hence these settings have to be applied before the
+        IRQs are learned in order to get the rest of the configuration right.
+        """
+        for iface in self.ifaces:
+            self.__setup_nic_settings(plan, iface)
+
+    @property
+    def nic_is_bond_iface(self):
+        return self.__nic_is_bond_iface
+
+    @property
+    def nic(self):
+        return self.__nic
+
+    @property
+    def nic_irqs_cpu_mask(self):
+        """
+        Return the mask of CPUs this NIC's IRQs are distributed among: its share of the IRQ CPUs when several NICs
+        are tuned (see split_irq_cpus()) or all IRQ CPUs.
+        """
+        if self.__irq_cpus is None:
+            return self.irqs_cpu_mask
+
+        return (self.__irq_cpus & self.irqs_cpu_mask) or self.irqs_cpu_mask
+
+    @nic_irqs_cpu_mask.setter
+    def nic_irqs_cpu_mask(self, cpu_mask):
+        self.__irq_cpus = cpu_mask
+
+    @property
+    def ifaces(self):
+        """
+        Return the list of the physical interfaces of this NIC: the NIC itself or the bond's physical slaves.
+        """
+        return [ self.nic ] if self.nic_is_hw_iface else list(filter(self.__dev_is_hw_iface, self.slaves))
+
+    @property
+    def nic_is_hw_iface(self):
+        return self.__dev_is_hw_iface(self.nic)
+
+    @property
+    def slaves(self):
+        """
+        Returns an iterator for all slaves of the NIC.
+        If the NIC is not a bonding interface an attempt to use the returned iterator
+        will immediately raise a StopIteration exception - use __dev_is_bond_iface() check to avoid this.
+        """
+        return iter(self.__slaves)
+
+#### Protected methods ##########################
+    def _get_def_mode(self):
+        """
+        Returns the default configuration mode: 'mq' on small hosts or if every CPU has its own Rx queue, 'sq' if there
+        are only a few cores. Otherwise a core per __irq_core_speed of the NIC's speed (but not more cores than the NIC
+        has Rx queues) is reserved for IRQs: 'sq_split' if it's a single core, N cores on every NUMA node
+        ('irq_cores:<N>') otherwise - but not more than an eighth of a node's cores.
+        """
+        topology = cpu_topology()
+        rx_queues_counts = [ self.__get_rx_queue_count(iface) for iface in self.ifaces ]
+        num_cores = topology.number_of_cores(self.args.cpu_mask)
+        num_PUs = topology.number_of_pus(self.args.cpu_mask)
+
+        if num_PUs <= 4 or all(rx_queues_count == num_PUs for rx_queues_count in rx_queues_counts):
+            return PerfTunerBase.SupportedModes.mq
+        elif num_cores <= 4:
+            return PerfTunerBase.SupportedModes.sq
+
+        irq_cores = min(-(-self._get_nic_speed() // self.__irq_core_speed), sum(rx_queues_counts))
+        nodes = [ pus & self.args.cpu_mask for pus in topology.numa_nodes.values() if pus & self.args.cpu_mask ]
+        cores_per_node = min(-(-irq_cores // len(nodes)), min(topology.number_of_cores(pus) for pus in nodes) // 8)
+        if irq_cores <= 1 or cores_per_node <= 1 and len(nodes) == 1:
+            return PerfTunerBase.SupportedModes.sq_split
+
+        return 'irq_cores:{}'.format(max(1, cores_per_node))
+
+    def _get_irqs(self):
+        """
+        Returns the iterator for all IRQs that are going to be configured for this NIC.
+        For instance, for a bonding interface that's going to include IRQs of all its slaves.
+        """
+        return itertools.chain.from_iterable(self.__nic2irqs.values())
+
+    def _get_nic_speed(self):
+        """
+        The speed of a bonding interface is the sum of its physical slaves' speeds.
+        """
+        return sum(nic_speed(iface) or self.__default_nic_speed for iface in self.ifaces) or self.__default_nic_speed
+
+    def _get_numa_nodes(self):
+        nodes = [ read_numa_node("/sys/class/net/{}/device".format(iface)) for iface in self.ifaces ]
+        return [ node for node in nodes if node is not None ] or None
+
+#### Private methods ############################
+    @property
+    def __rfs_table_size(self):
+        return int(self.sysctls().get('net.core.rps_sock_flow_entries', 32768))
+
+    def __check_nic(self):
+        """
+        Checks that self.nic is a supported interface
+        """
+        if not self.nic_is_hw_iface and not self.nic_is_bond_iface:
+            raise Exception("Not supported virtual device {}".format(self.nic))
+
+    def __get_irqs_one(self, iface):
+        """
+        Returns the list of IRQ numbers for the given interface.
+        """
+        return self.__nic2irqs[iface]
+
+    def __setup_rfs(self, plan, iface):
+        rps_limits = host_glob("/sys/class/net/{}/queues/*/rps_flow_cnt".format(iface))
+        one_q_limit = int(self.__rfs_table_size / len(rps_limits))
+
+        # If RFS feature is not present - get out
+        if not host_exists(sysctl_path('net.core.rps_sock_flow_entries')):
+            return
+
+        # RFS is enabled by the net.core.rps_sock_flow_entries kernel parameter (see sysctl_profile)
+
+        # Set each RPS queue limit
+        for rfs_limit_cnt in rps_limits:
+            plan.add_write(rfs_limit_cnt, one_q_limit)
+
+        # Enable ntuple filtering HW offload on the NIC
+        plan.add_ethtool(iface, ['-K', iface, 'ntuple', 'on'], description="Trying to enable ntuple filtering HW offload for {}".format(iface))
+
+    def __setup_rps(self, plan, iface, mask):
+        for one_rps_cpus in self.__get_rps_cpus(iface):
+            plan.add_mask(one_rps_cpus, mask)
+
+        self.__setup_rfs(plan, iface)
+
+    def __setup_xps(self, plan, iface, cpu_mask):
+        xps_cpus_list = host_glob("/sys/class/net/{}/queues/*/xps_cpus".format(iface))
+        masks = cpu_topology().distribute(len(xps_cpus_list), restrict=cpu_mask, single=False)
+
+        for i, mask in enumerate(masks):
+            plan.add_mask(xps_cpus_list[i], mask)
+
+    def __dev_is_hw_iface(self, iface):
+        return host_exists("/sys/class/net/{}/device".format(iface))
+
+    def __check_dev_is_bond_iface(self):
+        if not host_exists('/sys/class/net/bonding_masters'):
+            return False
+
+        return any([re.search(self.nic, line) for line in readlines('/sys/class/net/bonding_masters')])
+
+    def __learn_slaves(self):
+        if self.nic_is_bond_iface:
+            return list(itertools.chain.from_iterable([ line.split() for line in readlines("/sys/class/net/{}/bonding/slaves".format(self.nic)) ]))
+
+        return []
+
+    def __irq_classifier(self, iface):
+        """
+        Return the NicIrqClassifier of the given interface's driver (see nic_irq_classifiers).
+        """
+        return self.nic_irq_classifiers.get(nic_driver(iface), self.nic_irq_classifiers['default'])
+
+    def __learn_irqs_one(self, iface):
+        """
+        This is a slow method that is going to read from the system files. Never
+        use it outside the initialization code. Use __get_irqs_one() instead.
+
+        Filter the fast path queues IRQs from the __get_all_irqs_one() result with the classifier of the interface's
+        driver (see nic_irq_classifiers).
+
+        If as a result all IRQs are filtered out (if there are no IRQs with the names the classifier knows) then
+        this means that the given NIC uses a different IRQs naming pattern. In this case we won't filter any IRQ.
+
+        The IRQs that handle Rx are going to be at the beginning of the list (ordered by their queue index), then the
+        Tx ones and then the ones that serve no queue - so that NICs with a limited number of Rx queues or with
+        separate Rx and Tx IRQs can distribute their Rx IRQs separately.
+        """
+        # filter 'all_irqs' to only reference IRQs present in /proc/interrupts and avoid a KeyError on the 'irqs' search below
+        all_irqs = set(learn_all_irqs_one("/sys/class/net/{}/device".format(iface), self.__interrupts, iface)).intersection(self.__interrupts.keys())
+        irq2class = self.__irq_classifier(iface).classify({ irq: self.__interrupts.actions(irq) for irq in all_irqs })
+        if not irq2class:
+            return sorted(all_irqs, key=lambda irq: (len(irq), irq))
+
+        self.__irq2class.update(irq2class)
+        role_order = {'rx': 0, 'rxtx': 0, 'tx': 1}
+
+        def irq_order(irq):
+            role, queue = irq2class[irq]
+            return (role_order.get(role, 2), sys.maxsize if queue is None else queue, len(irq), irq)
+
+        return sorted(irq2class.keys(), key=irq_order)
+
+    def __has_tx_only_irqs(self, iface):
+        """
+        Returns True if the given interface has separate Tx IRQs.
+        """
+        return any(self.__irq2class.get(irq, (None, None))[0] == 'tx' for irq in self.__get_irqs_one(iface))
+
+    def __learn_irqs(self):
+        """
+        This is a slow method that is going to read from the system files. Never
+        use it outside the initialization code.
+        """
+        if self.nic_is_bond_iface:
+            return { slave : self.__learn_irqs_one(slave) for slave in filter(self.__dev_is_hw_iface, self.slaves) }
+        else:
+            return { self.nic : self.__learn_irqs_one(self.nic) }
+
+    def __get_rps_cpus(self, iface):
+        """
+        Prints all rps_cpus files names for the given HW interface.
+
+        There is a single rps_cpus file for each RPS queue and there is a single RPS
+        queue for each HW Rx queue. Each HW Rx queue should have an IRQ.
+        Therefore the number of these files is equal to the number of fast path Rx IRQs for this interface.
+        """
+        return host_glob("/sys/class/net/{}/queues/*/rps_cpus".format(iface))
+
+    def __setup_nic_settings(self, plan, iface):
+        """
+        Plan the ethtool settings of the given interface that differ from its current ones: the ring sizes and the
+        offloads and coalescing of its driver's profile (nic_driver_profiles), and the number of combined channels
+        matching the number of the IRQ CPUs.
+        """
+        nic = ethtool(iface)
+        driver = nic.driver()
+        profile = dict(self.nic_driver_profiles.get(driver, self.nic_driver_profiles['default']))
+        profile.update(self.instance_profile['nic_driver_profiles'].get(driver, {}))
+        plan.add_comment("Setting NIC parameters of {} (driver {})...".format(iface, driver))
+
+        # Combined channels: one per IRQ CPU, but not more than the NIC (or its RSS) supports
+        max_channels, cur_channels = nic.channels()
+        if max_channels.get('combined'):
+            combined = min(max_channels['combined'], self.__max_rx_queue_count(iface), cpu_topology().number_of_pus(self.nic_irqs_cpu_mask))
+            if combined != cur_channels.get('combined'):
+                plan.add_comment("{}: changing the number of combined channels from {} to {} - the number of IRQ CPUs".format(iface, cur_channels.get('combined'), combined))
+                plan.add_ethtool(iface, ['-L', iface, 'combined', str(combined)], description="Setting {} combined channels for {}".format(combined, iface))
+        else:
+            plan.add_comment("{}: combined channels are not supported - not changing channels".format(iface))
+
+        # Rings
+        max_rings, cur_rings = nic.rings()
+        ring_args = []
+        if profile['rings'] is not None:
+            for ring in ('rx', 'tx'):
+                if not isinstance(max_rings.get(ring), int) or max_rings[ring] <= 0:
+                    continue
+
+                size = max_rings[ring] if profile['rings'] == 'max' else min(int(profile['rings']), max_rings[ring])
+                if size != cur_rings.get(ring):
+                    ring_args += [ ring, str(size) ]
+
+        if ring_args:
+            plan.add_ethtool(iface, ['-G', iface] + ring_args, description="Setting {} rings of {}".format(" ".join(ring_args), iface))
+
+        # Interrupt coalescing
+        coalesce = nic.coalesce()
+        coalesce_args = list(itertools.chain.from_iterable((param, value) for param, value in profile['coalesce'].items()
+                                                           if param in coalesce and coalesce[param] != value))
+        if coalesce_args:
+            plan.add_ethtool(iface, ['-C', iface] + coalesce_args, description="Setting {} interrupt coalescing of {}".format(" ".join(coalesce_args), iface))
+
+        # Offloads
+        features = nic.features()
+        feature_args = []
+        for feature, state in profile['features'].items():
+            current = features.get(Ethtool.feature_names.get(feature, feature))
+            if current is not None and not current[1] and current[0] != state:
+                feature_args += [ feature, state ]
+
+        if feature_args:
+            plan.add_ethtool(iface, ['-K', iface] + feature_args, description="Setting {} offloads of {}".format(" ".join(feature_args), iface))
+
+    def __setup_one_hw_iface(self, plan, iface):
+        max_num_rx_queues = self.__max_rx_queue_count(iface)
+        all_irqs = self.__get_irqs_one(iface)
+        numa_node = read_numa_node("/sys/class/net/{}/device".format(iface)) if self.numa_local else None
+
+        # Bind the NIC's IRQs according to the configuration mode
+        #
+        # If this NIC has a limited number of Rx queues or separate Rx and Tx IRQs then we want to distribute the Rx
+        # IRQs separately. We've sorted IRQs list so that IRQs that handle Rx are all at the head of the list.
+        if max_num_rx_queues < len(all_irqs) or self.__has_tx_only_irqs(iface):
+            num_rx_queues = self.__get_rx_queue_count(iface)
+            plan.add_comment("Distributing IRQs handling Rx:")
+            placements = distribute_irqs(plan, all_irqs[0:num_rx_queues], self.nic_irqs_cpu_mask, load=self.irq_load, numa_node=numa_node)
+            plan.add_comment("Distributing the rest of IRQs")
+            placements += distribute_irqs(plan, all_irqs[num_rx_queues:], self.nic_irqs_cpu_mask, load=self.irq_load, numa_node=numa_node)
+        else:
+            plan.add_comment("Distributing all IRQs")
+            placements = distribute_irqs(plan, all_irqs, self.nic_irqs_cpu_mask, load=self.irq_load, numa_node=numa_node)
+
+        if self.numa_local:
+            report_irqs_locality(plan, iface, numa_node, placements)
+
+        if self.args.queue_symmetric:
+            self.__setup_symmetric_queues(plan, iface, placements, numa_node)
+        else:
+            self.__setup_rps(plan, iface, numa_local_mask(self.compute_cpu_mask, numa_node))
+            self.__setup_xps(plan, iface, numa_local_mask(self.args.cpu_mask, numa_node))
+
+    def __queue_files(self, iface, file_name):
+        """
+        Return a map of a queue index to its file (e.g. rps_cpus in queues/rx-<index>/ or xps_cpus in queues/tx-<index>/).
+        """
+        queue_files = {}
+        for queue_file in host_glob("/sys/class/net/{}/queues/*/{}".format(iface, file_name)):
+            m = self.__queue_dir_re.search(queue_file)
+            if m:
+                queue_files[int(m.group(1))] = queue_file
+
+        return queue_files
+
+    def __group_cpus_by_queue(self, queue2cpu, cpu_mask):
+        """
+        Split the CPUs of the given mask between queues: every CPU goes to the queue whose IRQ CPU is topologically
+        closest to it (see CpuTopology.cpu_distance()), ties are broken by the group size and then by the queue index.
+
+        :param queue2cpu: a map of a queue index to the CPU its IRQ is bound to
+        :return: a map of a queue index to the CpuMask of its CPUs
+        """
+        topology = cpu_topology()
+        groups = { queue : CpuMask() for queue in queue2cpu.keys() }
+
+        for cpu in cpu_mask:
+            queue = min(queue2cpu.keys(), key=lambda q: (topology.cpu_distance(cpu, queue2cpu[q]), len(groups[q]), q))
+            groups[queue] = groups[queue] | CpuMask.from_cpus([ cpu ])
+
+        return groups
+
+    def __setup_symmetric_queues(self, plan, iface, placements, numa_node):
+        """
+        Make queue i's IRQ CPU, its xps_cpus and its rps_cpus one consistent mapping: the CPUs (of --cpu-mask) are
+        split between queues by their proximity to the queue's IRQ CPU, and this group is used both for
+        transmitting on queue i (XPS) and for the RPS processing of packets received on queue i.
+
+        Queues are identified by the indexes the NIC's IRQ classifier gives their IRQs, IRQs that serve no known
+        queue are left out. If no IRQ of the NIC has a queue index the IRQs' positions are used instead.
+
+        For RPS only the compute CPUs of the group are used (unless there are none).
+        """
+        queue2cpu = {}
+        for irq, mask in placements:
+            queue = self.__irq2class.get(irq, (None, None))[1]
+            if queue is not None:
+                queue2cpu.setdefault(queue, mask.first())
+
+        if not queue2cpu:
+            for position, (irq, mask) in enumerate(placements):
+                queue2cpu[position] = mask.first()
+
+        if not queue2cpu:
+            self.__setup_rps(plan, iface, numa_local_mask(self.compute_cpu_mask, numa_node))
+            self.__setup_xps(plan, iface, numa_local_mask(self.args.cpu_mask, numa_node))
+            return
+
+        groups = self.__group_cpus_by_queue(queue2cpu, numa_local_mask(self.args.cpu_mask, numa_node))
+        queues = sorted(groups.keys())
+
+        def queue_group(idx):
+            return groups[idx] if idx in groups else groups[queues[idx % len(queues)]]
+
+        plan.add_comment("Queue-symmetric mapping for {}:\n{}".format(iface, "\n".join(
+            "  queue {}: IRQ CPU {}, CPUs {}".format(queue, queue2cpu[queue], groups[queue].to_list_str()) for queue in queues)))
+
+        for idx, xps_cpus in sorted(self.__queue_files(iface, 'xps_cpus').items()):
+            plan.add_mask(xps_cpus, queue_group(idx))
+
+        for idx, rps_cpus in sorted(self.__queue_files(iface, 'rps_cpus').items()):
+            group = queue_group(idx)
+            plan.add_mask(rps_cpus, (group & self.compute_cpu_mask) or group)
+
+        self.__setup_rfs(plan, iface)
+
+    def __setup_bonding_iface(self, plan):
+        def setup_slave(plan, slave):
+            if self.__dev_is_hw_iface(slave):
+                plan.add_comment("Setting up {}...".format(slave))
+                self.__setup_one_hw_iface(plan, slave)
+            else:
+                plan.add_comment("Skipping {} (not a physical slave device?)".format(slave))
+
+        plan_units(plan, [ functools.partial(setup_slave, slave=slave) for slave in self.slaves ], self.irq_jobs)
+
+    def __max_rx_queue_count(self, iface):
+        """
+        :param iface: Interface to check
+        :return: The maximum number of RSS queues for the given interface if there is known limitation (due to lack of
+        RSS bits, see the max_rss_queues of nic_irq_classifiers) and sys.maxsize otherwise.
+        """
+        return self.__irq_classifier(iface).max_rss_queues or sys.maxsize
+
+    def __get_rx_queue_count(self, iface):
+        """
+        :return: the RSS Rx queues count for the given interface.
+        """
+        num_irqs = len(self.__get_irqs_one(iface))
+        rx_queues_count = len(self.__get_rps_cpus(iface))
+
+        if rx_queues_count == 0:
+            rx_queues_count = num_irqs
+
+        return min(self.__max_rx_queue_count(iface), rx_queues_count)
+
+#################################################
+class SysfsBlockDevice:
+    """
+    The part of the pyudev.Device interface perftune uses (sys_path, device_node and parent) learned directly from
+    sysfs: used when there is no udev to ask, e.g. under a synthetic --root.
+    """
+    def __init__(self, sys_path):
+        self.__sys_path = sys_path
+
+    @staticmethod
+    def from_device_file(dev_node):
+        """
+        Return the device of the given device node, e.g. /dev/sda1 or /dev/mapper/vg-data.
+        """
+        class_link = "/sys/class/block/{}".format(os.path.basename(host_realpath(dev_node)))
+        if not host_exists(class_link):
+            raise LookupError("No block device for {}".format(dev_node))
+
+        return SysfsBlockDevice(host_realpath(class_link))
+
+    @staticmethod
+    def from_device_number(dev_number):
+        """
+        Return the block device with the given device number (e.g. os.stat().st_dev).
+        """
+        dev_link = "/sys/dev/block/{}:{}".format(os.major(dev_number), os.minor(dev_number))
+        if not host_exists(dev_link):
+            raise LookupError("No block device {}".format(dev_link))
+
+        return SysfsBlockDevice(host_realpath(dev_link))
+
+#### Public methods ############################
+    @property
+    def sys_path(self):
+        return self.__sys_path
+
+    @property
+    def device_node(self):
+        """
+        The device node from the uevent's DEVNAME or None if the device has none (e.g. a PCI device).
+        """
+        for line in readlines(os.path.join(self.__sys_path, 'uevent')):
+            key, _, value = line.strip().partition('=')
+            if key == 'DEVNAME':
+                return os.path.join('/dev', value)
+
+        return None
+
+    @property
+    def parent(self):
+        """
+        The closest ancestor directory that is a device (has a uevent file) or None.
+        """
+        path = os.path.dirname(self.__sys_path)
+        while path.startswith('/sys/devices/'):
+            if host_exists(os.path.join(path, 'uevent')):
+                return SysfsBlockDevice(path)
+
+            path = os.path.dirname(path)
+
+        return None
+
+#################################################
+class BlockDeviceGraph:
+    """
+    A per-run cache of the udev block devices graph.
+
+    Every device is looked up in udev only once: its sys_path, device node and the chain of its ancestors are
+    remembered, and so are the results of the "closest ancestor with a given feature" lookups, e.g. the
+    queue/scheduler file of /dev/md0 member partitions.
+
+    Without a udev context the devices are learned from sysfs (see SysfsBlockDevice).
+
+    The graph may be used by several threads: udev lookups are serialized since a udev context is not thread safe.
+    """
+    def __init__(self, pyudev_ctx=None):
+        self.__ctx = pyudev_ctx
+        self.__udev_lock = threading.Lock()
+        self.__node2device = {}
+        self.__node2ancestors = {}
+        self.__feature_cache = {}
+
+#### Public methods ############################
+    def device(self, dev_node):
+        """
+        Return the pyudev.Device of the given device node, e.g. /dev/sda1.
+        """
+        with self.__udev_lock:
+            device = self.__node2device.get(dev_node)
+            if device is None:
+                if self.__ctx:
+                    import pyudev
+                    device = pyudev.Device.from_device_file(self.__ctx, dev_node)
+                else:
+                    device = SysfsBlockDevice.from_device_file(dev_node)
+                self.__node2device[dev_node] = device
+
+            return device
+
+    def device_from_number(self, dev_number):
+        """
+        Return the pyudev.Device of the block device with the given device number (e.g. os.stat().st_dev).
+        """
+        with self.__udev_lock:
+            if self.__ctx:
+                import pyudev
+                device = pyudev.Device.from_device_number(self.__ctx, 'block', dev_number)
+            else:
+                device = SysfsBlockDevice.from_device_number(dev_number)
+            if device.device_node is not None:
+                self.__node2device.setdefault(device.device_node, device)
+
+            return device
+
+    def ancestors(self, dev_node):
+        """
+        Return the list of (sys_path, device node) tuples of the given device and all its ancestors starting from
+        the device itself. Ancestors without a device node have None as a device node.
+        """
+        chain = self.__node2ancestors.get(dev_node)
+        if chain is None:
+            chain = []
+            device = self.device(dev_node)
+            with self.__udev_lock:
+                while device is not None:
+                    chain.append((device.sys_path, device.device_node))
+                    device = device.parent
+
+            self.__node2ancestors[dev_node] = chain
+
+        return chain
+
+    def feature_file(self, dev_node, feature):
+        """
+        Find the closest ancestor with the given feature and return its ('feature file', 'device node') tuple.
+
+        If there isn't such an ancestor - return (None, None) tuple.
+
+        :param dev_node Device node file name, e.g. /dev/sda1
+        :param feature A feature file name relative to the device system directory, e.g. queue/scheduler
+        """
+        key = (dev_node, feature)
+        if key not in self.__feature_cache:
+            self.__feature_cache[key] = next(((os.path.join(sys_path, feature), node) for sys_path, node in self.ancestors(dev_node)
+                                              if node is not None and host_exists(os.path.join(sys_path, feature))), (None, None))
+
+        return self.__feature_cache[key]
+
+#################################################
+class DiskPerfTuner(PerfTunerBase):
+    class SupportedDiskTypes(enum.IntEnum):
+        nvme = 0
+        non_nvme = 1
+
+    __nvme_irq_re = re.compile(r'^nvme\d+q(\d+)$')
+    __ephemeral_model_re = re.compile(r'Amazon EC2 NVMe Instance Storage|nvme_card|Microsoft NVMe Direct Disk')
+
+    # Block queue tuning profiles: a map of a queue/<setting> file name to its value. The built-in values may be
+    # overridden in the 'block_profiles' section of the --options-file. Special values:
+    #   - None:        leave the setting intact
+    #   - max_hw:      the device's queue/max_hw_sectors_kb
+    #   - queue_depth: the SCSI device's device/queue_depth
+    #
+    # write_cache is left intact by the built-in profiles: switching a volatile cache to "write through" makes the
+    # kernel stop sending cache flushes to the device.
+    block_profiles = {
+        # rotational disks
+        'default': {
+            'nomerges': '2',
+        },
+        'nvme': {
+            'read_ahead_kb': '8',
+            'max_sectors_kb': 'max_hw',
+            'rq_affinity': '2',
+            'nr_requests': None,
+            'write_cache': None,
+            'wbt_lat_usec': '0',
+            'iostats': '1',
+            'nomerges': '2',
+        },
+        'ssd': {
+            'read_ahead_kb': '8',
+            'max_sectors_kb': 'max_hw',
+            'rq_affinity': '2',
+            'nr_requests': 'queue_depth',
+            'write_cache': None,
+            'wbt_lat_usec': '0',
+            'iostats': '1',
+            'nomerges': '2',
+        },
+        # md/dm volumes: read_ahead_kb and max_sectors_kb are also set on the volume's members
+        'raid': {
+            'read_ahead_kb': '128',
+            'max_sectors_kb': 'max_hw',
+            'iostats': '1',
+            'nomerges': '2',
+        },
+        # instances' local NVMe disks, e.g. AWS instance store, GCP local SSD, Azure NVMe direct disks
+        'ephemeral': {
+            'read_ahead_kb': '0',
+            'max_sectors_kb': 'max_hw',
+            'rq_affinity': '2',
+            'nr_requests': None,
+            'write_cache': None,
+            'wbt_lat_usec': '0',
+            'iostats': '1',
+            'nomerges': '2',
+        },
+    }
+
+    sysctl_profile = {
+        # Start the background writeback of dirty pages early and throttle the writers before the page cache of the
+        # data disks accumulates more than they can flush in a reasonable time
+        'vm.dirty_background_ratio': '5',
+        'vm.dirty_ratio': '10',
+    }
+
+    # RAID volume settings that are applied to its members too
+    __raid_member_settings = ('read_ahead_kb', 'max_sectors_kb')
+
+    def __init__(self, args):
+        super().__init__(args)
+
+        if not (self.args.dirs or self.args.devs):
+            raise Exception("'disks' tuning was requested but neither directories nor storage devices were given")
+
+        # udev knows nothing about the devices of a synthetic root
+        if is_live_host():
+            import pyudev
+            self.__pyudev_ctx = pyudev.Context()
+        else:
+            self.__pyudev_ctx = None
+        self.__devices = BlockDeviceGraph(self.__pyudev_ctx)
+        self.__disk2numa = {}
+        self.__raid2disks = {}
+        self.__dir2disks = self.__learn_directories()
+        self.__interrupts = interrupt_table()
+        self.__disk2irqs = self.__learn_irqs()
+        self.__type2diskinfo = self.__group_disks_info_by_type()
+        self.__profiles = self.__learn_profiles()
+
+#### Public methods #############################
+    def plan(self, plan):
+        """
+        Plan the IRQs distribution according to the requested mode (args.mode):
+           - Distribute NVMe disks' IRQs equally among all available CPUs.
+           - Distribute non-NVMe disks' IRQs equally among designated CPUs or among
+             all available CPUs in the 'mq' mode.
+        """
+        mode_cpu_mask = PerfTunerBase.irqs_cpu_mask_for_mode(self.mode, self.args.cpu_mask)
+
+        non_nvme_disks, non_nvme_irqs = self.__disks_info_by_type(DiskPerfTuner.SupportedDiskTypes.non_nvme)
+        if non_nvme_disks:
+            plan.add_comment("Setting non-NVMe disks: {}...".format(", ".join(non_nvme_disks)))
+            self.__distribute_irqs(plan, non_nvme_disks, non_nvme_irqs, mode_cpu_mask)
+            self.__tune_disks(plan, non_nvme_disks)
+        else:
+            plan.add_comment("No non-NVMe disks to tune")
+
+        nvme_disks, nvme_irqs = self.__disks_info_by_type(DiskPerfTuner.SupportedDiskTypes.nvme)
+        if nvme_disks:
+            plan.add_comment("Setting NVMe disks: {}...".format(", ".join(nvme_disks)))
+            self.__distribute_irqs(plan, nvme_disks, nvme_irqs, self.args.cpu_mask)
+            self.__tune_disks(plan, nvme_disks)
+        else:
+            plan.add_comment("No NVMe disks to tune")
+
+        def tune_raid(plan, raid, members):
+            plan.add_comment("Setting RAID volume {} (members: {})...".format(raid, ", ".join(members)))
+            self.__tune_profile(plan, raid, 'raid')
+
+        plan_units(plan, [ functools.partial(tune_raid, raid=raid, members=members) for raid, members in sorted(self.__raid2disks.items()) ], self.args.jobs)
+
+#### Protected methods ##########################
+    def _get_def_mode(self):
+        """
+        Return a default configuration mode.
+        """
+        # if the only disks we are tuning are NVMe disks - return the MQ mode
+        non_nvme_disks, non_nvme_irqs = self.__disks_info_by_type(DiskPerfTuner.SupportedDiskTypes.non_nvme)
+        if not non_nvme_disks:
+            return PerfTunerBase.SupportedModes.mq
+
+        num_cores = cpu_topology().number_of_cores(self.args.cpu_mask)
+        num_PUs = cpu_topology().number_of_pus(self.args.cpu_mask)
+        if num_PUs <= 4:
+            return PerfTunerBase.SupportedModes.mq
+        elif num_cores <= 4:
+            return PerfTunerBase.SupportedModes.sq
+        else:
+            return PerfTunerBase.SupportedModes.sq_split
+
+    def _get_irqs(self):
+        return itertools.chain.from_iterable(irqs for disks, irqs in self.__type2diskinfo.values())
+
+    def _get_numa_nodes(self):
+        return sorted(set(node for node in self.__disk2numa.values() if node is not None)) or None
+
+#### Private methods ############################
+    @property
+    def __io_schedulers(self):
+        """
+        :return: An ordered list of IO schedulers that we want to configure. Schedulers are ordered by their priority
+        from the highest (left most) to the lowest.
+        """
+        return ["none", "noop"]
+
+    def __distribute_irqs(self, plan, disks, irqs, cpu_mask, log_errors=True):
+        """
+        Distribute the IRQs of the given disks. In the NUMA-local mode IRQs of disks that sit on the same NUMA node
+        are distributed together preferring the CPUs of that node.
+        """
+        if not self.numa_local:
+            distribute_irqs(plan, irqs, cpu_mask, log_errors=log_errors, load=self.irq_load)
+            return
+
+        not_grouped = set(irqs)
+        numa2irqs = {}
+        for disk in disks:
+            numa_irqs = numa2irqs.setdefault(self.__disk2numa.get(disk), [])
+            for irq in self.__disk2irqs[disk]:
+                if irq in not_grouped:
+                    numa_irqs.append(irq)
+                    not_grouped.remove(irq)
+
+        def distribute_numa_irqs(plan, numa_node, numa_irqs):
+            numa_disks = [ disk for disk in disks if self.__disk2numa.get(disk) == numa_node ]
+            placements = distribute_irqs(plan, numa_irqs, cpu_mask, log_errors=log_errors, load=self.irq_load, numa_node=numa_node)
+            report_irqs_locality(plan, ", ".join(numa_disks), numa_node, placements)
+
+        plan_units(plan, [ functools.partial(distribute_numa_irqs, numa_node=numa_node, numa_irqs=numa_irqs) for numa_node, numa_irqs in numa2irqs.items() ], self.irq_jobs)
+
+    def __disks_info_by_type(self, disks_type):
+        """
+        Returns a tuple ( [<disks>], [<irqs>] ) for the given disks type.
+        IRQs numbers in the second list are promised to be unique.
+        """
+        return self.__type2diskinfo[DiskPerfTuner.SupportedDiskTypes(disks_type)]
+
+    def __nvme_fast_path_irq_filter(self, irq):
+        """
+        Return True for fast path NVMe IRQs.
+        For NVMe device only queues 1-<number of CPUs> are going to do fast path work.
+
+        NVMe IRQs have the following name convention:
+             nvme<device index>q<queue index>, e.g. nvme0q7
+
+        :param irq: IRQ number
+        :return: True if this IRQ is an IRQ of a FP NVMe queue.
+        """
+        # There may be more than an single HW queue bound to the same IRQ. In this case there are going to be
+        # several action names
+        num_PUs = cpu_topology().number_of_pus(cpu_topology().all_pus)
+        for action in self.__interrupts.actions(irq):
+            m = self.__nvme_irq_re.match(action)
+            if m and 0 < int(m.group(1)) <= num_PUs:
+                return True
+
+        return False
+
+    def __group_disks_info_by_type(self):
+        """
+        Return a map of tuples ( [<disks>], [<irqs>] ), where "disks" are all disks of the specific type
+        and "irqs" are the corresponding IRQs.
+
+        It's promised that every element is "disks" and "irqs" is unique.
+
+        The disk types are 'nvme' and 'non-nvme'
+        """
+        disks_info_by_type = {}
+        nvme_disks = set()
+        nvme_irqs = set()
+        non_nvme_disks = set()
+        non_nvme_irqs = set()
+        nvme_disk_name_pattern = re.compile('^nvme')
+
+        for disk, irqs in self.__disk2irqs.items():
+            if nvme_disk_name_pattern.search(disk):
+                nvme_disks.add(disk)
+                for irq in irqs:
+                    nvme_irqs.add(irq)
+            else:
+                non_nvme_disks.add(disk)
+                for irq in irqs:
+                    non_nvme_irqs.add(irq)
+
+        if not (nvme_disks or non_nvme_disks):
+            raise Exception("'disks' tuning was requested but no disks were found")
+
+        nvme_irqs = list(nvme_irqs)
+
+        # There is a known issue with Xen hypervisor that exposes itself on AWS i3 instances where nvme module
+        # over-allocates HW queues and uses only queues 1,2,3,..., <up to number of CPUs> for data transfer.
+        # On these instances we will distribute only these queues.
+
+        if self.instance_profile['nvme_fast_path_only']:
+            nvme_irqs = list(filter(self.__nvme_fast_path_irq_filter, nvme_irqs))
+
+        # Sort IRQs for easier verification
+        nvme_irqs.sort(key=lambda irq_num_str: int(irq_num_str))
+
+        # The plan must not depend on the sets' (hash seed dependent) order: only the drifted values are applied
+        disks_info_by_type[DiskPerfTuner.SupportedDiskTypes.nvme] = (sorted(nvme_disks), nvme_irqs)
+        disks_info_by_type[DiskPerfTuner.SupportedDiskTypes.non_nvme] = ( sorted(non_nvme_disks), sorted(non_nvme_irqs, key=lambda irq_num_str: int(irq_num_str)) )
+
+        return disks_info_by_type
+
+    def __learn_directories(self):
+        return { directory : self.__learn_directory(directory) for directory in self.args.dirs }
+
+    def __learn_directory(self, directory, recur=False):
+        """
+        Returns a list of disks the given directory is mounted on (there will be more than one if
+        the mount point is on the RAID volume)
+        """
+        if not host_exists(directory):
+            if not recur:
+                print("{} doesn't exist - skipping".format(directory))
+
+            return []
+
+        try:
+            udev_obj = self.__devices.device_from_number(directory_device_number(directory))
+            return self.__get_phys_devices(udev_obj)
+        except:
+            # handle cases like ecryptfs where the directory is mounted to another directory and not to some block device
+            filesystem = directory_mount(directory)[1]
+            if not re.search(r'^/dev/', filesystem):
+                devs = self.__learn_directory(filesystem, True)
+            else:
+                raise Exception("Logic error: failed to create a udev device while {} is mounted from {}".format(directory, filesystem))
+
+            # log error only for the original directory
+            if not recur and not devs:
+                print("Can't get a block device for {} - skipping".format(directory))
+
+            return devs
+
+    def __get_phys_devices(self, udev_obj):
+        # if device is a virtual device - the underlying physical devices are going to be its slaves
+        if re.search(r'virtual', udev_obj.sys_path):
+            members = list(itertools.chain.from_iterable([ self.__get_phys_devices(self.__devices.device("/dev/{}".format(slave))) for slave in os.listdir(host_path(os.path.join(udev_obj.sys_path, 'slaves'))) ]))
+            self.__raid2disks[re.match(r'/dev/(\S+)', udev_obj.device_node).group(1)] = members
+            return members
+        else:
+            # device node is something like /dev/sda1 - we need only the part without /dev/
+            return [ re.match(r'/dev/(\S+\d*)', udev_obj.device_node).group(1) ]
+
+    def __learn_irqs(self):
+        disk2irqs = {}
+
+        for devices in list(self.__dir2disks.values()) + [ self.args.devs ]:
+            for device in devices:
+                # There could be that some of the given directories are on the same disk.
+                # There is no need to rediscover IRQs of the disk we've already handled.
+                if device in disk2irqs.keys():
+                    continue
+
+                udev_obj = self.__devices.device("/dev/{}".format(device))
+                dev_sys_path = udev_obj.sys_path
+                split_sys_path = list(pathlib.PurePath(dev_sys_path).parts)
+
+                # first part is always /sys/devices/pciXXX ...
+                controller_path_parts = split_sys_path[0:4]
+
+                # ...then there is a chain of one or more "domain:bus:device.function" followed by the storage device enumeration crap
+                # e.g. /sys/devices/pci0000:00/0000:00:1f.2/ata2/host1/target1:0:0/1:0:0:0/block/sda/sda3 or
+                #      /sys/devices/pci0000:00/0000:00:02.0/0000:02:00.0/host6/target6:2:0/6:2:0:0/block/sda/sda1
+                # We want only the path till the last BDF including - it contains the IRQs information.
+
+                patt = re.compile("^[0-9ABCDEFabcdef]{4}\:[0-9ABCDEFabcdef]{2}\:[0-9ABCDEFabcdef]{2}\.[0-9ABCDEFabcdef]$")
+                for split_sys_path_branch in split_sys_path[4:]:
+                    if patt.search(split_sys_path_branch):
+                        controller_path_parts.append(split_sys_path_branch)
+                    else:
+                        break
+
+                controler_path_str = functools.reduce(lambda x, y : os.path.join(x, y), controller_path_parts)
+                disk2irqs[device] = learn_all_irqs_one(controler_path_str, self.__interrupts, 'blkif')
+                self.__disk2numa[device] = read_numa_node(controler_path_str)
+
+        return disk2irqs
+
+    def __learn_profiles(self):
+        """
+        Return the block queue profiles: the built-in ones (block_profiles) with the overrides from the options file
+        applied.
+        """
+        profiles = { name : dict(settings) for name, settings in DiskPerfTuner.block_profiles.items() }
+
+        for name, settings in self.args.block_profiles.items():
+            if name not in profiles:
+                raise Exception("Unknown block profile '{}', supported profiles are: {}".format(name, ", ".join(profiles.keys())))
+
+            for setting, value in settings.items():
+                if setting not in DiskPerfTuner.block_profiles['nvme']:
+                    raise Exception("Unknown block profile setting '{}' in '{}'".format(setting, name))
+
+                profiles[name][setting] = None if value is None else str(value)
+
+        return profiles
+
+    def __read_feature(self, dev_node, feature):
+        """
+        Return the value of the given feature of the closest ancestor that has it or None if there isn't one.
+        """
+        feature_file, feature_node = self.__devices.feature_file(dev_node, feature)
+        if feature_file is None:
+            return None
+
+        return read_one_line(feature_file)
+
+    def __disk_profile(self, disk):
+        """
+        Return the name of the block queue profile of the given physical disk.
+        """
+        dev_node = "/dev/{}".format(disk)
+
+        model = self.__read_feature(dev_node, os.path.join('device', 'model'))
+        if model and self.__ephemeral_model_re.search(model):
+            return 'ephemeral'
+
+        if re.match(r'^nvme', disk):
+            return 'nvme'
+
+        if self.__read_feature(dev_node, os.path.join('queue', 'rotational')) == '0':
+            return 'ssd'
+
+        return 'default'
+
+    def __resolve_setting(self, dev_node, value):
+        """
+        Resolve the special block profile values (see block_profiles) for the given device.
+
+        :return: the value to set or None if the setting should be left intact
+        """
+        if value == 'max_hw':
+            return self.__read_feature(dev_node, os.path.join('queue', 'max_hw_sectors_kb'))
+        elif value == 'queue_depth':
+            return self.__read_feature(dev_node, os.path.join('device', 'queue_depth'))
+
+        return value
+
+    def __raid_member_overrides(self, disk):
+        """
+        Return the settings of the RAID volumes the given disk is a member of that have to be set on the disk too:
+        the volume-level and the member-level read-ahead and request size limits are kept the same.
+        """
+        overrides = {}
+        for raid, members in sorted(self.__raid2disks.items()):
+            if disk not in members:
+                continue
+
+            raid_node = "/dev/{}".format(raid)
+            for setting in self.__raid_member_settings:
+                value = self.__resolve_setting(raid_node, self.__profiles['raid'].get(setting))
+                if value is not None:
+                    overrides.setdefault(setting, value)
+
+        return overrides
+
+    def __tune_one_feature(self, plan, dev_node, feature, value):
+        """
+        Find the closest ancestor that has the given feature, plan its configuration and
+        return True.
+
+        If there isn't such ancestor - return False.
+
+        An ancestor shared by several tuned devices (e.g. a disk of several partitions) is configured by the first
+        one: see plan_units().
+
+        :param dev_node Device node file name, e.g. /dev/sda1
+        :param feature A feature file name relative to the device system directory, e.g. queue/nomerges
+        """
+        feature_file, feature_node = self.__devices.feature_file(dev_node, feature)
+
+        if feature_file is None:
+            return False
+
+        plan.add_write(feature_file, value)
+        return True
+
+    def __tune_io_scheduler(self, plan, dev_node, io_scheduler):
+        return self.__tune_one_feature(plan, dev_node, os.path.join('queue', 'scheduler'), io_scheduler)
+
+    def __tune_profile(self, plan, device, profile, overrides={}):
+        """
+        Plan the block queue settings of the given profile for the given device.
+        """
+        dev_node = "/dev/{}".format(device)
+        plan.add_comment("Using '{}' block profile for {}".format(profile, device))
+
+        for setting, value in self.__profiles[profile].items():
+            value = overrides.get(setting, self.__resolve_setting(dev_node, value))
+            if value is None:
+                continue
+
+            if not self.__tune_one_feature(plan, dev_node, os.path.join('queue', setting), value):
+                plan.add_comment("Not setting '{}' for {} - feature not present".format(setting, device))
+
+    def __get_io_scheduler(self, dev_node):
+        """
+        Return a supported scheduler that is also present in the required schedulers list (__io_schedulers).
+
+        If there isn't such a supported scheduler - return None.
+        """
+        feature_file, feature_node = self.__devices.feature_file(dev_node, os.path.join('queue', 'scheduler'))
+        if feature_file is None:
+            return None
+
+        lines = readlines(feature_file)
+        if not lines:
+            return None
+
+        # Supported schedulers appear in the config file as a single line as follows:
+        #
+        # sched1 [sched2] sched3
+        #
+        # ...with one or more schedulers where currently selected scheduler is the one in brackets.
+        #
+        # Return the scheduler with the highest priority among those that are supported for the current device.
+        supported_schedulers = frozenset([scheduler.lstrip("[").rstrip("]") for scheduler in lines[0].split(" ")])
+        return next((scheduler for scheduler in self.__io_schedulers if scheduler in supported_schedulers), None)
+
+    def __tune_disk(self, plan, device):
+        dev_node = "/dev/{}".format(device)
+        io_scheduler = self.__get_io_scheduler(dev_node)
+
+        if not io_scheduler:
+            plan.add_comment("Not setting I/O Scheduler for {} - required schedulers ({}) are not supported".format(device, list(self.__io_schedulers)))
+        elif not self.__tune_io_scheduler(plan, dev_node, io_scheduler):
+            plan.add_comment("Not setting I/O Scheduler for {} - feature not present".format(device))
+
+        self.__tune_profile(plan, device, self.__disk_profile(device), self.__raid_member_overrides(device))
+
+    def __tune_disks(self, plan, disks):
+        plan_units(plan, [ functools.partial(self.__tune_disk, device=disk) for disk in disks ], self.args.jobs)
+
+################################################################################
+class TuneModes(enum.Enum):
+    disks = 0
+    net = 1
+
+    @staticmethod
+    def names():
+        return list(TuneModes.__members__.keys())
+
+def mode_name(name):
+    """
+    The --mode argument type: a named or a parametric mode (see TuningMode).
+    """
+    if not TuningMode.is_valid(name):
+        raise argparse.ArgumentTypeError("invalid mode: '{}'".format(name))
+
+    return name
+
+def sample_window(value):
+    """
+    The --load-sample-window argument type: a positive number of seconds.
+    """
+    try:
+        seconds = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid number of seconds: '{}'".format(value))
+
+    if not 0 < seconds < float('inf'):
+        raise argparse.ArgumentTypeError("the load sample window must be a positive number of seconds: '{}'".format(value))
+
+    return seconds
+
+argp = argparse.ArgumentParser(description = 'Configure various system parameters in order to improve the seastar application performance.', formatter_class=argparse.RawDescriptionHelpFormatter,
+                               epilog=
+'''
+This script will:
+
+    - Ban relevant IRQs from being moved by irqbalance.
+    - Configure various system parameters in /proc/sys.
+    - Distribute the IRQs (using SMP affinity configuration) among CPUs according to the configuration mode (see below).
+
+As a result some of the CPUs may be destined to only handle the IRQs and taken out of the CPU set
+that should be used to run the seastar application ("compute CPU set").
+
+With --plan nothing is changed: the complete, ordered list of the above steps is printed (or stored) as JSON or YAML
+instead. Such a plan may be executed later using --apply. With --check nothing is changed either: the expected state
+is compared with the current one, the drifted items are reported as JSON and the exit status is 2 if anything has
+drifted.
+
+Only values that differ from the current system state are written. The number of changed and unchanged entries is
+reported at the end of the run; use --changed-exit-code to get a distinct exit status when something was changed.
+
+--nic may be given more than once and every NIC may have its own mode: '--nic eth0:sq_split --nic eth1'. The modes of
+all NICs and of the disks are merged into one mode that reserves for IRQs every CPU any of them reserves.
+
+Kernel parameters are sized according to the NIC speed and the number of CPUs and set in one batch through /proc/sys:
+if one of them fails the others are rolled back. They, the disks' block queue settings and the cloud instances'
+profiles may be overridden in the 'sysctls', 'block_profiles' and 'instance_profiles' sections of the options file.
+
+The IRQ placement (--irq-placement, --numa-local, --queue-symmetric), the NIC drivers' IRQ classifiers and settings
+(--nic-settings), the kernel parameters, the block queue settings, the cloud instances' profiles, the kernel managed
+IRQs, irqbalance (--irqbalance-policy), the plans of other hosts (--root, --capture) and the --get-cpu-mask cache are
+described in detail in the README.md of the ansible-scylla-common Ansible role.
+
+Modes description:
+
+ sq - set all IRQs of a given NIC to CPU0 and configure RPS
+      to spreads NAPIs' handling between other CPUs.
+
+ sq_split - divide all IRQs of a given NIC between CPU0 and its HT siblings and configure RPS
+      to spreads NAPIs' handling between other CPUs.
+
+ mq - distribute NIC's IRQs among all CPUs instead of binding
+      them all to CPU0. In this mode RPS is always enabled to
+      spreads NAPIs' handling between all CPUs.
+
+ sq_split_2numa - divide all IRQs of a given NIC between the first cores (and their HT siblings)
+      of the first two packages and configure RPS to spreads NAPIs' handling between other CPUs.
+
+ irq_cores:<N>[:local] - divide all IRQs between the first N cores (and their HT siblings) of every NUMA node
+      or, with ':local', of the NUMA nodes of the tuned devices only, and configure RPS to spreads NAPIs' handling
+      between other CPUs.
+
+ irq_threads:<M>[:local] - the same with the first M hyperthreads of every (or of every local) NUMA node.
+
+ The modes of several NICs and of the disks are merged: every CPU reserved for IRQs by one of them is reserved.
+
+ If there isn't any mode given script will use a default mode:
+    - If there are at most 4 hyperthreads or every NIC has an Rx HW queue per hyperthread - use the 'mq' mode.
+    - Otherwise, if there are at most 4 physical CPU cores - use the 'sq' mode.
+    - Otherwise a core per 25 Gb/s of the NIC's speed is reserved for IRQs (but not more cores than the NIC has Rx
+      HW queues): the 'sq_split' mode if that's a single core, otherwise 'irq_cores:<N>' with the cores spread over
+      the NUMA nodes, at most an eighth of a node's cores each.
+
+Default values:
+
+ --nic NIC[:MODE] - default: eth0
+ --cpu-mask MASK  - default: all available cores mask
+''')
+argp.add_argument('--mode', type=mode_name, metavar='MODE', help="configuration mode: {} or a parametric one: irq_cores:<N>[:local], irq_threads:<M>[:local]".format(", ".join(PerfTunerBase.SupportedModes.names())))
+argp.add_argument('--nic', action='append', dest='nics', default=[], metavar='NIC[:MODE]', help="network interface name, optionally with its own configuration mode (may be given more than once), by default uses 'eth0'")
+argp.add_argument('--get-cpu-mask', action='store_true', help="print the CPU mask to be used for compute")
+argp.add_argument('--verbose', action='store_true', help="be more verbose about operations and their result")
+argp.add_argument('--tune', choices=TuneModes.names(), help="components to configure (may be given more than once)", action='append', default=[])
+argp.add_argument('--cpu-mask', help="mask of cores to use, by default use all available cores", metavar='MASK')
+argp.add_argument('--dir', help="directory to optimize (may appear more than once)", action='append', dest='dirs', default=[])
+argp.add_argument('--dev', help="device to optimize (may appear more than once), e.g. sda1", action='append', dest='devs', default=[])
+argp.add_argument('--options-file', help="configuration YAML file")
+argp.add_argument('--dump-options-file', action='store_true', help="Print the configuration YAML file containing the current configuration")
+argp.add_argument('--plan', nargs='?', const='-', metavar='FILE', help="compute the tuning plan without changing anything and write it into FILE (standard output by default)")
+argp.add_argument('--plan-format', choices=['json', 'yaml'], default='json', help="tuning plan format for --plan, by default 'json'")
+argp.add_argument('--check', action='store_true', help="don't change anything: compare the system with the tuning plan (or with the --apply one), print a JSON drift report and exit with 2 if something has drifted")
+argp.add_argument('--apply', metavar='PLAN', help="apply the tuning plan from the given file created with --plan")
+argp.add_argument('--numa-local', action='store_true', help="place devices' IRQs, RPS and XPS on the CPUs of the device's NUMA node first and report the resulting locality")
+argp.add_argument('--nic-settings', action='store_true', help="also tune NICs' ring sizes, combined channels, interrupt coalescing and offloads (may reset the link)")
+argp.add_argument('--queue-symmetric', action='store_true', help="bind each NIC queue's xps_cpus and rps_cpus to the CPUs closest to the CPU its IRQ is bound to")
+argp.add_argument('--irq-placement', choices=['round-robin', 'load'], help="how to place IRQs on the IRQ CPUs: spread them evenly ('round-robin', the default) or balance their measured load ('load')")
+argp.add_argument('--load-sample-window', type=sample_window, metavar='SECONDS', help="for '--irq-placement load': how long to sample /proc/interrupts and /proc/softirqs, 1 second by default")
+argp.set_defaults(block_profiles={}, sysctls={}, instance_profiles={})
+argp.add_argument('--irqbalance-policy', choices=['banirq', 'banned-cpus', 'both'], help="how to keep irqbalance away from the tuned IRQs: ban the IRQs ('banirq', the default), ban the compute CPUs ('banned-cpus') or both")
+argp.add_argument('--jobs', type=int, default=min(8, os.cpu_count() or 1), metavar='N', help="number of bond slaves, disks and IRQ groups to plan concurrently, by default the number of CPUs but not more than 8")
+argp.add_argument('--root', metavar='DIR', help="the root directory of /sys, /proc, /dev and /etc, e.g. a synthetic tree created by perftune_fixture.py; nothing is restarted and no NIC is queried under it")
+argp.add_argument('--capture', metavar='ARCHIVE', help="store the system files the plan is computed from into the given tar.gz archive (a --root for other machines) and print the plan's hardware fingerprint")
+argp.add_argument('--ignore-fingerprint', action='store_true', help="--apply the plan even if it was computed for a host with a different hardware fingerprint")
+argp.add_argument('--changed-exit-code', type=int, metavar='CODE', help="exit with CODE instead of 0 if tuning changed anything in the system, e.g. for an Ansible 'changed_when'")
+
+def parse_options_file(prog_args):
+    if not prog_args.options_file:
+        return
+
+    import yaml
+
+    y = yaml.safe_load(open(prog_args.options_file))
+    if y is None:
+        return
+
+    if 'mode' in y and not prog_args.mode:
+        if not TuningMode.is_valid(str(y['mode'])):
+            raise Exception("Bad 'mode' value in {}: {}".format(prog_args.options_file, y['mode']))
+        prog_args.mode = y['mode']
+
+    if 'nic' in y and not prog_args.nics:
+        nics = y['nic'] if isinstance(y['nic'], list) else [ y['nic'] ]
+        if not all(isinstance(nic, str) for nic in nics):
+            raise Exception("Bad 'nic' value in {}: {}".format(prog_args.options_file, y['nic']))
+        prog_args.nics = nics
+
+    if 'tune' in y:
+        if set(y['tune']) <= set(TuneModes.names()):
+            prog_args.tune.extend(y['tune'])
+        else:
+            raise Exception("Bad 'tune' value in {}: {}".format(prog_args.options_file, y['tune']))
+
+    if 'cpu_mask' in y and not prog_args.cpu_mask:
+        hex_32bit_pattern='0x[0-9a-fA-F]{1,8}'
+        mask_pattern = re.compile('^{}((,({})?)*,{})*$'.format(hex_32bit_pattern, hex_32bit_pattern, hex_32bit_pattern))
+        if mask_pattern.match(str(y['cpu_mask'])):
+            prog_args.cpu_mask = y['cpu_mask']
+        else:
+            raise Exception("Bad 'cpu_mask' value in {}: {}".format(prog_args.options_file, str(y['cpu_mask'])))
+
+    if 'irqbalance_policy' in y and not prog_args.irqbalance_policy:
+        if not y['irqbalance_policy'] in ('banirq', 'banned-cpus', 'both'):
+            raise Exception("Bad 'irqbalance_policy' value in {}: {}".format(prog_args.options_file, y['irqbalance_policy']))
+        prog_args.irqbalance_policy = y['irqbalance_policy']
+
+    if 'irq_placement' in y and not prog_args.irq_placement:
+        if not y['irq_placement'] in ('round-robin', 'load'):
+            raise Exception("Bad 'irq_placement' value in {}: {}".format(prog_args.options_file, y['irq_placement']))
+        prog_args.irq_placement = y['irq_placement']
+
+    if 'load_sample_window' in y and not prog_args.load_sample_window:
+        try:
+            prog_args.load_sample_window = sample_window(str(y['load_sample_window']))
+        except argparse.ArgumentTypeError:
+            raise Exception("Bad 'load_sample_window' value in {}: {}".format(prog_args.options_file, y['load_sample_window']))
+
+    if 'dir' in y:
+        prog_args.dirs.extend(y['dir'])
+
+    if 'dev' in y:
+        prog_args.devs.extend(y['dev'])
+
+    if 'sysctls' in y:
+        if not isinstance(y['sysctls'], dict):
+            raise Exception("Bad 'sysctls' value in {}: {}".format(prog_args.options_file, y['sysctls']))
+        prog_args.sysctls = y['sysctls']
+
+    if 'block_profiles' in y:
+        if not isinstance(y['block_profiles'], dict) or not all(isinstance(settings, dict) for settings in y['block_profiles'].values()):
+            raise Exception("Bad 'block_profiles' value in {}: {}".format(prog_args.options_file, y['block_profiles']))
+        prog_args.block_profiles = y['block_profiles']
+
+    if 'instance_profiles' in y:
+        if not isinstance(y['instance_profiles'], dict) or not all(isinstance(settings, dict) for settings in y['instance_profiles'].values()):
+            raise Exception("Bad 'instance_profiles' value in {}: {}".format(prog_args.options_file, y['instance_profiles']))
+
+        for name, settings in y['instance_profiles'].items():
+            if settings.get('default_mode') is not None and not TuningMode.is_valid(str(settings['default_mode'])):
+                raise Exception("Bad 'default_mode' value of the '{}' instance profile in {}: {}".format(name, prog_args.options_file, settings['default_mode']))
+
+        prog_args.instance_profiles = y['instance_profiles']
+
+def dump_config(prog_args):
+    prog_options = {}
+
+    if prog_args.mode:
+        prog_options['mode'] = prog_args.mode
+
+    if prog_args.nics:
+        prog_options['nic'] = prog_args.nics[0] if len(prog_args.nics) == 1 else prog_args.nics
+
+    if prog_args.tune:
+        prog_options['tune'] = prog_args.tune
+
+    if prog_args.cpu_mask:
+        prog_options['cpu_mask'] = str(prog_args.cpu_mask)
+
+    if prog_args.irqbalance_policy:
+        prog_options['irqbalance_policy'] = prog_args.irqbalance_policy
+
+    if prog_args.irq_placement:
+        prog_options['irq_placement'] = prog_args.irq_placement
+
+    if prog_args.load_sample_window:
+        prog_options['load_sample_window'] = prog_args.load_sample_window
+
+    if prog_args.dirs:
+        prog_options['dir'] = prog_args.dirs
+
+    if prog_args.devs:
+        prog_options['dev'] = prog_args.devs
+
+    if prog_args.block_profiles:
+        prog_options['block_profiles'] = prog_args.block_profiles
+
+    if prog_args.sysctls:
+        prog_options['sysctls'] = prog_args.sysctls
+
+    if prog_args.instance_profiles:
+        prog_options['instance_profiles'] = prog_args.instance_profiles
+
+    import yaml
+
+    print(yaml.dump(prog_options, default_flow_style=False))
+################################################################################
+
+def prepare_args(args):
+    """
+    Apply the --options-file and the default values to the parsed arguments.
+    """
+    if args.root:
+        set_sysroot(args.root)
+
+    parse_options_file(args)
+
+    if not args.nics:
+        args.nics = [ 'eth0' ]
+
+    names = [ nic for nic, mode in nic_modes(args) ]
+    if len(set(names)) != len(names):
+        raise Exception("Every NIC may be given only once: {}".format(", ".join(args.nics)))
+
+    if not args.cpu_mask:
+        args.cpu_mask = cpu_topology().all_pus
+    elif not isinstance(args.cpu_mask, CpuMask):
+        args.cpu_mask = CpuMask.from_mask_str(args.cpu_mask)
+
+def nic_modes(args):
+    """
+    Return the list of the (NIC, mode) tuples of the --nic NIC[:MODE] values, the mode is None if it's not given.
+    """
+    nics = []
+    for nic in args.nics:
+        name, _, mode = nic.partition(':')
+        if not name or (mode and not TuningMode.is_valid(mode)):
+            raise Exception("Bad NIC '{}': expected NIC[:MODE] with MODE one of {} or irq_cores:<N>[:local], irq_threads:<M>[:local]".format(nic, ", ".join(PerfTunerBase.SupportedModes.names())))
+        nics.append((name, mode or None))
+
+    return nics
+
+def configured_mode(args):
+    """
+    Return the mode all tuners are going to use if it's known without learning the NICs and the disks: the --mode (or
+    the instance profile's default one) merged with the NICs' own modes. None is returned otherwise, e.g. for the
+    ':local' modes that depend on the devices' NUMA nodes.
+    """
+    mode = args.mode or CloudInstance.default_mode(cloud_instance().profile(args.instance_profiles), args.cpu_mask)
+
+    modes = []
+    if TuneModes.net.name in args.tune:
+        modes += [ nic_mode or mode for nic, nic_mode in nic_modes(args) ]
+
+    if TuneModes.disks.name in args.tune or not modes:
+        modes.append(mode)
+
+    if not all(modes) or any(TuningMode.is_local(mode) for mode in modes):
+        return None
+
+    return TuningMode.merge([ TuningMode.from_name(mode) for mode in modes ], cpu_topology().restrict(args.cpu_mask))
+
+def split_irq_cpus(net_tuners):
+    """
+    Give every NIC its own share of the IRQ CPUs (the same in all tuners) in proportion to its number of IRQs, so
+    that the queues of different NICs are not bound to the same CPUs. NICs are given shares in the order of their
+    NUMA nodes so that a NIC's share tends to be on its own node. If there are fewer IRQ CPUs than NICs they all use
+    all IRQ CPUs.
+    """
+    ifaces = list(itertools.chain.from_iterable(tuner.ifaces for tuner in net_tuners))
+    if len(set(ifaces)) != len(ifaces):
+        raise Exception("The same physical interface is tuned more than once: {}".format(", ".join(tuner.nic for tuner in net_tuners)))
+
+    def numa_node(tuner):
+        nodes = [ read_numa_node("/sys/class/net/{}/device".format(iface)) for iface in tuner.ifaces ]
+        return min([ node for node in nodes if node is not None ], default=-1)
+
+    net_tuners = sorted(net_tuners, key=numa_node)
+    shares = cpu_topology().split([ len(list(tuner.irqs)) for tuner in net_tuners ], restrict=net_tuners[0].irqs_cpu_mask)
+    if shares is None:
+        print("{} IRQ CPUs can't be split between {} NICs: their IRQs are going to share them".format(len(net_tuners[0].irqs_cpu_mask), len(net_tuners)))
+        return
+
+    for tuner, share in zip(net_tuners, shares):
+        tuner.nic_irqs_cpu_mask = share
+
+def create_tuners(args):
+    tuners = []
+
+    if TuneModes.disks.name in args.tune:
+        tuners.append(DiskPerfTuner(args))
+
+    if TuneModes.net.name in args.tune:
+        tuners += [ NetPerfTuner(args, nic, mode) for nic, mode in nic_modes(args) ]
+
+    # Merge the modes of all tuners: the IRQ CPUs of each one are reserved
+    mode = TuningMode.merge([ tuner.mode for tuner in tuners ], tuners[0].args.cpu_mask)
+    for tuner in tuners:
+        tuner.mode = mode
+
+    net_tuners = [ tuner for tuner in tuners if isinstance(tuner, NetPerfTuner) ]
+    if len(net_tuners) > 1:
+        split_irq_cpus(net_tuners)
+
+    return tuners
+
+def apply_nic_settings(args, tuners):
+    """
+    Apply the NICs' settings (--nic-settings) right away: changing NICs' channels changes their IRQs, hence if
+    something has changed everything is learned again.
+
+    :return: the (tuners, summary) tuple - new tuners are created if something has changed
+    """
+    nic_plan = TuningPlan()
+    for tuner in tuners:
+        if isinstance(tuner, NetPerfTuner):
+            tuner.plan_nic_settings(nic_plan)
+
+    summary = nic_plan.apply()
+    if summary['changed']:
+        interrupt_table.cache_clear()
+        irq_load.cache_clear()
+        ethtool.cache_clear()
+        tuners = create_tuners(args)
+
+    return tuners, summary
+
+def plan_irqbalance(args, tuners, plan):
+    """
+    Add the irqbalance step of the --irqbalance-policy: the IRQs of all tuners and/or the compute CPUs are banned.
+    """
+    policy = args.irqbalance_policy or 'banirq'
+    banned_irqs = itertools.chain.from_iterable([ tuner.irqs for tuner in tuners ]) if policy != 'banned-cpus' else []
+    banned_cpus = None
+
+    if policy != 'banirq':
+        # The compute mask is the same in all tuners
+        banned_cpus = tuners[0].compute_cpu_mask
+        if not (cpu_topology().all_pus - banned_cpus):
+            plan.add_comment("Not banning irqbalance from the compute CPUs {}: there would be no CPUs left for IRQs - banning the IRQs instead".format(banned_cpus.to_list_str()))
+            banned_irqs = itertools.chain.from_iterable([ tuner.irqs for tuner in tuners ])
+            banned_cpus = None
+
+    plan.add_irqbalance_ban(banned_irqs, banned_cpus)
+
+def plan_tuning(args, tuners, nic_settings=False):
+    """
+    Return the complete TuningPlan of the given tuners. The NICs' settings (--nic-settings) are a part of it only if
+    nic_settings is True: they are applied separately before the IRQs are learned otherwise (see apply_nic_settings()).
+    """
+    plan = TuningPlan()
+    plan_irqbalance(args, tuners, plan)
+
+    if nic_settings:
+        for tuner in tuners:
+            if isinstance(tuner, NetPerfTuner):
+                tuner.plan_nic_settings(plan)
+
+    for tuner in tuners:
+        tuner.plan(plan)
+
+    # All kernel parameters are set in one batch, the ones of the fastest NIC win
+    sysctls = {}
+    for tuner in sorted(tuners, key=lambda tuner: tuner._get_nic_speed() or 0):
+        sysctls.update(tuner.sysctls())
+    sysctls.update({ key : str(value) for key, value in args.sysctls.items() if value is not None })
+
+    for key in [ key for key in sysctls if not host_exists(sysctl_path(key)) ]:
+        plan.add_comment("Not setting {} - not supported by the kernel".format(key))
+        del sysctls[key]
+
+    plan.add_sysctls(sysctls)
+
+    if not managed_irqs_debugfs_available():
+        plan.add_comment("Kernel managed IRQs can't be detected: the IRQs' debugfs (/sys/kernel/debug/irq/irqs) is not available - they are learned when setting their affinity fails")
+
+    return plan
+
+def apply_tuning(args, tuners, plan):
+    """
+    Apply the given plan of the given tuners. If it turns out that some of the IRQs are managed by the kernel (see
+    learn_managed_irq()) the plan is computed and applied once more so that the rest of the IRQs avoid their CPUs.
+
+    :return: a dictionary with the numbers of 'changed', 'unchanged' and 'failed' steps
+    """
+    num_managed = len(learned_managed_irqs())
+    summary = plan.apply()
+    if len(learned_managed_irqs()) == num_managed:
+        return summary
+
+    print("Planning again around the kernel managed IRQs...")
+    again = plan_tuning(args, tuners).apply()
+    return {'changed': summary['changed'] + again['changed'], 'unchanged': again['unchanged'], 'failed': again['failed']}
+
+def plan_fingerprint(plan):
+    """
+    Return the fingerprint of this host's hardware the given plan depends on: a SHA-256 digest of the CPU topology, of
+    the device/queue names of the plan's IRQs and of the plan's targets (see TuningPlan.targets()) that exist.
+    """
+    interrupts = interrupt_table()
+    hardware = cpu_topology().description()
+    hardware.update({
+        'irqs': { irq: interrupts.actions(irq) if irq in interrupts else None for irq in plan.irqs() },
+        'targets': [ path for path in plan.targets() if host_exists(path) ],
+    })
+
+    return hashlib.sha256(json.dumps(hardware, sort_keys=True).encode()).hexdigest()
+
+def verify_fingerprint(plan):
+    """
+    Raise an exception if the given plan was computed for a host with a different hardware fingerprint.
+    """
+    if plan.fingerprint is None:
+        return
+
+    fingerprint = plan_fingerprint(plan)
+    if fingerprint != plan.fingerprint:
+        raise Exception("The plan was computed for different hardware: its fingerprint is {}, this host's one is {}".format(plan.fingerprint, fingerprint))
+
+def cpu_mask_cache_file(options_file):
+    """
+    Return the file the compute CPU mask is cached in next to the given options file, e.g.
+    /etc/scylla.d/perftune.yaml -> /etc/scylla.d/perftune.cpu_mask.json
+    """
+    return os.path.splitext(options_file)[0] + '.cpu_mask.json'
+
+def cpu_mask_cache_key(args):
+    """
+    Return the fingerprint the cached compute CPU mask is valid for: a SHA-256 digest of the CPU topology and of the
+    options the mask depends on (including the ones from the --options-file).
+    """
+    options = {
+        'tune': sorted(set(args.tune)),
+        'nic': args.nics,
+        'dirs': sorted(args.dirs),
+        'devs': sorted(args.devs),
+        'cpu_mask': args.cpu_mask.to_list_str(),
+    }
+
+    return hashlib.sha256(json.dumps({'topology': cpu_topology().description(), 'options': options}, sort_keys=True).encode()).hexdigest()
+
+def store_cpu_mask(args, compute_cpu_mask):
+    """
+    Cache the compute CPU mask of the default mode next to the --options-file for get_compute_cpu_mask(). Nothing is
+    cached if there is no options file or the mode is known (see configured_mode()): the mask is cheap to compute then.
+    """
+    if not args.options_file or configured_mode(args) is not None:
+        return
+
+    cache_file = cpu_mask_cache_file(args.options_file)
+    try:
+        with open(cache_file, 'w') as f:
+            json.dump({'fingerprint': cpu_mask_cache_key(args), 'compute_cpu_mask': compute_cpu_mask.to_list_str()}, f)
+    except OSError as e:
+        print("Failed to cache the compute CPU mask in {}: {}".format(cache_file, e))
+
+def get_compute_cpu_mask(args):
+    """
+    Return the compute CPU mask (--get-cpu-mask) learning as little as possible: when the mode is known only the CPU
+    topology is needed, otherwise the mask cached next to the --options-file is used if its fingerprint matches.
+    NICs and disks are learned (and the mask is cached) only when the default mode has to be computed.
+    """
+    mode = configured_mode(args)
+    if mode is not None:
+        return PerfTunerBase.compute_cpu_mask_for_mode(mode, cpu_topology().restrict(args.cpu_mask))
+
+    if args.options_file:
+        try:
+            with open(cpu_mask_cache_file(args.options_file), 'r') as f:
+                cached = json.load(f)
+
+            if cached.get('fingerprint') == cpu_mask_cache_key(args):
+                return CpuMask.from_list_str(cached['compute_cpu_mask'])
+        except (OSError, ValueError, KeyError, AttributeError):
+            pass
+
+    compute_cpu_mask = create_tuners(args)[0].compute_cpu_mask
+    store_cpu_mask(args, compute_cpu_mask)
+    return compute_cpu_mask
+
+def capture(args):
+    """
+    Compute the plan recording the system files it's computed from, store them into the --capture archive and
+    return the plan's hardware fingerprint.
+    """
+    with HostSnapshot() as snapshot:
+        prepare_args(args)
+        plan = plan_tuning(args, create_tuners(args), nic_settings=args.nic_settings)
+        fingerprint = plan_fingerprint(plan)
+
+    snapshot.write(args.capture)
+    return fingerprint
+
+def main():
+    args = argp.parse_args()
+
+    def exit_with_summary(summary):
+        """
+        Exit with --changed-exit-code if something has been changed in the system.
+        """
+        if args.changed_exit_code is not None and summary['changed'] > 0:
+            sys.exit(args.changed_exit_code)
+
+        sys.exit(0)
+
+    def exit_with_drift_report(plan):
+        """
+        Print the JSON drift report of the given plan and exit with 2 if something has drifted.
+        """
+        report = plan.check()
+        print(json.dumps(report, indent=2))
+        sys.exit(2 if report['drifted'] else 0)
+
+    if args.apply:
+        if args.root:
+            set_sysroot(args.root)
+
+        try:
+            plan = TuningPlan.load(args.apply)
+            if not args.ignore_fingerprint:
+                verify_fingerprint(plan)
+
+            if args.check:
+                exit_with_drift_report(plan)
+
+            summary = plan.apply()
+        except Exception as e:
+            sys.exit("ERROR: {}. Your system can't be tuned until the issue is fixed.".format(e))
+
+        exit_with_summary(summary)
+
+    if args.capture:
+        try:
+            with contextlib.redirect_stdout(sys.stderr):
+                fingerprint = capture(args)
+        except Exception as e:
+            sys.exit("ERROR: {}. The system can't be captured until the issue is fixed.".format(e))
+
+        print(fingerprint)
+        sys.exit(0)
+
+    prepare_args(args)
+
+    # if nothing needs to be configured - quit
+    if args.tune is None:
+        sys.exit("ERROR: At least one tune mode MUST be given.")
+
+    if args.dump_options_file:
+        dump_config(args)
+        sys.exit(0)
+
+    if args.get_cpu_mask:
+        try:
+            with contextlib.redirect_stdout(sys.stderr):
+                compute_cpu_mask = get_compute_cpu_mask(args)
+        except Exception as e:
+            sys.exit("ERROR: {}. Your system can't be tuned until the issue is fixed.".format(e))
+
+        print(compute_cpu_mask)
+        sys.exit(0)
+
+    try:
+        nic_summary = None
+
+        # When the plan or the drift report goes to the standard output all progress messages go to the standard error
+        with contextlib.redirect_stdout(sys.stderr if args.plan == '-' or args.check else sys.stdout):
+            tuners = create_tuners(args)
+
+            # The NICs' settings are applied first when tuning the system, they are a part of the plan otherwise
+            nic_settings_planned = args.nic_settings and bool(args.plan or args.check)
+            if args.nic_settings and not nic_settings_planned:
+                tuners, nic_summary = apply_nic_settings(args, tuners)
+
+            plan = plan_tuning(args, tuners, nic_settings=nic_settings_planned)
+            if args.plan:
+                plan.fingerprint = plan_fingerprint(plan)
+
+        if args.check:
+            exit_with_drift_report(plan)
+        elif args.plan == '-':
+            print(plan.dump(args.plan_format))
+        elif args.plan:
+            with open(args.plan, 'w') as f:
+                f.write(plan.dump(args.plan_format))
+        else:
+            # Tune the system - the compute mask is going to be the same in all tuners
+            store_cpu_mask(args, tuners[0].compute_cpu_mask)
+            summary = apply_tuning(args, tuners, plan)
+            if nic_summary:
+                summary = { result : summary[result] + nic_summary[result] for result in summary }
+    except Exception as e:
+        sys.exit("ERROR: {}. Your system can't be tuned until the issue is fixed.".format(e))
+
+    if not args.plan:
+        exit_with_summary(summary)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1 @@
+../../ansible-scylla-common/module_utils/perftune.py
\ No newline at end of file
@@ -0,0 +1,244 @@
+#!/usr/bin/python3
+
+import argparse
+import collections
+import contextlib
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import perftune
+import perftune_fixture
+
+#
+# Times perftune's discovery and planning on the synthetic trees of perftune_fixture.py and counts the system calls
+# and the subprocesses it makes, as well as the cold start of 'perftune.py --get-cpu-mask', e.g.:
+#
+#   perftune_bench.py --output baseline.json
+#   ... change perftune.py ...
+#   perftune_bench.py --baseline baseline.json
+#
+# exits with 1 if any preset got slower than the baseline by more than --tolerance or makes more calls than it did.
+#
+# Every preset is also planned under two hash seeds (PYTHONHASHSEED): the plans must be byte for byte identical, or
+# every run would rewrite the values that only moved around. The script exits with 1 if they are not.
+#
+# --get-cpu-mask is run in a new interpreter as boot-time scripts do: with the default mode (the NICs and the disks are
+# learned), with --mode given and with the mask cached next to an --options-file.
+#
+
+class CallCounter:
+    """
+    Counts the file system calls (open, listdir, scandir, stat, lstat, readlink and ioctl) and the subprocesses made
+    while it's active.
+
+    open, listdir, scandir, ioctl and subprocess.Popen are counted with an audit hook (sys.addaudithook()); stat,
+    lstat and readlink raise no audit events and are counted by wrapping the os module's functions.
+    """
+    __audit_events = {'open': 'open', 'os.listdir': 'listdir', 'os.scandir': 'scandir', 'fcntl.ioctl': 'ioctl', 'subprocess.Popen': 'subprocesses'}
+    __wrapped = ('stat', 'lstat', 'readlink')
+    __instance = None
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__counts = collections.Counter()
+        self.__active = False
+
+        if CallCounter.__instance is None:
+            # Audit hooks can't be removed: a single one forwards the events to the active counter
+            sys.addaudithook(CallCounter.__audit)
+
+#### Public methods ############################
+    @property
+    def counts(self):
+        counts = dict(self.__counts)
+        counts['syscalls'] = sum(count for name, count in counts.items() if name != 'subprocesses')
+        counts.setdefault('subprocesses', 0)
+        return counts
+
+    def __enter__(self):
+        CallCounter.__instance = self
+        self.__originals = { name: getattr(os, name) for name in CallCounter.__wrapped }
+        for name, original in self.__originals.items():
+            setattr(os, name, self.__counting(name, original))
+
+        self.__active = True
+        return self
+
+    def __exit__(self, *exc_info):
+        self.__active = False
+        for name, original in self.__originals.items():
+            setattr(os, name, original)
+
+        return False
+
+#### Private methods ############################
+    @staticmethod
+    def __audit(event, args):
+        counter = CallCounter.__instance
+        if counter is not None and counter.__active and event in CallCounter.__audit_events:
+            counter.__count(CallCounter.__audit_events[event])
+
+    def __count(self, name):
+        with self.__lock:
+            self.__counts[name] += 1
+
+    def __counting(self, name, original):
+        def counting(*args, **kwargs):
+            if self.__active:
+                self.__count(name)
+            return original(*args, **kwargs)
+
+        return counting
+
+def plan_once(root, perftune_args):
+    """
+    Run perftune's discovery and planning on the given tree from scratch.
+
+    :return: the (discovery seconds, planning seconds, plan, call counts) tuple
+    """
+    args = perftune.argp.parse_args(perftune_args + ['--root', root])
+
+    with contextlib.redirect_stdout(io.StringIO()), CallCounter() as counter:
+        start = time.perf_counter()
+        perftune.prepare_args(args)
+        tuners = perftune.create_tuners(args)
+        discovered = time.perf_counter()
+        plan = perftune.plan_tuning(args, tuners)
+        planned = time.perf_counter()
+
+    perftune.set_sysroot('/')
+    return discovered - start, planned - discovered, plan, counter.counts
+
+def get_cpu_mask_once(perftune_args):
+    """
+    Run 'perftune.py --get-cpu-mask' with the given arguments in a new interpreter.
+
+    :return: the wall time in seconds
+    """
+    start = time.perf_counter()
+    subprocess.run([sys.executable, perftune.__file__] + perftune_args + ['--get-cpu-mask'], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+def plan_with_seed(perftune_args, seed):
+    """
+    Run 'perftune.py --plan' with the given arguments in a new interpreter with the given hash seed.
+
+    :return: the plan file's contents
+    """
+    with tempfile.NamedTemporaryFile(suffix='.json') as plan_file:
+        subprocess.run([sys.executable, perftune.__file__] + perftune_args + ['--plan', plan_file.name], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=dict(os.environ, PYTHONHASHSEED=str(seed)))
+        return plan_file.read()
+
+def bench_get_cpu_mask(root, perftune_args, repeat):
+    """
+    Time the cold start of --get-cpu-mask with the default mode, with the mode given and with a cached mask.
+    """
+    options_file = os.path.join(root, 'perftune.yaml')
+    with open(options_file, 'w') as f:
+        f.write('')
+
+    variants = {
+        'cpu_mask_s': perftune_args,
+        'cpu_mask_mode_s': perftune_args + ['--mode', 'mq'],
+        'cpu_mask_cached_s': perftune_args + ['--options-file', options_file],
+    }
+
+    # The first run with the options file caches the mask
+    get_cpu_mask_once(variants['cpu_mask_cached_s'])
+    return { name: round(min(get_cpu_mask_once(args) for _ in range(repeat)), 4) for name, args in variants.items() }
+
+def bench_preset(workdir, preset, repeat):
+    """
+    Build the preset's tree and plan it the given number of times: the best times are reported, the call counts are
+    the same in every run.
+    """
+    root = os.path.join(workdir, preset)
+    perftune_args = perftune_fixture.build(root, preset)
+
+    # The first run imports the modules perftune uses lazily: their files would be counted and timed too
+    plan_once(root, perftune_args)
+    runs = [ plan_once(root, perftune_args) for _ in range(repeat) ]
+    discovery, planning, plan, counts = min(runs, key=lambda run: run[0] + run[1])
+
+    result = {'discovery_s': round(discovery, 4), 'plan_s': round(planning, 4), 'total_s': round(discovery + planning, 4), 'steps': len(plan.steps)}
+    result.update(counts)
+    result.update(bench_get_cpu_mask(root, perftune_args + ['--root', root], repeat))
+    result['deterministic'] = plan_with_seed(perftune_args + ['--root', root], 1) == plan_with_seed(perftune_args + ['--root', root], 2)
+    return result
+
+def regressions(results, baseline, tolerance):
+    """
+    Return the list of the descriptions of the results that are worse than the baseline ones.
+    """
+    found = []
+    for preset, result in results.items():
+        base = baseline.get(preset)
+        if base is None:
+            continue
+
+        # Times of a few milliseconds are noise
+        for name in ('total_s', 'cpu_mask_s', 'cpu_mask_mode_s', 'cpu_mask_cached_s'):
+            if name in result and name in base and result[name] > base[name] * (1 + tolerance) + 0.005:
+                found.append("{}: {} {}s vs {}s".format(preset, name, result[name], base[name]))
+
+        for name in ('syscalls', 'subprocesses'):
+            if result.get(name, 0) > base.get(name, 0):
+                found.append("{}: {} {} vs {}".format(preset, name, result.get(name, 0), base.get(name, 0)))
+
+    return found
+
+def nondeterministic(results):
+    """
+    Return the list of the descriptions of the presets whose plans depend on the hash seed.
+    """
+    return [ "{}: the plan depends on PYTHONHASHSEED".format(preset) for preset, result in results.items() if not result['deterministic'] ]
+
+def print_results(results):
+    tables = (
+        ('discovery_s', 'plan_s', 'total_s', 'steps', 'syscalls', 'open', 'stat', 'lstat', 'readlink', 'listdir', 'scandir', 'ioctl', 'subprocesses'),
+        ('cpu_mask_s', 'cpu_mask_mode_s', 'cpu_mask_cached_s', 'deterministic'),
+    )
+    for columns in tables:
+        print("{:<8}".format('preset') + "".join("{:>18}".format(column) for column in columns))
+        for preset, result in results.items():
+            print("{:<8}".format(preset) + "".join("{:>18}".format(str(result.get(column, 0))) for column in columns))
+
+if __name__ == '__main__':
+    argp = argparse.ArgumentParser(description="Benchmark perftune.py discovery and planning on synthetic trees.")
+    argp.add_argument('--preset', action='append', dest='presets', choices=list(perftune_fixture.presets.keys()), help="preset to benchmark (may be given more than once), all by default")
+    argp.add_argument('--repeat', type=int, default=3, help="number of runs per preset, the best one is reported, 3 by default")
+    argp.add_argument('--workdir', help="directory to build the trees in, a temporary one (removed at the end) by default")
+    argp.add_argument('--output', metavar='FILE', help="store the results in the given JSON file, e.g. to be used as a --baseline later")
+    argp.add_argument('--baseline', metavar='FILE', help="compare the results with the ones stored with --output and exit with 1 if any of them regressed")
+    argp.add_argument('--tolerance', type=float, default=0.2, help="allowed relative total time increase over the --baseline, 0.2 by default")
+    args = argp.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='perftune-bench-')
+    try:
+        results = { preset: bench_preset(workdir, preset, args.repeat) for preset in (args.presets or perftune_fixture.presets.keys()) }
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir)
+
+    print_results(results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    found = nondeterministic(results)
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            found += regressions(results, json.load(f), args.tolerance)
+
+    for regression in found:
+        print("REGRESSION: {}".format(regression))
+
+    sys.exit(1 if found else 0)
@@ -0,0 +1,226 @@
+#!/usr/bin/python3
+
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+
+import perftune
+import perftune_bench
+import perftune_fixture
+
+#
+# Checks perftune's plans on the synthetic trees of perftune_fixture.py, e.g. after changing perftune.py:
+#
+#   perftune_check.py
+#
+# - golden plans: the plan of every preset with the default mode and with every named --mode has to be the one
+#   recorded in perftune_golden.json. After an intended change of the plans record the new ones with --update and
+#   commit them with the change.
+# - the fast path IRQs of every NIC are ordered Rx first, then Tx, each by the queue index, and the NICs' control IRQs
+#   (e.g. mlx5_async, virtio config) are not tuned.
+# - the plans don't depend on the hash seed (PYTHONHASHSEED): otherwise every run would rewrite the values that only
+#   moved around.
+# - the cloud instance and its profile are recognized and the profile's default mode is used, except on small hosts.
+# - the named modes reserve exactly PU:0 / core:0 of --cpu-mask and are rejected if --cpu-mask has none of them.
+#
+# exits with 1 if any check fails.
+#
+
+golden_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'perftune_golden.json')
+
+# The named modes every preset is planned with besides the default one
+modes = ['mq', 'sq', 'sq_split']
+
+# Actions of NIC IRQs that serve no queue: they are left to irqbalance
+control_irq_re = re.compile(r"^mlx5_async|\-config$|mgmnt")
+
+role_ranks = {'rx': 0, 'rxtx': 0, 'tx': 1, None: 2}
+
+# The (cloud, instance type, profile, default mode) every preset is recognized as, the mode is None if it's computed
+# from the devices. Presets that are not listed are not cloud instances.
+instances = {
+    'ena': ('aws', 'i3en.24xlarge', 'aws-i3en', 'irq_cores:1'),
+    'i3': ('aws', None, 'aws-xen', None),
+    'virtio': ('gcp', None, None, None),
+}
+
+# Presets built as their family's smallest sizes, which use the computed default mode whatever their profile says
+small_instances = {
+    'ena': {'sockets': 1, 'cores': 2, 'threads': 2, 'nvmes': 1},
+}
+
+def golden_plans(root, perftune_args):
+    """
+    Return the map of a mode ('default' or a named one) to the (number of steps, SHA-256 digest) of the plan of the
+    given tree in it.
+    """
+    plans = {}
+    for mode in [ None ] + modes:
+        plan = perftune_bench.plan_once(root, perftune_args + ([ '--mode', mode ] if mode else []))[2]
+        plans[mode or 'default'] = {'steps': len(plan.steps), 'sha256': hashlib.sha256(plan.dump('json').encode()).hexdigest()}
+
+    return plans
+
+def check_golden_plans(preset, plans, golden):
+    """
+    Return the list of the descriptions of the plans that differ from the golden ones.
+    """
+    if preset not in golden:
+        return [ "{}: no golden plans, record them with --update".format(preset) ]
+
+    return [ "{}: the '{}' mode plan differs from the golden one ({} steps vs {})".format(preset, mode, plan['steps'], golden[preset].get(mode, {}).get('steps'))
+             for mode, plan in plans.items() if plan != golden[preset].get(mode) ]
+
+def check_irqs_order(preset, root, perftune_args):
+    """
+    Return the list of the descriptions of the NICs whose fast path IRQs are not ordered Rx first or that tune their
+    control IRQs.
+    """
+    args = perftune.argp.parse_args(perftune_args + ['--root', root])
+    with contextlib.redirect_stdout(io.StringIO()):
+        perftune.prepare_args(args)
+        tuners = perftune.create_tuners(args)
+
+    interrupts = perftune.interrupt_table()
+    found = []
+    for tuner in tuners:
+        if not isinstance(tuner, perftune.NetPerfTuner):
+            continue
+
+        for iface in tuner.ifaces:
+            iface_irqs = set(perftune.learn_all_irqs_one("/sys/class/net/{}/device".format(iface), interrupts, iface))
+            irqs = [ irq for irq in tuner.irqs if irq in iface_irqs ]
+            classifier = perftune.NetPerfTuner.nic_irq_classifiers.get(perftune.nic_driver(iface), perftune.NetPerfTuner.nic_irq_classifiers['default'])
+
+            control = [ irq for irq in irqs if any(control_irq_re.search(action) for action in interrupts.actions(irq)) ]
+            if control:
+                found.append("{}: {} control IRQs are tuned: {}".format(preset, iface, ", ".join(control)))
+
+            classes = [ classifier.classify_one(interrupts.actions(irq)) for irq in irqs ]
+            if None in classes:
+                continue
+
+            order = [ (role_ranks[role], sys.maxsize if queue is None else queue) for role, queue in classes ]
+            if order != sorted(order):
+                found.append("{}: {} IRQs are not ordered Rx first by queue: {}".format(preset, iface, ", ".join(irqs)))
+
+    perftune.set_sysroot('/')
+    return found
+
+# The IRQ CPUs (a CPU list, None if the mode is rejected) of the given (--mode, --cpu-mask) of the presets, e.g. the
+# ixgbe host's core:0 is CPUs 0 and 16
+cpu_mask_cases = {
+    'ixgbe': [
+        ('sq', '0x000000ff', '0'),
+        ('sq', '0xfffffffe', None),
+        ('sq', '0x000000fc', None),
+        ('sq_split', '0xfffffffe', '16'),
+        ('sq_split', '0x000000fc', None),
+    ],
+}
+
+def check_cpu_mask_modes(preset, root, perftune_args):
+    """
+    Return the list of the descriptions of the cpu_mask_cases of the given preset whose IRQ CPUs are not the expected
+    ones.
+    """
+    found = []
+    for mode, cpu_mask, expected in cpu_mask_cases.get(preset, []):
+        args = perftune.argp.parse_args(perftune_args + ['--root', root, '--mode', mode, '--cpu-mask', cpu_mask])
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                perftune.prepare_args(args)
+                irq_cpus = { tuner.irqs_cpu_mask.to_list_str() for tuner in perftune.create_tuners(args) }
+        except Exception:
+            irq_cpus = { None }
+
+        if irq_cpus != { expected }:
+            found.append("{}: --mode {} --cpu-mask {} IRQ CPUs are {} instead of {}".format(preset, mode, cpu_mask, ", ".join(str(cpus) for cpus in irq_cpus), expected))
+
+    perftune.set_sysroot('/')
+    return found
+
+def check_instance(preset, root, perftune_args, small=False):
+    """
+    Return the list of the descriptions of the differences between the recognized cloud instance of the given tree
+    and its default mode and the expected ones: the profile's one or, on small hosts, the one computed from the devices.
+    """
+    cloud, instance_type, profile, default_mode = instances.get(preset, (None, None, None, None))
+    args = perftune.argp.parse_args(perftune_args + ['--root', root])
+    with contextlib.redirect_stdout(io.StringIO()):
+        perftune.prepare_args(args)
+        tuners = perftune.create_tuners(args)
+        modes = { str(tuner.mode) for tuner in tuners }
+        if small or default_mode is None:
+            default_mode = str(perftune.TuningMode.merge([ perftune.PerfTunerBase.to_mode(tuner._get_def_mode(), tuner._get_numa_nodes()) for tuner in tuners ], args.cpu_mask))
+
+    instance = perftune.cloud_instance()
+    label = "{} (small)".format(preset) if small else preset
+    found = []
+    if (instance.cloud, instance.instance_type, instance.profile_name) != (cloud, instance_type, profile):
+        found.append("{}: recognized as {} instead of {}".format(label, (instance.cloud, instance.instance_type, instance.profile_name), (cloud, instance_type, profile)))
+
+    if modes != { default_mode }:
+        found.append("{}: the default mode is {} instead of {}".format(label, ", ".join(sorted(modes)), default_mode))
+
+    perftune.set_sysroot('/')
+    return found
+
+def check_hash_seeds(preset, root, perftune_args):
+    if perftune_bench.plan_with_seed(perftune_args + ['--root', root], 1) != perftune_bench.plan_with_seed(perftune_args + ['--root', root], 2):
+        return [ "{}: the plan depends on PYTHONHASHSEED".format(preset) ]
+
+    return []
+
+if __name__ == '__main__':
+    argp = argparse.ArgumentParser(description="Check perftune.py plans on synthetic trees.")
+    argp.add_argument('--preset', action='append', dest='presets', choices=list(perftune_fixture.presets.keys()), help="preset to check (may be given more than once), all by default")
+    argp.add_argument('--update', action='store_true', help="record the current plans of the checked presets as the golden ones")
+    args = argp.parse_args()
+
+    golden = {}
+    if os.path.exists(golden_file):
+        with open(golden_file, 'r') as f:
+            golden = json.load(f)
+
+    workdir = tempfile.mkdtemp(prefix='perftune-check-')
+    found = []
+    try:
+        for preset in (args.presets or perftune_fixture.presets.keys()):
+            root = os.path.join(workdir, preset)
+            perftune_args = perftune_fixture.build(root, preset)
+
+            plans = golden_plans(root, perftune_args)
+            if args.update:
+                golden[preset] = plans
+            else:
+                found += check_golden_plans(preset, plans, golden)
+
+            found += check_irqs_order(preset, root, perftune_args)
+            found += check_hash_seeds(preset, root, perftune_args)
+            found += check_instance(preset, root, perftune_args)
+            found += check_cpu_mask_modes(preset, root, perftune_args)
+
+            if preset in small_instances:
+                found += check_instance(preset, root, perftune_fixture.build(root, preset, **small_instances[preset]), small=True)
+
+            print("{}: checked".format(preset))
+    finally:
+        shutil.rmtree(workdir)
+
+    if args.update:
+        with open(golden_file, 'w') as f:
+            json.dump(golden, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+    for failure in found:
+        print("FAILED: {}".format(failure))
+
+    sys.exit(1 if found else 0)
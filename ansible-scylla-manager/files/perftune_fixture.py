@@ -0,0 +1,491 @@
+#!/usr/bin/python3
+
+import argparse
+import itertools
+import os
+import shutil
+import sys
+
+#
+# Builds a synthetic /sys, /proc, /dev and /etc tree perftune.py can be run on with --root: the CPU topology, NUMA
+# nodes, NICs (physical, bonded, virtio and xen), NVMe, virtio and xen disks, md RAIDs, mounts, /proc/interrupts, the
+# kernel parameters and the DMI attributes - just enough of them for perftune to discover everything it would on a
+# real host.
+#
+
+# Kernel parameters perftune reads or tunes with their kernel default values
+KERNEL_SYSCTLS = {
+    'net.core.somaxconn': '4096',
+    'net.ipv4.tcp_max_syn_backlog': '512',
+    'net.core.rps_sock_flow_entries': '0',
+    'net.core.netdev_max_backlog': '1000',
+    'net.core.netdev_budget': '300',
+    'net.core.busy_read': '0',
+    'net.core.busy_poll': '0',
+    'net.core.rmem_max': '212992',
+    'net.core.wmem_max': '212992',
+    'net.ipv4.tcp_rmem': '4096\t131072\t6291456',
+    'net.ipv4.tcp_wmem': '4096\t16384\t4194304',
+    'net.ipv4.tcp_mem': '188319\t251093\t376638',
+    'vm.dirty_background_ratio': '10',
+    'vm.dirty_ratio': '20',
+}
+
+BLOCK_QUEUE_DEFAULTS = {
+    'scheduler': '[none] mq-deadline kyber',
+    'read_ahead_kb': '128',
+    'max_sectors_kb': '1280',
+    'max_hw_sectors_kb': '2048',
+    'rq_affinity': '1',
+    'nr_requests': '1023',
+    'wbt_lat_usec': '2000',
+    'iostats': '1',
+    'nomerges': '0',
+    'rotational': '0',
+    'write_cache': 'write back',
+}
+
+class Fixture:
+    """
+    A synthetic host tree under the given root directory. Devices are added one by one and the files that describe
+    all of them together (/proc/interrupts, /proc/self/mountinfo, etc.) are written by finish().
+
+    All paths given to and returned by the methods are host paths, e.g. /sys/class/net/eth0.
+    """
+    # pci, virtio and xen IRQs chip and type columns of /proc/interrupts
+    __irq_chips = {'pci': ('IR-PCI-MSI', 'edge'), 'xen': ('xen-dyn', '-edge')}
+
+    def __init__(self, root):
+        self.__root = os.path.abspath(root)
+        self.__nr_cpus = 0
+        self.__nr_nodes = 1
+        self.__irqs = []
+        self.__next_irq = 24
+        self.__next_slot = itertools.count(1)
+        self.__next_virtio = itertools.count(0)
+        self.__next_vif = itertools.count(0)
+        self.__next_minor = {}
+        self.__mounts = []
+        self.__bonds = []
+
+#### Public methods ############################
+    @property
+    def root(self):
+        return self.__root
+
+    @property
+    def nr_cpus(self):
+        return self.__nr_cpus
+
+    def cpus(self, sockets, cores, threads):
+        """
+        Add sockets * cores * threads CPUs numbered the way Linux does (all first threads of all cores first) with a
+        NUMA node per socket.
+        """
+        cpu_dir = '/sys/devices/system/cpu'
+        node_dir = '/sys/devices/system/node'
+        self.__nr_cpus = sockets * cores * threads
+        self.__nr_nodes = sockets
+
+        for cpu in range(self.__nr_cpus):
+            thread, socket, core = cpu // (sockets * cores), (cpu % (sockets * cores)) // cores, cpu % cores
+            topology_dir = os.path.join(cpu_dir, 'cpu{}'.format(cpu), 'topology')
+            siblings = [ t * sockets * cores + socket * cores + core for t in range(threads) ]
+            package = [ c for c in range(self.__nr_cpus) if (c % (sockets * cores)) // cores == socket ]
+
+            self.write(os.path.join(topology_dir, 'physical_package_id'), socket)
+            self.write(os.path.join(topology_dir, 'core_id'), core)
+            self.write(os.path.join(topology_dir, 'thread_siblings_list'), list_str(siblings))
+            self.write(os.path.join(topology_dir, 'core_siblings_list'), list_str(package))
+            self.write(os.path.join(cpu_dir, 'cpu{}'.format(cpu), 'online'), 1)
+
+        for name in ('online', 'possible', 'present'):
+            self.write(os.path.join(cpu_dir, name), "0-{}".format(self.__nr_cpus - 1))
+
+        for node in range(sockets):
+            cpus = [ c for c in range(self.__nr_cpus) if (c % (sockets * cores)) // cores == node ]
+            self.write(os.path.join(node_dir, 'node{}'.format(node), 'cpulist'), list_str(cpus))
+            self.write(os.path.join(node_dir, 'node{}'.format(node), 'distance'), " ".join('10' if other == node else '21' for other in range(sockets)))
+
+        self.write(os.path.join(node_dir, 'online'), "0-{}".format(sockets - 1))
+
+    def nic(self, name, driver, queues, numa_node=0, speed=25000):
+        """
+        Add a NIC served by the given driver: mlx5_core, ixgbe, i40e, ice, ena, gve, bnxt_en, virtio_net or xen
+        (netfront).
+        """
+        if driver == 'virtio_net':
+            virtio, _ = self.__virtio_device(1, [ 'config' ] + [ "{}.{}".format(kind, q) for q in range(queues) for kind in ('input', 'output') ], numa_node)
+            self.__net_device(name, virtio, queues, speed)
+            self.__driver('virtio', 'virtio_net', virtio)
+            return
+
+        if driver == 'xen':
+            vif = "/sys/devices/vif-{}".format(next(self.__next_vif))
+            self.write(os.path.join(vif, 'modalias'), 'xen:vif')
+            self.write(os.path.join(vif, 'uevent'), 'DRIVER=vif')
+            self.__driver('xen', 'vif', vif)
+            for q in range(queues):
+                for kind in ('tx', 'rx'):
+                    self.add_irq(["{}-q{}-{}".format(name, q, kind)], bus='xen')
+            self.__net_device(name, vif, queues, speed)
+            return
+
+        slot = next(self.__next_slot)
+        bdf = self.__bdf(numa_node, slot)
+        if driver == 'mlx5_core':
+            names = [ "mlx5_async0@pci:{}".format(bdf) ] + [ "mlx5_comp{}@pci:{}".format(q, bdf) for q in range(queues) ]
+        elif driver == 'ena':
+            names = [ "ena-mgmnt@pci:{}".format(bdf) ] + [ "{}-Tx-Rx-{}".format(name, q) for q in range(queues) ]
+        elif driver == 'gve':
+            # notification blocks: the TX queues' ones first, then the RX queues' ones
+            names = [ "gve-mgmnt@pci:{}".format(bdf) ] + [ "gve-ntfy-blk{}@pci:{}".format(block, bdf) for block in range(2 * queues) ]
+        elif driver == 'ice':
+            names = [ "ice-{}-TxRx-{}".format(name, q) for q in range(queues) ] + [ "ice-{}".format(bdf) ]
+        elif driver == 'bnxt_en':
+            names = [ "{}-TxRx-{}".format(name, q) for q in range(queues) ]
+        else:
+            # Intel: the link IRQ is named after the interface
+            names = [ "{}-TxRx-{}".format(name, q) for q in range(queues) ] + [ name ]
+
+        device = self.__pci_device(numa_node, slot, driver, [ [ irq_name ] for irq_name in names ])
+        self.__net_device(name, device, queues, speed)
+
+    def dmi(self, **attributes):
+        """
+        Set the given DMI attributes, e.g. sys_vendor='Amazon EC2', product_name='i3en.2xlarge'.
+        """
+        dmi_dir = '/sys/devices/virtual/dmi/id'
+        for name, value in attributes.items():
+            self.write(os.path.join(dmi_dir, name), value)
+
+        if not os.path.lexists(self.path('/sys/class/dmi/id')):
+            self.symlink('/sys/class/dmi/id', dmi_dir)
+
+    def bond(self, name, slaves):
+        bond_dir = "/sys/devices/virtual/net/{}".format(name)
+        self.write(os.path.join(bond_dir, 'bonding', 'slaves'), " ".join(slaves))
+        self.write(os.path.join(bond_dir, 'speed'), -1)
+        self.symlink("/sys/class/net/{}".format(name), bond_dir)
+        self.__bonds.append(name)
+
+    def nvme(self, index, queues, numa_node=0, model='Synthetic NVMe SSD', managed=True):
+        """
+        Add the NVMe controller nvme<index> with a single namespace: the admin queue IRQ (nvme<index>q0) and queues - 1
+        I/O queues IRQs, kernel managed ones unless managed is False.
+        """
+        slot = next(self.__next_slot)
+        irqs = [ ([ "nvme{}q{}".format(index, q) ], managed and q > 0) for q in range(queues) ]
+        device = self.__pci_device(numa_node, slot, 'nvme', [ names for names, _ in irqs ], managed=[ managed for _, managed in irqs ])
+
+        ctrl = os.path.join(device, 'nvme', "nvme{}".format(index))
+        self.write(os.path.join(ctrl, 'uevent'), "MAJOR=241\nMINOR={}\nDEVNAME=nvme{}".format(index, index))
+        self.write(os.path.join(ctrl, 'model'), model)
+        self.symlink(os.path.join(ctrl, 'device'), device)
+        self.symlink("/sys/class/nvme/nvme{}".format(index), ctrl)
+
+        disk = self.block_device(os.path.join(ctrl, "nvme{}n1".format(index)), 259)
+        self.symlink(os.path.join(disk, 'device'), ctrl)
+        return os.path.basename(disk)
+
+    def virtio_disk(self, name, queues, numa_node=0):
+        virtio, _ = self.__virtio_device(2, [ 'config' ] + [ "req.{}".format(q) for q in range(queues) ], numa_node)
+        self.__driver('virtio', 'virtio_blk', virtio)
+        return os.path.basename(self.block_device(os.path.join(virtio, 'block', name), 252, rotational=1))
+
+    def xen_disk(self, name):
+        vbd = "/sys/devices/vbd-{}".format(51712 + 16 * (ord(name[-1]) - ord('a')))
+        self.write(os.path.join(vbd, 'modalias'), 'xen:vbd')
+        self.write(os.path.join(vbd, 'uevent'), 'DRIVER=vbd')
+        self.add_irq(['blkif'], bus='xen')
+        return os.path.basename(self.block_device(os.path.join(vbd, 'block', name), 202, rotational=1))
+
+    def raid(self, name, members):
+        md = self.block_device("/sys/devices/virtual/block/{}".format(name), 9)
+        for member in members:
+            self.symlink(os.path.join(md, 'slaves', member), "/sys/class/block/{}".format(member), resolve=True)
+
+        return name
+
+    def block_device(self, sys_path, major, rotational=0):
+        """
+        Add the block device of the given sysfs directory: its uevent, queue settings and /sys/class/block,
+        /sys/dev/block and /dev entries.
+        """
+        name = os.path.basename(sys_path)
+        minor = self.__next_minor.get(major, 0)
+        self.__next_minor[major] = minor + 1
+
+        self.write(os.path.join(sys_path, 'uevent'), "MAJOR={}\nMINOR={}\nDEVNAME={}\nDEVTYPE=disk".format(major, minor, name))
+        self.write(os.path.join(sys_path, 'dev'), "{}:{}".format(major, minor))
+        for feature, value in BLOCK_QUEUE_DEFAULTS.items():
+            self.write(os.path.join(sys_path, 'queue', feature), rotational if feature == 'rotational' else value)
+
+        self.symlink("/sys/class/block/{}".format(name), sys_path)
+        self.symlink("/sys/dev/block/{}:{}".format(major, minor), sys_path)
+        self.write("/dev/{}".format(name), '')
+        return sys_path
+
+    def mount(self, directory, device):
+        """
+        Mount the given block device (e.g. md0) on the given directory.
+        """
+        major, minor = self.read("/sys/class/block/{}/dev".format(device)).split(':')
+        self.__mounts.append("{} 1 {}:{} / {} rw,noatime shared:{} - xfs /dev/{} rw".format(len(self.__mounts) + 30, major, minor, directory, len(self.__mounts) + 1, device))
+        os.makedirs(self.path(directory), exist_ok=True)
+
+    def add_irq(self, actions, bus='pci', managed=False):
+        """
+        Add an IRQ with the given actions: its /proc/irq/<irq>/ files and its debugfs state. Returns its number.
+        """
+        irq = self.__next_irq
+        self.__next_irq += 1
+        self.__irqs.append((irq, bus, actions))
+
+        irq_dir = "/proc/irq/{}".format(irq)
+        all_cpus = range(self.__nr_cpus)
+        self.write(os.path.join(irq_dir, 'smp_affinity'), mask_str(all_cpus))
+        self.write(os.path.join(irq_dir, 'smp_affinity_list'), list_str(all_cpus))
+        self.write(os.path.join(irq_dir, 'effective_affinity_list'), irq % max(self.__nr_cpus, 1))
+        self.write("/sys/kernel/debug/irq/irqs/{}".format(irq), "handler:  handle_edge_irq\ndstate:   0x00000000\n{}".format("            IRQD_AFFINITY_MANAGED\n" if managed else ''))
+        return irq
+
+    def finish(self):
+        """
+        Write the files that describe all the added devices: /proc/interrupts, /proc/softirqs, mountinfo, the kernel
+        parameters, bonding_masters, and a running irqbalance with its configuration.
+        """
+        cpus = range(self.__nr_cpus)
+        header = "     " + "".join("{:>11}".format("CPU{}".format(cpu)) for cpu in cpus)
+        zeros = "".join("{:>11}".format(0) for cpu in cpus)
+
+        with open(self.__prepare("/proc/interrupts"), 'w') as f:
+            f.write(header + "\n")
+            for irq, bus, actions in self.__irqs:
+                chip, irq_type = self.__irq_chips['xen' if bus == 'xen' else 'pci']
+                f.write("{:>4}:{} {:>10} {}-{}      {}\n".format(irq, zeros, chip, irq, irq_type.lstrip('-'), ", ".join(actions)))
+            f.write(" NMI:{}   Non-maskable interrupts\n".format(zeros))
+
+        with open(self.__prepare("/proc/softirqs"), 'w') as f:
+            f.write(header + "\n")
+            for name in ('HI', 'TIMER', 'NET_TX', 'NET_RX', 'BLOCK', 'IRQ_POLL', 'TASKLET', 'SCHED', 'HRTIMER', 'RCU'):
+                f.write("{:>12}:{}\n".format(name, zeros))
+
+        self.write('/proc/self/mountinfo', "\n".join([ "22 1 8:1 / / rw,relatime shared:1 - ext4 /dev/sda1 rw" ] + self.__mounts))
+
+        for key, value in KERNEL_SYSCTLS.items():
+            self.write(os.path.join('/proc/sys', *key.split('.')), value)
+
+        if self.__bonds:
+            self.write('/sys/class/net/bonding_masters', " ".join(self.__bonds))
+
+        self.write('/proc/1/stat', "1 (systemd) S 0 1 1 0 -1 4194560")
+        self.write('/proc/1/comm', 'systemd')
+        self.write('/proc/812/stat', "812 (irqbalance) S 1 812 812 0 -1 4194560")
+        self.write('/proc/812/comm', 'irqbalance')
+        self.write('/lib/systemd/system/irqbalance.service', "[Service]\nExecStart=/usr/sbin/irqbalance --foreground $IRQBALANCE_ARGS")
+        self.write('/etc/default/irqbalance', "#IRQBALANCE_ONESHOT=\nIRQBALANCE_ARGS=\"\"")
+
+    def path(self, path):
+        return os.path.join(self.__root, os.path.relpath(path, '/'))
+
+    def read(self, path):
+        with open(self.path(path), 'r') as f:
+            return f.read().strip()
+
+    def write(self, path, value):
+        with open(self.__prepare(path), 'w') as f:
+            f.write("{}\n".format(value))
+
+    def symlink(self, path, target, resolve=False):
+        """
+        Create a relative symbolic link (as sysfs does) to the given target so that the tree may be moved around.
+        """
+        if resolve:
+            target = os.path.join('/', os.path.relpath(os.path.realpath(self.path(target)), self.__root))
+
+        os.symlink(os.path.relpath(target, os.path.dirname(path)), self.__prepare(path))
+
+#### Private methods ############################
+    def __prepare(self, path):
+        full_path = self.path(path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        return full_path
+
+    def __bdf(self, numa_node, slot):
+        return "0000:{:02x}:{:02x}.0".format(numa_node * 0x80 + slot // 32, slot % 32)
+
+    def __pci_device(self, numa_node, slot, driver, irq_names, managed=None):
+        """
+        Add a PCI device with MSI-X IRQs of the given actions lists on the root complex of the given NUMA node.
+        """
+        device = "/sys/devices/pci0000:{:02x}/{}".format(numa_node * 0x80, self.__bdf(numa_node, slot))
+        self.write(os.path.join(device, 'uevent'), "DRIVER={}\nPCI_SLOT_NAME={}".format(driver, os.path.basename(device)))
+        self.write(os.path.join(device, 'modalias'), 'pci:v000015B3d0000101Dsv000015B3sd00000016bc02sc00i00')
+        self.write(os.path.join(device, 'numa_node'), numa_node if self.__nr_nodes > 1 else -1)
+        self.__driver('pci', driver, device)
+
+        for i, names in enumerate(irq_names):
+            irq = self.add_irq(names, managed=bool(managed and managed[i]))
+            self.write(os.path.join(device, 'msi_irqs', str(irq)), 'msix')
+
+        return device
+
+    def __virtio_device(self, device_id, queue_names, numa_node):
+        """
+        Add a virtio PCI device with its virtio<N> child: its IRQs are named virtio<N>-<queue name>.
+        """
+        virtio_name = "virtio{}".format(next(self.__next_virtio))
+        device = self.__pci_device(numa_node, next(self.__next_slot), 'virtio-pci', [ [ "{}-{}".format(virtio_name, name) ] for name in queue_names ])
+        virtio = os.path.join(device, virtio_name)
+        self.write(os.path.join(virtio, 'modalias'), "virtio:d{:08d}v00001AF4".format(device_id))
+        self.write(os.path.join(virtio, 'uevent'), "MODALIAS=virtio:d{:08d}v00001AF4".format(device_id))
+        return virtio, device
+
+    def __driver(self, bus, driver, device):
+        driver_dir = "/sys/bus/{}/drivers/{}".format(bus, driver)
+        os.makedirs(self.path(driver_dir), exist_ok=True)
+        self.symlink(os.path.join(driver_dir, os.path.basename(device)), device)
+        self.symlink(os.path.join(device, 'driver'), driver_dir)
+
+    def __net_device(self, name, device, queues, speed):
+        net_dir = os.path.join(device, 'net', name)
+        self.symlink("/sys/class/net/{}".format(name), net_dir)
+        self.symlink(os.path.join(net_dir, 'device'), device)
+        self.write(os.path.join(net_dir, 'speed'), speed)
+
+        zero_mask = mask_str([], self.__nr_cpus)
+        for q in range(queues):
+            self.write(os.path.join(net_dir, 'queues', "rx-{}".format(q), 'rps_cpus'), zero_mask)
+            self.write(os.path.join(net_dir, 'queues', "rx-{}".format(q), 'rps_flow_cnt'), 0)
+            self.write(os.path.join(net_dir, 'queues', "tx-{}".format(q), 'xps_cpus'), zero_mask)
+
+def list_str(cpus):
+    """
+    Returns the "List Format" string of the given CPU numbers, e.g. 0-3,8.
+    """
+    ranges = []
+    for _, group in itertools.groupby(enumerate(sorted(cpus)), lambda item: item[1] - item[0]):
+        group = [ cpu for _, cpu in group ]
+        ranges.append(str(group[0]) if len(group) == 1 else "{}-{}".format(group[0], group[-1]))
+
+    return ",".join(ranges)
+
+def mask_str(cpus, nr_cpus=None):
+    """
+    Returns the kernel "Mask Format" string of the given CPU numbers, e.g. 00000000,000000ff.
+    """
+    bits = 0
+    for cpu in cpus:
+        bits |= 1 << cpu
+
+    words = max(1, ((nr_cpus or max(list(cpus) + [0]) + 1) + 31) // 32)
+    return ",".join("{:08x}".format((bits >> (32 * word)) & 0xffffffff) for word in reversed(range(words)))
+
+#### Presets ####################################
+def metal(fixture, sockets=2, cores=96, threads=2, nvmes=32, nvme_queues=129):
+    """
+    A large bare metal host: a bond of two mlx5 NICs, a RAID0 of NVMe drives spread over the NUMA nodes.
+    """
+    fixture.cpus(sockets, cores, threads)
+    fixture.nic('eth0', 'mlx5_core', 63, numa_node=0, speed=100000)
+    fixture.nic('eth1', 'mlx5_core', 63, numa_node=sockets - 1, speed=100000)
+    fixture.bond('bond0', ['eth0', 'eth1'])
+    disks = [ fixture.nvme(i, nvme_queues, numa_node=i * sockets // nvmes) for i in range(nvmes) ]
+    fixture.mount('/var/lib/scylla', fixture.raid('md0', disks))
+    return ['--nic', 'bond0', '--tune', 'net', '--tune', 'disks', '--dir', '/var/lib/scylla']
+
+def ixgbe(fixture, sockets=1, cores=16, threads=2, nvmes=4, nvme_queues=33):
+    """
+    A mid-size host with an Intel 10G NIC and a few NVMe drives.
+    """
+    fixture.cpus(sockets, cores, threads)
+    fixture.nic('eth0', 'ixgbe', 32, speed=10000)
+    disks = [ fixture.nvme(i, nvme_queues) for i in range(nvmes) ]
+    fixture.mount('/var/lib/scylla', fixture.raid('md0', disks))
+    return ['--nic', 'eth0', '--tune', 'net', '--tune', 'disks', '--dir', '/var/lib/scylla']
+
+def dual(fixture, sockets=2, cores=16, threads=2, nvmes=8, nvme_queues=65):
+    """
+    A host with separate client and internode Intel 25G NICs, one on each NUMA node, and NVMe drives.
+    """
+    fixture.cpus(sockets, cores, threads)
+    fixture.nic('eth0', 'i40e', 32, numa_node=0, speed=25000)
+    fixture.nic('eth1', 'i40e', 16, numa_node=sockets - 1, speed=25000)
+    disks = [ fixture.nvme(i, nvme_queues, numa_node=i * sockets // nvmes) for i in range(nvmes) ]
+    fixture.mount('/var/lib/scylla', fixture.raid('md0', disks))
+    return ['--nic', 'eth0', '--nic', 'eth1', '--tune', 'net', '--tune', 'disks', '--dir', '/var/lib/scylla']
+
+def ena(fixture, sockets=2, cores=24, threads=2, nvmes=8, nvme_queues=33):
+    """
+    An AWS i3en.24xlarge-like instance: an ENA NIC that doesn't report its speed and instance store NVMe drives.
+    """
+    fixture.cpus(sockets, cores, threads)
+    fixture.dmi(sys_vendor='Amazon EC2', product_name='i3en.24xlarge', bios_version='1.0')
+    fixture.nic('eth0', 'ena', 32, speed=-1)
+    disks = [ fixture.nvme(i, nvme_queues, numa_node=i * sockets // nvmes, model='Amazon EC2 NVMe Instance Storage') for i in range(nvmes) ]
+    fixture.mount('/var/lib/scylla', fixture.raid('md0', disks))
+    return ['--nic', 'eth0', '--tune', 'net', '--tune', 'disks', '--dir', '/var/lib/scylla']
+
+def i3(fixture, sockets=1, cores=8, threads=2, nvmes=2, nvme_queues=33):
+    """
+    An AWS i3.4xlarge-like Xen instance: an ENA NIC and instance store NVMe drives with more I/O queues than CPUs.
+    """
+    fixture.cpus(sockets, cores, threads)
+    fixture.dmi(sys_vendor='Xen', product_name='HVM domU', bios_version='4.11.amazon')
+    fixture.nic('eth0', 'ena', 8, speed=10000)
+    disks = [ fixture.nvme(i, nvme_queues, model='Amazon EC2 NVMe Instance Storage', managed=False) for i in range(nvmes) ]
+    fixture.mount('/var/lib/scylla', fixture.raid('md0', disks))
+    return ['--nic', 'eth0', '--tune', 'net', '--tune', 'disks', '--dir', '/var/lib/scylla']
+
+def virtio(fixture, sockets=1, cores=8, threads=1, nvmes=0, nvme_queues=0):
+    """
+    A GCP-like KVM guest: a multi-queue virtio-net NIC and a virtio-blk disk.
+    """
+    fixture.cpus(sockets, cores, threads)
+    fixture.dmi(sys_vendor='Google', product_name='Google Compute Engine', bios_version='Google')
+    fixture.nic('eth0', 'virtio_net', cores * threads, speed=-1)
+    fixture.mount('/var/lib/scylla', fixture.virtio_disk('vdb', cores * threads))
+    return ['--nic', 'eth0', '--tune', 'net', '--tune', 'disks', '--dir', '/var/lib/scylla']
+
+def xen(fixture, sockets=1, cores=4, threads=2, nvmes=0, nvme_queues=0):
+    """
+    A Xen guest: a netfront NIC and blkfront disks.
+    """
+    fixture.cpus(sockets, cores, threads)
+    fixture.nic('eth0', 'xen', cores * threads, speed=10000)
+    fixture.xen_disk('xvda')
+    fixture.mount('/var/lib/scylla', fixture.xen_disk('xvdb'))
+    return ['--nic', 'eth0', '--tune', 'net', '--tune', 'disks', '--dir', '/var/lib/scylla']
+
+presets = {'metal': metal, 'ixgbe': ixgbe, 'dual': dual, 'ena': ena, 'i3': i3, 'virtio': virtio, 'xen': xen}
+
+def build(root, preset, **overrides):
+    """
+    Build the given preset's tree under root (which is removed first).
+
+    :return: the perftune arguments that tune everything the preset has
+    """
+    if os.path.exists(root):
+        shutil.rmtree(root)
+
+    fixture = Fixture(root)
+    perftune_args = presets[preset](fixture, **{ key: value for key, value in overrides.items() if value is not None })
+    fixture.finish()
+    return perftune_args
+
+if __name__ == '__main__':
+    argp = argparse.ArgumentParser(description="Build a synthetic /sys, /proc, /dev and /etc tree to run perftune.py --root on.",
+                                   epilog="Presets: " + "; ".join("{} - {}".format(name, " ".join(preset.__doc__.split())) for name, preset in presets.items()))
+    argp.add_argument('root', help="the directory to build the tree in, removed first if it exists")
+    argp.add_argument('--preset', choices=list(presets.keys()), default='metal', help="the host layout, 'metal' by default")
+    argp.add_argument('--sockets', type=int, help="number of CPU sockets (NUMA nodes)")
+    argp.add_argument('--cores', type=int, help="number of cores per socket")
+    argp.add_argument('--threads', type=int, help="number of threads per core")
+    argp.add_argument('--nvmes', type=int, help="number of NVMe drives")
+    argp.add_argument('--nvme-queues', type=int, help="number of IRQs (the admin and I/O queues) per NVMe drive")
+    args = argp.parse_args()
+
+    perftune_args = build(args.root, args.preset, sockets=args.sockets, cores=args.cores, threads=args.threads, nvmes=args.nvmes, nvme_queues=args.nvme_queues)
+    print("perftune.py --root {} {}".format(os.path.abspath(args.root), " ".join(perftune_args)))
+    sys.exit(0)
@@ -32,25 +32,51 @@
 
 #Original of below is in Scylla repo, this is just for ansible purposes
 # https://github.com/scylladb/scylla/blob/master/dist/common/scripts/scylla_util.py#L568
+#
+# CpuMask is cut down to the conversions of perftune.py's CpuMask (ansible-scylla-common/module_utils/perftune.py)
+# since this script is copied to the nodes on its own - keep them in sync.
+
+class CpuMask:
+    """
+    A set of CPUs backed by a single integer bitmap: bit N is set iff CPU N belongs to the set.
+    """
+    __slots__ = ('__bits',)
+
+    def __init__(self, bits=0):
+        if bits < 0:
+            raise ValueError("CPU mask can't be negative: {}".format(bits))
+        self.__bits = bits
+
+    @staticmethod
+    def from_mask_str(mask_str):
+        bits = 0
+        for word in mask_str.strip().split(','):
+            word = word.strip()
+            if word[:2] in ('0x', '0X'):
+                word = word[2:]
+
+            bits = (bits << 32) | (int(word, 16) if word else 0)
+
+        return CpuMask(bits)
+
+    def to_list_str(self):
+        """
+        Return the "List Format" string, e.g. 1,5-6,11-13,17-19.
+        """
+        ranges = []
+        bits = self.__bits
+        while bits:
+            first = (bits & -bits).bit_length() - 1
+            shifted = bits >> first
+            # the lowest zero bit of the shifted value terminates the run of ones
+            run_len = ((shifted + 1) & ~shifted).bit_length() - 1
+            last = first + run_len - 1
+            ranges.append(str(first) if first == last else "{}-{}".format(first, last))
+            bits &= ~(((1 << run_len) - 1) << first)
+
+        return ",".join(ranges)
 
 def hex2list(hex_str):
-    hex_str2 = hex_str.replace("0x", "").replace(",", "")
-    hex_int = int(hex_str2, 16)
-    bin_str = "{0:b}".format(hex_int)
-    bin_len = len(bin_str)
-    cpu_list = []
-    i = 0
-    while i < bin_len:
-        if 1 << i & hex_int:
-            j = i
-            while j + 1 < bin_len and 1 << j + 1 & hex_int:
-                j += 1
-            if j == i:
-                cpu_list.append(str(i))
-            else:
-                cpu_list.append("{0}-{1}".format(i, j))
-                i = j
-        i += 1
-    return ",".join(cpu_list)
+    return CpuMask.from_mask_str(hex_str).to_list_str()
 
 print(hex2list(input()))